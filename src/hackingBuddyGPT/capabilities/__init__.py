@@ -1,11 +1,14 @@
-from .capability import Capability
+from .batch_test_credential import BatchTestCredential
+from .capability import Capability, CapabilityRegistry
 from .psexec_run_command import PSExecRunCommand
 from .psexec_test_credential import PSExecTestCredential
 from .ssh_run_command import SSHRunCommand
 from .ssh_test_credential import SSHTestCredential
 
 __all__ = [
+    "BatchTestCredential",
     "Capability",
+    "CapabilityRegistry",
     "PSExecRunCommand",
     "PSExecTestCredential",
     "SSHRunCommand",
@@ -0,0 +1,97 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Optional, Tuple
+
+from .capability import Capability
+
+
+class HostRateLimiter:
+    """Spaces out the start of login attempts against a single host, so that at most `rate` attempts start per second."""
+
+    def __init__(self, rate: float):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+# shared between all capabilities, so that two agents testing credentials against the same host do not add up
+_host_limiters: dict[tuple[str, float], HostRateLimiter] = {}
+_host_limiters_lock = threading.Lock()
+
+
+def rate_limiter_for(host: str, rate: float) -> HostRateLimiter:
+    with _host_limiters_lock:
+        return _host_limiters.setdefault((host, rate), HostRateLimiter(rate))
+
+
+@dataclass
+class BatchTestCredential(Capability):
+    """
+    Tests a list of credentials at once with an existing single-credential capability (SSHTestCredential or
+    PSExecTestCredential), so that a whole credentials file can be checked in one turn.
+    """
+
+    test_credential: Capability
+    max_workers: int = 4
+    attempts_per_second: float = 2.0  # per host, 0 for no limit
+
+    _limiter: Optional[HostRateLimiter] = field(init=False, repr=False, default=None)
+
+    def __post_init__(self):
+        self._limiter = rate_limiter_for(self.test_credential.conn.host, self.attempts_per_second)
+
+    def describe(self) -> str:
+        return "give a list of credentials to be tested at once, as space separated username:password pairs. Testing stops at the first successful login as root."
+
+    def get_name(self) -> str:
+        return "test_credentials"
+
+    def __call__(self, credentials: str) -> Tuple[str, bool]:
+        pairs = []
+        for candidate in credentials.split():
+            username, separator, password = candidate.partition(":")
+            if not separator or not username:
+                return f"Invalid credentials '{candidate}', expected username:password\n", False
+            pairs.append((username, password))
+        if not pairs:
+            return "No credentials given\n", False
+
+        results: dict[int, str] = {}
+        got_root = threading.Event()
+
+        def test(index: int) -> bool:
+            self._limiter.wait()
+            if got_root.is_set():
+                return False
+            try:
+                result, is_root = self.test_credential(*pairs[index])
+            except Exception as e:
+                result, is_root = f"Error while testing: {e}", False
+            results[index] = result.strip()
+            if is_root:
+                got_root.set()
+            return is_root
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(test, index) for index in range(len(pairs))}
+            while pending and not got_root.is_set():
+                _, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in pending:
+                future.cancel()
+
+        width = max(len(f"{username}:{password}") for username, password in pairs)
+        lines = [
+            f"{f'{username}:{password}':<{width}}  {results.get(index, 'not tested, root login already found')}"
+            for index, (username, password) in enumerate(pairs)
+        ]
+        return "\n".join(lines) + "\n", got_root.is_set()
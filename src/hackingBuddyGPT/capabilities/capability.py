@@ -1,6 +1,6 @@
 import abc
 import inspect
-from typing import Any, Callable, Dict, Iterable, Type, Union
+from typing import Any, Callable, Dict, Iterable, Optional, Type, Union
 
 import openai
 from openai.types.chat import ChatCompletionToolParam
@@ -85,6 +85,9 @@ def capabilities_to_action_model(capabilities: Dict[str, Capability]) -> Type[Ac
     the model returned from here.
     """
 
+    if isinstance(capabilities, CapabilityRegistry):
+        return capabilities.action_model()
+
     class Model(Action):
         action: Union[tuple([capability.to_model() for capability in capabilities.values()])]
 
@@ -211,6 +214,9 @@ def capabilities_to_tools(
     This function takes a dictionary of capabilities and returns a dictionary of functions, that can be called with the
     parameters of the respective capabilities.
     """
+    if isinstance(capabilities, CapabilityRegistry):
+        return capabilities.tools()
+
     return [
         ChatCompletionToolParam(
             type="function",
@@ -222,3 +228,99 @@ def capabilities_to_tools(
         )
         for name, capability in capabilities.items()
     ]
+
+
+class CapabilityRegistry(dict):
+    """
+    The capabilities of an agent by name, which compiles everything that is derived from them (the simple text handler
+    with its descriptions and parsers, the pydantic models and the tool schemas) only once instead of every round.
+
+    All of that only depends on which capabilities are registered, so any change to the registry drops the compiled
+    results and they are rebuilt on their next use.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._invalidate()
+
+    def _invalidate(self):
+        self._text_handlers: Dict[tuple[int, bool], tuple[Optional[Capability], tuple[Dict[str, str], SimpleTextHandler]]] = {}
+        self._models: Dict[int, tuple[Capability, Type[BaseModel]]] = {}
+        self._tools: Optional[list[ChatCompletionToolParam]] = None
+        self._action_model: Optional[Type[Action]] = None
+
+    def __setitem__(self, name: str, capability: Capability):
+        super().__setitem__(name, capability)
+        self._invalidate()
+
+    def __delitem__(self, name: str):
+        super().__delitem__(name)
+        self._invalidate()
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._invalidate()
+
+    def setdefault(self, name: str, capability: Capability = None) -> Capability:
+        if name not in self:
+            self[name] = capability
+        return self[name]
+
+    def pop(self, name: str, *default) -> Capability:
+        result = super().pop(name, *default)
+        self._invalidate()
+        return result
+
+    def popitem(self) -> tuple[str, Capability]:
+        result = super().popitem()
+        self._invalidate()
+        return result
+
+    def clear(self):
+        super().clear()
+        self._invalidate()
+
+    def simple_text_handler(self, default_capability: Capability = None, include_description: bool = True) -> tuple[Dict[str, str], SimpleTextHandler]:
+        """Cached version of `capabilities_to_simple_text_handler` for this registry."""
+        key = (id(default_capability), include_description)
+        if key not in self._text_handlers:
+            handler = capabilities_to_simple_text_handler(self, default_capability, include_description)
+            # the default capability is kept alongside, so that its id can not be reused while the entry exists
+            self._text_handlers[key] = (default_capability, handler)
+        return self._text_handlers[key][1]
+
+    def model(self, capability: Capability) -> Type[BaseModel]:
+        """Cached version of `capability.to_model()`, for a capability of this registry or the default capability."""
+        key = id(capability)
+        if key not in self._models:
+            self._models[key] = (capability, capability.to_model())
+        return self._models[key][1]
+
+    def tools(self) -> list[ChatCompletionToolParam]:
+        if self._tools is None:
+            self._tools = [
+                ChatCompletionToolParam(
+                    type="function",
+                    function=Function(
+                        name=name,
+                        description=capability.describe(),
+                        parameters=self.model(capability).model_json_schema(),
+                    ),
+                )
+                for name, capability in self.items()
+            ]
+        return self._tools
+
+    def action_model(self) -> Type[Action]:
+        if self._action_model is None:
+            models = tuple(self.model(capability) for capability in self.values())
+
+            class Model(Action):
+                action: Union[models]
+
+            self._action_model = Model
+        return self._action_model
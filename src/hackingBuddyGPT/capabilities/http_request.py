@@ -1,9 +1,12 @@
 import base64
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from http.cookiejar import DefaultCookiePolicy
 from typing import Dict, Literal, Optional
 
 import requests
 
+from hackingBuddyGPT.utils.http_pool import create_session
+
 from . import Capability
 
 
@@ -12,12 +15,18 @@ class HTTPRequest(Capability):
     host: str
     follow_redirects: bool = False
     use_cookie_jar: bool = True
+    connect_timeout: float = 10
+    read_timeout: float = 30
+    max_response_size: int = 64 * 1024  # bytes of the response body that are returned, the rest is cut off
+    pool_size: int = 10
 
-    _client = requests.Session()
+    _client: requests.Session = field(init=False, repr=False, default=None)
 
     def __post_init__(self):
+        # every capability instance gets its own pool of connections (and cookie jar) to its host
+        self._client = create_session(pool_size=self.pool_size)
         if not self.use_cookie_jar:
-            self._client = requests
+            self._client.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
 
     def describe(self) -> str:
         description = (
@@ -34,6 +43,7 @@ class HTTPRequest(Capability):
             description += "\nRedirects are followed."
         else:
             description += "\nRedirects are not followed."
+        description += f"\nResponse bodies are cut off after {self.max_response_size} bytes."
         return description
 
     def __call__(
@@ -49,28 +59,37 @@ class HTTPRequest(Capability):
             body = base64.b64decode(body).decode()
         if self.host[-1] != "/":
             path = "/" + path
-        resp = self._client.request(
-            method,
-            self.host + path,
-            params=query,
-            data=body,
-            headers=headers,
-            allow_redirects=self.follow_redirects,
-        )
+        url = self.host + path
         try:
             resp = self._client.request(
                 method,
-                self.host + path,
+                url,
                 params=query,
                 data=body,
                 headers=headers,
                 allow_redirects=self.follow_redirects,
+                timeout=(self.connect_timeout, self.read_timeout),
+                stream=True,
             )
+            with resp:
+                content, truncated = self._read_body(resp)
         except requests.exceptions.RequestException as e:
             url = self.host + ("" if path.startswith("/") else "/") + path + (f"?{query}" if query else "")
             return f"Could not request '{url}': {e}"
 
         response_headers = "\r\n".join(f"{k}: {v}" for k, v in resp.headers.items())
+        text = content.decode(resp.encoding or "utf-8", errors="replace")
+        if truncated:
+            text += f"\n[response body truncated after {self.max_response_size} bytes]"
 
         # turn the response into "plain text format" for responding to the prompt
-        return f"HTTP/1.1 {resp.status_code} {resp.reason}\r\n{response_headers}\r\n\r\n{resp.text}"
+        return f"HTTP/1.1 {resp.status_code} {resp.reason}\r\n{response_headers}\r\n\r\n{text}"
+
+    def _read_body(self, resp: requests.Response) -> tuple[bytes, bool]:
+        """Reads at most max_response_size bytes of the body, the rest is never downloaded."""
+        content = bytearray()
+        for chunk in resp.iter_content(chunk_size=8192):
+            content += chunk
+            if len(content) > self.max_response_size:
+                return bytes(content[:self.max_response_size]), True
+        return bytes(content), False
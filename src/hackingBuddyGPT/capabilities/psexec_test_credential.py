@@ -18,8 +18,8 @@ class PSExecTestCredential(Capability):
         return "test_credential"
 
     def __call__(self, username: str, password: str) -> Tuple[str, bool]:
+        test_conn = self.conn.new_with(username=username, password=password)
         try:
-            test_conn = self.conn.new_with(username=username, password=password)
             test_conn.init()
             warnings.warn(
                 message="full credential testing is not implemented yet for psexec, we have logged in, but do not know who we are, returning True for now",
@@ -28,3 +28,5 @@ class PSExecTestCredential(Capability):
             return "Login as root was successful\n", True
         except Exception:
             return "Authentication error, credentials are wrong\n", False
+        finally:
+            test_conn.close()
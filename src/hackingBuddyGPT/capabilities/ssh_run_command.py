@@ -1,12 +1,14 @@
 import re
 from dataclasses import dataclass
 from io import StringIO
-from typing import Tuple
+from typing import Optional, Tuple
 
 from invoke import Responder
 
 from hackingBuddyGPT.utils import SSHConnection
+from hackingBuddyGPT.utils.logging import Logger
 from hackingBuddyGPT.utils.shell_root_detection import got_root
+from hackingBuddyGPT.utils.ssh_connection.capped_output import CappedOutput
 
 from .capability import Capability
 
@@ -15,6 +17,10 @@ from .capability import Capability
 class SSHRunCommand(Capability):
     conn: SSHConnection
     timeout: int = 10
+    log: Optional[Logger] = None  # truncated outputs are reported here
+    max_output_bytes: int = 1024 * 1024  # the command is stopped once it wrote more than this (0 for no limit)
+    max_output_lines: int = 20000  # the command is stopped once it wrote more lines than this (0 for no limit)
+    keep_output_bytes: int = 64 * 1024  # of longer outputs, only the first and last half of this is kept
 
     def describe(self) -> str:
         return "give a command to be executed and I will respond with the terminal output when running this command over SSH on the linux machine. The given command must not require user interaction. Do not use quotation marks in front and after your command."
@@ -30,33 +36,28 @@ class SSHRunCommand(Capability):
             else:
                 command = cmd_parts[1]
 
-        sudo_pass = Responder(
-            pattern=r"\[sudo\] password for " + self.conn.username + ":",
-            response=self.conn.password + "\n",
-        )
+        timeout = self.timeout
+        # Check if the command contains "sleep" and adjust the timeout accordingly
+        if "sleep" in command:
+            sleep_time = re.search(r"\bsleep\s+(\d+)", command)
+            if sleep_time:
+                sleep_time = int(sleep_time.group(1))
+                timeout = sleep_time + 5
 
-        out = StringIO()
+        out = CappedOutput(self.max_output_bytes, self.max_output_lines, self.keep_output_bytes)
+        if self.conn.use_shell_session:
+            self._run_in_session(command, timeout, out)
+        else:
+            self._run(command, timeout, out)
+        output = out.getvalue()
 
-        try:
-            timeout = self.timeout
-
-            # Check if the command contains "sleep" and adjust the timeout accordingly
-            if "sleep" in command:
-                sleep_time = re.search(r"\bsleep\s+(\d+)", command)
-                if sleep_time:
-                    sleep_time = int(sleep_time.group(1))
-                    timeout = sleep_time + 5
-            
-            # avoids terminal control codes that can break the output
-            command = "TERM=dumb " + command
+        stats = out.stats()
+        if stats is not None and self.log is not None:
+            self.log.status_message(f"output of `{command}` was truncated: {stats}")
 
-            self.conn.run(command, pty=True, warn=True, out_stream=out, watchers=[sudo_pass], timeout=timeout)
-        except Exception:
-            print("TIMEOUT! Could we have become root?")
-        out.seek(0)
         tmp = ""
         last_line = ""
-        for line in out.readlines():
+        for line in StringIO(output).readlines():
             if not line.startswith("[sudo] password for " + self.conn.username + ":"):
                 line.replace("\r", "")
                 last_line = line
@@ -67,3 +68,25 @@ class SSHRunCommand(Capability):
         last_line = ansi_escape.sub("", last_line)
 
         return tmp, got_root(self.conn.hostname, last_line)
+
+    def _run(self, command: str, timeout: int, out: CappedOutput):
+        sudo_pass = Responder(
+            pattern=r"\[sudo\] password for " + self.conn.username + ":",
+            response=self.conn.password + "\n",
+        )
+
+        try:
+            # avoids terminal control codes that can break the output
+            command = "TERM=dumb " + command
+
+            # the output is also passed as watcher, which aborts the command once it produced too much output
+            self.conn.run(command, pty=True, warn=True, out_stream=out, watchers=[sudo_pass, out], timeout=timeout)
+        except Exception:
+            if not out.exceeded:
+                print("TIMEOUT! Could we have become root?")
+
+    def _run_in_session(self, command: str, timeout: int, out: CappedOutput):
+        _, exit_code = self.conn.shell().run(command, timeout, out)
+        if exit_code is None and not out.exceeded:
+            # whatever is reading from the terminal now printed its prompt last, which is what root detection looks at
+            print("TIMEOUT! Could we have become root?")
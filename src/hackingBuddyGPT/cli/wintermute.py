@@ -1,17 +1,27 @@
 import argparse
 import sys
 
-from hackingBuddyGPT.usecases.base import use_cases
+from hackingBuddyGPT.usecases.registry import available_use_cases, load_use_case
 from hackingBuddyGPT.utils.configurable import CommandMap, InvalidCommand, Parseable, instantiate
 
 
+def use_case_parsers(selected: str) -> CommandMap:
+    """
+    All use cases by name, where only the selected one is loaded (and can be parsed), the others are just listed with
+    their description in the help.
+    """
+    use_cases = available_use_cases()
+    parsers: CommandMap = dict(use_cases)
+    if selected in use_cases:
+        use_case = load_use_case(selected)
+        parsers[selected] = Parseable(use_case, description=use_case.description)
+    return parsers
+
+
 def main():
-    use_case_parsers: CommandMap = {
-        name: Parseable(use_case, description=use_case.description)
-        for name, use_case in use_cases.items()
-    }
+    selected = sys.argv[1] if len(sys.argv) > 1 else None
     try:
-        instance, configuration = instantiate(sys.argv, use_case_parsers)
+        instance, configuration = instantiate(sys.argv, use_case_parsers(selected))
     except InvalidCommand as e:
         if len(f"{e}") > 0:
             print(e)
@@ -51,6 +51,9 @@
     });
   });
 
+  // number of messages of a run that are requested at once, the following pages are requested as the batches arrive
+  const PAGE_SIZE = 500;
+
   let ws = null;
   let currentRun = null;
 
@@ -85,6 +88,11 @@
         const {type, data} = message;
 
         const wasAtBottom = isScrollAtBottom();
+        handleControlMessage(type, data);
+        scrollUpdate(wasAtBottom);
+      });
+
+      function handleControlMessage(type, data) {
         switch (type) {
           case "Run":
             handleRunMessage(data);
@@ -104,11 +112,28 @@
           case "ToolCallStreamPart":
             handleToolCallStreamPart(data);
             break;
+          case "Batch":
+            handleBatch(data);
+            break;
           default:
             console.warn("Unknown message type:", type);
         }
-        scrollUpdate(wasAtBottom);
-      });
+      }
+
+      function handleBatch(batch) {
+        // a page of a run that was switched away from while it was on its way
+        if (batch.run_id !== currentRun) {
+          return;
+        }
+        batch.records.forEach((record) => handleControlMessage(record.type, record.data));
+        if (batch.next_message !== null) {
+          send("MessageRequest", {
+            follow_run: batch.run_id,
+            from_message: batch.next_message,
+            limit: PAGE_SIZE,
+          });
+        }
+      }
 
       function createRunListEntry(runId) {
         const runList = document.getElementById("run-list");
@@ -290,6 +315,9 @@
       }
 
       function handleToolCall(toolCall) {
+        if (!document.getElementById(`message-${toolCall.message_id}`)) {
+          addMessageDiv(toolCall.message_id);
+        }
         let toolCallDiv = document.getElementById(
             `message-${toolCall.message_id}-tool-call-${toolCall.id}`,
         );
@@ -336,7 +364,7 @@
         document.getElementById("messages").innerHTML = "";
         sectionColumns = [];
         document.documentElement.style.setProperty("--section-column-count", 0);
-        send("MessageRequest", {follow_run: runId});
+        send("MessageRequest", {follow_run: runId, from_message: 0, limit: PAGE_SIZE});
         currentRun = runId;
         // set hash to runId via pushState
         window.location.hash = runId;
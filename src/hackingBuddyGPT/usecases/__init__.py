@@ -1,7 +1,17 @@
-from .examples import *
-from .privesc import *
-from .web import *
-from .web_api_testing import *
-from .viewer import *
-from .rag import *
-from .reasoning import *
\ No newline at end of file
+# The use cases are not imported here, as that would import the dependencies of all of them whenever any one is used,
+# see registry.py. Names that used to be re-exported from here are still available, but imported on first access.
+import importlib
+import importlib.util
+
+_REEXPORTED_FROM = ["examples", "privesc", "web", "web_api_testing", "viewer", "rag", "reasoning"]
+
+
+def __getattr__(name: str):
+    if name.startswith("_") or importlib.util.find_spec(f"{__name__}.{name}") is not None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    for submodule in _REEXPORTED_FROM:
+        module = importlib.import_module(f"{__name__}.{submodule}")
+        if hasattr(module, name):
+            return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
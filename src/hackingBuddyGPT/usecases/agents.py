@@ -2,28 +2,27 @@ import datetime
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 from mako.template import Template
-from typing import Dict
 
 from hackingBuddyGPT.utils.logging import log_conversation, Logger, log_param
-from hackingBuddyGPT.capabilities.capability import (
-    Capability,
-    capabilities_to_simple_text_handler,
-)
+from hackingBuddyGPT.capabilities.capability import Capability, CapabilityRegistry
 from hackingBuddyGPT.utils import llm_util
-from hackingBuddyGPT.utils.openai.openai_llm import OpenAIConnection
+from hackingBuddyGPT.utils.llm_cache import CachedLLM, LLMCache, LLMCacheChoice, llm_cache_param
+from hackingBuddyGPT.utils.openai.openai_llm import OpenAICompatibleLLM, llm_param
 
 
 @dataclass
 class Agent(ABC):
     log: Logger = log_param
 
-    _capabilities: Dict[str, Capability] = field(default_factory=dict)
+    _capabilities: CapabilityRegistry = field(default_factory=CapabilityRegistry)
     _default_capability: Capability = None
 
-    llm: OpenAIConnection = None
+    llm: OpenAICompatibleLLM = llm_param
+    llm_cache: LLMCacheChoice = llm_cache_param
 
-    def init(self):  # noqa: B027
-        pass
+    def init(self):
+        if isinstance(self.llm_cache, LLMCache):
+            self.llm = CachedLLM(self.llm, self.llm_cache)
 
     def before_run(self):  # noqa: B027
         pass
@@ -51,7 +50,7 @@ class Agent(ABC):
 
         tic = datetime.datetime.now()
         try:
-            result = capability.to_model().model_validate_json(arguments).execute()
+            result = self._capabilities.model(capability).model_validate_json(arguments).execute()
         except Exception as e:
             result = f"EXCEPTION: {e}"
         duration = datetime.datetime.now() - tic
@@ -60,7 +59,7 @@ class Agent(ABC):
         return result
 
     def run_capability_simple_text(self, message_id: int, cmd: str) -> tuple[str, str, str, bool]:
-        _capability_descriptions, parser = capabilities_to_simple_text_handler(self._capabilities, default_capability=self._default_capability)
+        _capability_descriptions, parser = self._capabilities.simple_text_handler(default_capability=self._default_capability)
 
         tic = datetime.datetime.now()
         try:
@@ -80,7 +79,7 @@ class Agent(ABC):
         return capability, cmd, result, got_root
 
     def get_capability_block(self) -> str:
-        capability_descriptions, _parser = capabilities_to_simple_text_handler(self._capabilities)
+        capability_descriptions, _parser = self._capabilities.simple_text_handler()
         return "You can either\n\n" + "\n".join(f"- {description}" for description in capability_descriptions.values())
 
 
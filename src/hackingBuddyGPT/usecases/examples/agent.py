@@ -25,7 +25,7 @@ class ExPrivEscLinux(Agent):
         self._sliding_history = SlidingCliHistory(self.llm)
         self._max_history_size = self.llm.context_size - llm_util.SAFETY_MARGIN - self.llm.count_tokens(template_next_cmd.source)
 
-        self.add_capability(SSHRunCommand(conn=self.conn), default=True)
+        self.add_capability(SSHRunCommand(conn=self.conn, log=self.log), default=True)
         self.add_capability(SSHTestCredential(conn=self.conn))
 
     @log_conversation("Asking LLM for a new command...")
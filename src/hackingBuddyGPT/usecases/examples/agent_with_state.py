@@ -37,7 +37,7 @@ class ExPrivEscLinuxTemplated(TemplatedAgent):
         self.set_template(str(pathlib.Path(__file__).parent / "next_cmd.txt"))
 
         # setup capabilities
-        self.add_capability(SSHRunCommand(conn=self.conn), default=True)
+        self.add_capability(SSHRunCommand(conn=self.conn, log=self.log), default=True)
         self.add_capability(SSHTestCredential(conn=self.conn))
 
         # setup state
@@ -6,7 +6,7 @@ from hackingBuddyGPT.capabilities import SSHRunCommand
 from hackingBuddyGPT.usecases.base import UseCase, use_case
 from hackingBuddyGPT.usecases.privesc.linux import LinuxPrivesc, LinuxPrivescUseCase
 from hackingBuddyGPT.utils import SSHConnection
-from hackingBuddyGPT.utils.openai.openai_llm import OpenAIConnection
+from hackingBuddyGPT.utils.openai.openai_llm import OpenAICompatibleLLM, llm_param
 
 template_dir = pathlib.Path(__file__).parent
 template_lse = Template(filename=str(template_dir / "get_hint_from_lse.txt"))
@@ -19,7 +19,7 @@ class ExPrivEscLinuxLSEUseCase(UseCase):
     enable_explanation: bool = False
     enable_update_state: bool = False
     disable_history: bool = False
-    llm: OpenAIConnection = None
+    llm: OpenAICompatibleLLM = llm_param
 
     _got_root: bool = False
 
@@ -0,0 +1,249 @@
+import contextlib
+import json
+import multiprocessing
+import os
+import pathlib
+import traceback
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+from hackingBuddyGPT.usecases.base import UseCase, use_case
+from hackingBuddyGPT.usecases.registry import load_use_case
+from hackingBuddyGPT.utils.configurable import Parseable, instantiate, parameter
+from hackingBuddyGPT.utils.db_storage import DbStorage
+from hackingBuddyGPT.utils.logging import GlobalLocalLogger
+
+# the axes of the experiment matrix, each maps a label to the parameters that are set for it
+AXES = ("scenarios", "models", "hints")
+
+
+@dataclass
+class ExperimentRun:
+    experiment: str
+    scenario: str
+    model: str
+    hint: str
+    repetition: int
+    parameters: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def tag(self) -> str:
+        return f"{self.experiment}/{self.scenario}/{self.model}/{self.hint}/{self.repetition}"
+
+    @property
+    def endpoint(self) -> str:
+        return str(self.parameters.get("llm.api_url", ""))
+
+    @property
+    def host(self) -> str:
+        return str(self.parameters.get("conn.host", ""))
+
+    def arguments(self) -> list[str]:
+        arguments = []
+        for key, value in self.parameters.items():
+            if isinstance(value, bool):
+                # boolean parameters are parsed with bool(), so only the empty string is False
+                value = "True" if value else ""
+            arguments.append(f"--{key}={value}")
+        return arguments
+
+
+def flatten_parameters(parameters: Dict[str, Any], prefix: str = "") -> Dict[str, Any]:
+    """Turns nested parameters ({"conn": {"host": ...}}) into the dotted form of the command line ({"conn.host": ...})."""
+    flat = {}
+    for key, value in parameters.items():
+        if isinstance(value, dict):
+            flat.update(flatten_parameters(value, f"{prefix}{key}."))
+        else:
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def expand_matrix(experiment: str, matrix: Dict[str, Any]) -> list[ExperimentRun]:
+    """
+    Returns one run for every combination of scenario, model, hint and repetition. An axis that is not given in the
+    matrix has a single entry without parameters.
+
+    The repetitions are the outermost loop, so that a partially finished experiment has results for every combination.
+    """
+    common = flatten_parameters(matrix.get("parameters", {}))
+    axes = [matrix.get(axis) or {"default": {}} for axis in AXES]
+
+    runs = []
+    for repetition in range(1, matrix.get("repetitions", 1) + 1):
+        for scenario, scenario_parameters in axes[0].items():
+            for model, model_parameters in axes[1].items():
+                for hint, hint_parameters in axes[2].items():
+                    parameters = dict(common)
+                    parameters.update(flatten_parameters(scenario_parameters))
+                    parameters.update(flatten_parameters(model_parameters))
+                    parameters.update(flatten_parameters(hint_parameters))
+                    runs.append(ExperimentRun(experiment, scenario, model, hint, repetition, parameters))
+    return runs
+
+
+def schedule_runs(
+    runs: list[ExperimentRun],
+    start: Callable[[ExperimentRun], Future],
+    on_done: Callable[[ExperimentRun, Future], None],
+    max_concurrent_runs: int,
+    max_runs_per_endpoint: int = 0,
+    max_runs_per_host: int = 0,
+):
+    """
+    Starts the runs in order, as long as there are less than max_concurrent_runs running and neither the LLM endpoint nor
+    the target host of a run already has its maximum number of runs (0 means no limit). Runs that have to wait do not
+    block later runs for other endpoints and hosts.
+    """
+    pending = list(runs)
+    running: Dict[Future, ExperimentRun] = {}
+    endpoints: Counter = Counter()
+    hosts: Counter = Counter()
+
+    def can_start(run: ExperimentRun) -> bool:
+        if max_runs_per_endpoint and endpoints[run.endpoint] >= max_runs_per_endpoint:
+            return False
+        return not (max_runs_per_host and hosts[run.host] >= max_runs_per_host)
+
+    while pending or running:
+        waiting = []
+        for run in pending:
+            if len(running) >= max_concurrent_runs or not can_start(run):
+                waiting.append(run)
+                continue
+            running[start(run)] = run
+            endpoints[run.endpoint] += 1
+            hosts[run.host] += 1
+        pending = waiting
+
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            run = running.pop(future)
+            endpoints[run.endpoint] -= 1
+            hosts[run.host] -= 1
+            on_done(run, future)
+
+
+def execute_run(use_case_name: str, arguments: list[str], output_file: Optional[str] = None) -> tuple[str, Optional[str]]:
+    """
+    Runs a single run of an experiment, just like `wintermute <use_case_name> <arguments>` would, and returns its result
+    ("got root", "no root" or "failed") together with the error of a failed run. This is executed in the worker
+    processes, which stay alive for many runs.
+
+    Exceptions are not raised to the parent process, as not all of them can be unpickled there (an exception that
+    cannot be unpickled breaks the whole process pool), their traceback is written to the output of the run instead.
+    """
+    with contextlib.ExitStack() as stack:
+        if output_file is not None:
+            output = stack.enter_context(open(output_file, "w"))
+            stack.enter_context(contextlib.redirect_stdout(output))
+            stack.enter_context(contextlib.redirect_stderr(output))
+
+        try:
+            use_case = load_use_case(use_case_name)
+            instance, configuration = instantiate(
+                ["experiment", use_case_name, *arguments],
+                {use_case_name: Parseable(use_case, description=use_case.description)},
+            )
+        except Exception as e:
+            traceback.print_exc()
+            return "failed", f"{type(e).__name__}: {e}"
+
+        try:
+            return ("got root" if instance.run(configuration) else "no root"), None
+        except Exception as e:
+            traceback.print_exc()
+            return "failed", f"{type(e).__name__}: {e}"
+        finally:
+            # every run has its own connection to the database, the writer thread has to be stopped before the next one
+            log_db = getattr(instance.log, "log_db", None)
+            if log_db is not None:
+                log_db.close()
+                log_db.db.close()
+
+
+@use_case("Runs all combinations of scenarios, models and hints of another use case in parallel")
+class Experiment(UseCase):
+    """
+    The experiment file is a JSON file like the following, where all parameters are given as on the command line of the
+    use case (either dotted or nested):
+
+        {
+            "use_case": "LinuxPrivesc",
+            "repetitions": 10,
+            "parameters": {"conn.username": "lowpriv", "conn.password": "trustno1", "max_turns": 20},
+            "scenarios": {"05_vuln_sudo_gtfo": {"conn.host": "192.168.122.151", "conn.port": 5005}},
+            "models": {"gpt-4o": {"llm.model": "gpt-4o", "llm.api_url": "https://api.openai.com", "llm.context_size": 128000}},
+            "hints": {"unguided": {}, "hint": {"hint": "check the sudo permissions"}}
+        }
+
+    All runs are logged into the database of this use case, tagged with `<name>/<scenario>/<model>/<hint>/<repetition>`.
+    """
+
+    log: GlobalLocalLogger = None
+    log_db: DbStorage = None
+    experiment_file: str = parameter(desc="JSON file that describes the matrix of runs", default="experiment.json")
+    name: str = parameter(desc="Name of the experiment that the runs are tagged with (default: name of the experiment file)", default="")
+    max_concurrent_runs: int = parameter(desc="Number of runs that are executed in parallel (one worker process each)", default=4)
+    max_runs_per_endpoint: int = parameter(desc="Maximum number of parallel runs that use the same LLM api_url (0 for no limit)", default=2)
+    max_runs_per_host: int = parameter(desc="Maximum number of parallel runs against the same target host (0 for no limit)", default=1)
+    resume: bool = parameter(desc="Skip runs that were already finished by an earlier execution of the experiment", default=True)
+    output_dir: str = parameter(desc="Directory for the console output of the runs", default="logs")
+
+    def get_name(self) -> str:
+        return "experiment"
+
+    def finished_tags(self) -> set[str]:
+        """Tags of all runs of this experiment that ended, runs that are still "in progress" were interrupted."""
+        prefix = f"{self.name}/"
+        return {run.tag for run in self.log_db.get_runs() if run.tag.startswith(prefix) and run.state != "in progress"}
+
+    def run(self, configuration):
+        with open(self.experiment_file) as f:
+            matrix = json.load(f)
+        if not self.name:
+            self.name = pathlib.Path(self.experiment_file).stem
+
+        runs = expand_matrix(self.name, matrix)
+        if self.resume:
+            finished = self.finished_tags()
+            skipped = len(runs)
+            runs = [run for run in runs if run.tag not in finished]
+            skipped -= len(runs)
+            if skipped:
+                self.log.console.print(f"Skipping {skipped} runs that were already finished")
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.log.console.print(f"Starting {len(runs)} runs of {matrix['use_case']} with up to {self.max_concurrent_runs} in parallel")
+
+        results = Counter()
+
+        def start(run: ExperimentRun) -> Future:
+            arguments = [
+                *run.arguments(),
+                "--log=local_logger",
+                f"--log_db.connection_string={self.log_db.connection_string}",
+                f"--log.tag={run.tag}",
+            ]
+            output_file = os.path.join(self.output_dir, run.tag.replace("/", "_") + ".log")
+            return executor.submit(execute_run, matrix["use_case"], arguments, output_file)
+
+        def on_done(run: ExperimentRun, future: Future):
+            if future.exception() is not None:
+                result, error = "failed", str(future.exception())
+            else:
+                result, error = future.result()
+            results[result] += 1
+            if error is not None:
+                self.log.console.print(f"[red]{run.tag} failed: {error}")
+            else:
+                self.log.console.print(f"{run.tag}: {result}")
+
+        # spawned workers do not inherit the threads (and locks) of this process, like the database writer
+        with ProcessPoolExecutor(max_workers=self.max_concurrent_runs, mp_context=multiprocessing.get_context("spawn")) as executor:
+            schedule_runs(runs, start, on_done, self.max_concurrent_runs, self.max_runs_per_endpoint, self.max_runs_per_host)
+
+        self.log.console.print(f"Experiment {self.name} finished: {dict(results)}")
+        return results
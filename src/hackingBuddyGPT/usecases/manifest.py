@@ -0,0 +1,22 @@
+"""
+Generated by `python -m hackingBuddyGPT.usecases.registry`, do not edit.
+
+Maps the name of every use case to the module that registers it and its description, see registry.py.
+"""
+
+USE_CASES = {
+    'ExPrivEscLinux': ('hackingBuddyGPT.usecases.examples.agent', 'Showcase Minimal Linux Priv-Escalation'),
+    'ExPrivEscLinuxHintFile': ('hackingBuddyGPT.usecases.examples.hintfile', 'Linux Privilege Escalation using hints from a hint file initial guidance'),
+    'ExPrivEscLinuxLSE': ('hackingBuddyGPT.usecases.examples.lse', 'Linux Privilege Escalation using lse.sh for initial guidance'),
+    'ExPrivEscLinuxTemplated': ('hackingBuddyGPT.usecases.examples.agent_with_state', 'Showcase Minimal Linux Priv-Escalation'),
+    'Experiment': ('hackingBuddyGPT.usecases.experiment', 'Runs all combinations of scenarios, models and hints of another use case in parallel'),
+    'LinuxPrivesc': ('hackingBuddyGPT.usecases.privesc.linux', 'Linux Privilege Escalation'),
+    'ReasoningLinuxPrivesc': ('hackingBuddyGPT.usecases.reasoning.linux', 'Reasoning Linux Privilege Escalation'),
+    'Replayer': ('hackingBuddyGPT.usecases.viewer', 'Tool to replay the .jsonl logs generated by the Viewer (not well tested)'),
+    'SimpleWebAPIDocumentation': ('hackingBuddyGPT.usecases.web_api_testing.simple_openapi_documentation', 'Minimal implementation of a web API testing use case'),
+    'SimpleWebAPITesting': ('hackingBuddyGPT.usecases.web_api_testing.simple_web_api_testing', 'Minimal implementation of a web API testing use case'),
+    'ThesisLinuxPrivescPrototype': ('hackingBuddyGPT.usecases.rag.linux', 'Thesis Linux Privilege Escalation Prototype'),
+    'Viewer': ('hackingBuddyGPT.usecases.viewer', 'Webserver for (live) log viewing'),
+    'WebTestingWithExplanation': ('hackingBuddyGPT.usecases.web.with_explanation', "Minimal implementation of a web testing use case while allowing the llm to 'talk'"),
+    'WindowsPrivesc': ('hackingBuddyGPT.usecases.privesc.windows', 'Windows Privilege Escalation'),
+}
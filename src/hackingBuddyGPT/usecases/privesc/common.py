@@ -4,8 +4,7 @@ from dataclasses import dataclass, field
 from mako.template import Template
 from typing import Any, Dict, Optional
 
-from hackingBuddyGPT.capabilities import Capability
-from hackingBuddyGPT.capabilities.capability import capabilities_to_simple_text_handler
+from hackingBuddyGPT.capabilities.capability import CapabilityRegistry
 from hackingBuddyGPT.usecases.agents import Agent
 from hackingBuddyGPT.utils.logging import log_section, log_conversation
 from hackingBuddyGPT.utils import llm_util
@@ -27,7 +26,7 @@ class Privesc(Agent):
 
     _sliding_history: SlidingCliHistory = None
     _state: str = ""
-    _capabilities: Dict[str, Capability] = field(default_factory=dict)
+    _capabilities: CapabilityRegistry = field(default_factory=CapabilityRegistry)
     _template_params: Dict[str, Any] = field(default_factory=dict)
     _max_history_size: int = 0
 
@@ -59,13 +58,17 @@ class Privesc(Agent):
         if self._sliding_history:
             self._sliding_history.add_command(cmd, result)
 
-        # analyze the result..
-        if self.enable_explanation:
-            self.analyze_result(cmd, result)
+        if self.enable_explanation and self.enable_update_state:
+            # both only depend on the command output and the previous state, so we can query them concurrently
+            self.analyze_result_and_update_state(cmd, result)
+        else:
+            # analyze the result..
+            if self.enable_explanation:
+                self.analyze_result(cmd, result)
 
-        # .. and let our local model update its state
-        if self.enable_update_state:
-            self.update_state(cmd, result)
+            # .. and let our local model update its state
+            if self.enable_update_state:
+                self.update_state(cmd, result)
 
         # Output Round Data..  # TODO: reimplement
         # self.log.console.print(ui.get_history_table(self.enable_explanation, self.enable_update_state, self.log.run_id, self.log.log_db, turn))
@@ -94,7 +97,7 @@ class Privesc(Agent):
 
     @log_section("Executing that command...")
     def run_command(self, cmd, message_id) -> tuple[Optional[str], bool]:
-        _capability_descriptions, parser = capabilities_to_simple_text_handler(self._capabilities, default_capability=self._default_capability)
+        _capability_descriptions, parser = self._capabilities.simple_text_handler(default_capability=self._default_capability)
         start_time = datetime.datetime.now()
         success, *output = parser(cmd)
         if not success:
@@ -108,25 +111,40 @@ class Privesc(Agent):
 
         return result, got_root
 
-    @log_conversation("Analyze its result...", start_section=True)
-    def analyze_result(self, cmd, result):
+    def trim_result(self, result: str) -> str:
+        # ugly, but cut down result to fit context size
+        # don't do this linearly as this can take too long
         state_size = self.get_state_size()
         target_size = self.llm.context_size - llm_util.SAFETY_MARGIN - state_size
+        return llm_util.trim_result_front(self.llm, target_size, result)
 
-        # ugly, but cut down result to fit context size
-        result = llm_util.trim_result_front(self.llm, target_size, result)
+    @log_conversation("Analyze its result...", start_section=True)
+    def analyze_result(self, cmd, result):
+        result = self.trim_result(result)
         answer = self.llm.get_response(template_analyze, cmd=cmd, resp=result, facts=self._state)
         self.log.call_response(answer)
 
     @log_conversation("Updating fact list..", start_section=True)
     def update_state(self, cmd, result):
-        # ugly, but cut down result to fit context size
-        # don't do this linearly as this can take too long
-        ctx = self.llm.context_size
-        state_size = self.get_state_size()
-        target_size = ctx - llm_util.SAFETY_MARGIN - state_size
-        result = llm_util.trim_result_front(self.llm, target_size, result)
-
+        result = self.trim_result(result)
         state = self.llm.get_response(template_state, cmd=cmd, resp=result, facts=self._state)
+        self.apply_state(state)
+
+    def apply_state(self, state):
         self._state = state.result
         self.log.call_response(state)
+
+    def analyze_result_and_update_state(self, cmd, result):
+        result = self.trim_result(result)
+
+        answer, state = llm_util.get_responses(
+            self.llm,
+            (template_analyze, {"cmd": cmd, "resp": result, "facts": self._state}),
+            (template_state, {"cmd": cmd, "resp": result, "facts": self._state}),
+        )
+
+        # logging happens afterwards in the usual order, as the logger keeps track of the current conversation
+        with self.log.conversation("Analyze its result...", start_section=True):
+            self.log.call_response(answer)
+        with self.log.conversation("Updating fact list..", start_section=True):
+            self.apply_state(state)
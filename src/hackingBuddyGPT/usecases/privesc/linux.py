@@ -1,4 +1,4 @@
-from hackingBuddyGPT.capabilities import SSHRunCommand, SSHTestCredential
+from hackingBuddyGPT.capabilities import BatchTestCredential, SSHRunCommand, SSHTestCredential
 from hackingBuddyGPT.usecases.base import AutonomousAgentUseCase, use_case
 from hackingBuddyGPT.utils import SSHConnection
 
@@ -11,8 +11,9 @@ class LinuxPrivesc(Privesc):
 
     def init(self):
         super().init()
-        self.add_capability(SSHRunCommand(conn=self.conn), default=True)
+        self.add_capability(SSHRunCommand(conn=self.conn, log=self.log), default=True)
         self.add_capability(SSHTestCredential(conn=self.conn))
+        self.add_capability(BatchTestCredential(SSHTestCredential(conn=self.conn)))
 
 
 @use_case("Linux Privilege Escalation")
@@ -1,3 +1,4 @@
+from hackingBuddyGPT.capabilities.batch_test_credential import BatchTestCredential
 from hackingBuddyGPT.capabilities.psexec_run_command import PSExecRunCommand
 from hackingBuddyGPT.capabilities.psexec_test_credential import PSExecTestCredential
 from hackingBuddyGPT.usecases.base import AutonomousAgentUseCase, use_case
@@ -13,6 +14,11 @@ class WindowsPrivesc(Privesc):
         super().init()
         self.add_capability(PSExecRunCommand(conn=self.conn), default=True)
         self.add_capability(PSExecTestCredential(conn=self.conn))
+        self.add_capability(BatchTestCredential(PSExecTestCredential(conn=self.conn)))
+
+    def after_run(self):
+        super().after_run()
+        self.conn.close()
 
 
 @use_case("Windows Privilege Escalation")
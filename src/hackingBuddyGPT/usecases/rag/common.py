@@ -8,8 +8,7 @@ from mako.template import Template
 from typing import Any, Dict, Optional
 from langchain_core.vectorstores import VectorStoreRetriever
 
-from hackingBuddyGPT.capabilities import Capability
-from hackingBuddyGPT.capabilities.capability import capabilities_to_simple_text_handler
+from hackingBuddyGPT.capabilities.capability import CapabilityRegistry
 from hackingBuddyGPT.usecases.agents import Agent
 from hackingBuddyGPT.usecases.rag import rag_utility as rag_util
 from hackingBuddyGPT.utils.logging import log_section, log_conversation
@@ -38,7 +37,7 @@ class ThesisPrivescPrototype(Agent):
     hint: str = ""
 
     _sliding_history: SlidingCliHistory = None
-    _capabilities: Dict[str, Capability] = field(default_factory=dict)
+    _capabilities: CapabilityRegistry = field(default_factory=CapabilityRegistry)
     _template_params: Dict[str, Any] = field(default_factory=dict)
     _max_history_size: int = 0
     _analyze: str = ""
@@ -176,7 +175,7 @@ class ThesisPrivescPrototype(Agent):
 
     @log_section("Executing that command...")
     def run_command(self, cmd, message_id) -> tuple[Optional[str], Optional[str], bool]:
-        _capability_descriptions, parser = capabilities_to_simple_text_handler(self._capabilities, default_capability=self._default_capability)
+        _capability_descriptions, parser = self._capabilities.simple_text_handler(default_capability=self._default_capability)
 
         cmds = ""
         result = ""
@@ -12,7 +12,7 @@ class ThesisLinuxPrivescPrototype(ThesisPrivescPrototype):
 
     def init(self):
         super().init()
-        self.add_capability(SSHRunCommand(conn=self.conn), default=True)
+        self.add_capability(SSHRunCommand(conn=self.conn, log=self.log), default=True)
         self.add_capability(SSHTestCredential(conn=self.conn))
 
 
@@ -5,8 +5,7 @@ from typing import Any, Dict, Optional
 
 from mako.template import Template
 
-from hackingBuddyGPT.capabilities import Capability
-from hackingBuddyGPT.capabilities.capability import capabilities_to_simple_text_handler
+from hackingBuddyGPT.capabilities.capability import CapabilityRegistry
 from hackingBuddyGPT.usecases.agents import Agent
 from hackingBuddyGPT.utils import llm_util
 from hackingBuddyGPT.utils.cli_history import SlidingCliHistory
@@ -32,7 +31,7 @@ class ReasoningPrivesc(Agent):
 
     _sliding_history: Optional[SlidingCliHistory] = None
     _state: str = ""
-    _capabilities: Dict[str, Capability] = field(default_factory=dict)
+    _capabilities: CapabilityRegistry = field(default_factory=CapabilityRegistry)
     _template_params: Dict[str, Any] = field(default_factory=dict)
     _max_history_size: int = 0
 
@@ -46,7 +45,7 @@ class ReasoningPrivesc(Agent):
             self.log.error(f"Error reading exploit file: {e}")
 
     def get_capability_block(self) -> str:
-        capability_descriptions, _parser = capabilities_to_simple_text_handler(self._capabilities)
+        capability_descriptions, _parser = self._capabilities.simple_text_handler()
         return "You can use the following tools:\n\n" + "\n".join(
             f"- {description}" for description in capability_descriptions.values()
         )
@@ -84,13 +83,17 @@ class ReasoningPrivesc(Agent):
         if self._sliding_history:
             self._sliding_history.add_command(cmd, result if result is not None else "")
 
-        # analyze the result..
-        if self.enable_explanation:
-            self.analyze_result(cmd, result)
+        if self.enable_explanation and self.enable_update_state:
+            # both only depend on the command output and the previous state, so we can query them concurrently
+            self.analyze_result_and_update_state(cmd, result)
+        else:
+            # analyze the result..
+            if self.enable_explanation:
+                self.analyze_result(cmd, result)
 
-        # .. and let our local model update its state
-        if self.enable_update_state:
-            self.update_state(cmd, result)
+            # .. and let our local model update its state
+            if self.enable_update_state:
+                self.update_state(cmd, result)
 
         # if we got root, we can stop the loop
         return got_root
@@ -115,9 +118,7 @@ class ReasoningPrivesc(Agent):
 
     @log_section("Executing that command...")
     def run_command(self, cmd, message_id) -> tuple[Optional[str], bool]:
-        _capability_descriptions, parser = capabilities_to_simple_text_handler(
-            self._capabilities, default_capability=self._default_capability
-        )
+        _capability_descriptions, parser = self._capabilities.simple_text_handler(default_capability=self._default_capability)
         start_time = datetime.datetime.now()
         success, *output = parser(cmd)
         capability, cmd, (result, got_root) = output[0]
@@ -136,27 +137,43 @@ class ReasoningPrivesc(Agent):
 
         return result, bool(got_root)
 
-    @log_conversation("Analyze its result...", start_section=True)
-    def analyze_result(self, cmd, result):
+    def trim_result(self, result: str) -> str:
+        # ugly, but cut down result to fit context size
+        # don't do this linearly as this can take too long
         state_size = self.get_state_size()
         target_size = self.llm.context_size - llm_util.SAFETY_MARGIN - state_size
+        return llm_util.trim_result_front(self.llm, target_size, result)
 
-        # ugly, but cut down result to fit context size
-        result = llm_util.trim_result_front(self.llm, target_size, result)
+    @log_conversation("Analyze its result...", start_section=True)
+    def analyze_result(self, cmd, result):
+        result = self.trim_result(result)
         answer = self.llm.get_response(template_analyze, cmd=cmd, resp=result, facts=self._state)
         answer.result = llm_util.remove_think_block(answer.result)
         self.log.call_response(answer)
 
     @log_conversation("Updating fact list..", start_section=True)
     def update_state(self, cmd, result):
-        # ugly, but cut down result to fit context size
-        # don't do this linearly as this can take too long
-        ctx = self.llm.context_size
-        state_size = self.get_state_size()
-        target_size = ctx - llm_util.SAFETY_MARGIN - state_size
-        result = llm_util.trim_result_front(self.llm, target_size, result)
-
+        result = self.trim_result(result)
         state = self.llm.get_response(template_state, cmd=cmd, resp=result, facts=self._state)
+        self.apply_state(state)
+
+    def apply_state(self, state):
         state.result = llm_util.remove_think_block(state.result)
         self._state = state.result
         self.log.call_response(state)
+
+    def analyze_result_and_update_state(self, cmd, result):
+        result = self.trim_result(result)
+
+        answer, state = llm_util.get_responses(
+            self.llm,
+            (template_analyze, {"cmd": cmd, "resp": result, "facts": self._state}),
+            (template_state, {"cmd": cmd, "resp": result, "facts": self._state}),
+        )
+
+        # logging happens afterwards in the usual order, as the logger keeps track of the current conversation
+        with self.log.conversation("Analyze its result...", start_section=True):
+            answer.result = llm_util.remove_think_block(answer.result)
+            self.log.call_response(answer)
+        with self.log.conversation("Updating fact list..", start_section=True):
+            self.apply_state(state)
@@ -12,7 +12,7 @@ class ReasoningLinuxPrivesc(ReasoningPrivesc):
     def init(self):
         super().init()
         self.add_capability(SSHTestCredential(conn=self.conn))
-        self.add_capability(SSHRunCommand(conn=self.conn), default=True)
+        self.add_capability(SSHRunCommand(conn=self.conn, log=self.log), default=True)
 
 
 @use_case("Reasoning Linux Privilege Escalation")
@@ -0,0 +1,81 @@
+"""
+Lazy loading of use cases.
+
+Importing every use case up front pulls in the dependencies of all of them (fastapi, langchain, chromadb, nltk, ...),
+even though only a single one is run. The manifest (`manifest.py`) therefore lists the name, module and description of
+every use case, so that the command line can show them all, but only imports the module of the one that was selected.
+
+The manifest is generated by importing all modules of this package and recording the use cases they register:
+
+    python -m hackingBuddyGPT.usecases.registry
+
+This has to be rerun whenever a use case is added, renamed or moved (tests/test_use_case_registry.py checks it).
+"""
+import importlib
+import pkgutil
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict
+
+from hackingBuddyGPT.usecases import base
+from hackingBuddyGPT.usecases.manifest import USE_CASES
+from hackingBuddyGPT.utils.configurable import configurable
+
+MANIFEST_PATH = Path(__file__).parent / "manifest.py"
+
+MANIFEST_HEADER = '''"""
+Generated by `python -m hackingBuddyGPT.usecases.registry`, do not edit.
+
+Maps the name of every use case to the module that registers it and its description, see registry.py.
+"""
+
+'''
+
+
+@dataclass(frozen=True)
+class UseCaseInfo:
+    """Everything the command line needs to know about a use case that is not loaded yet."""
+
+    name: str
+    module: str
+    description: str
+
+
+def available_use_cases() -> Dict[str, UseCaseInfo]:
+    """All use cases from the manifest, as well as those that were registered without being in it."""
+    infos = {name: UseCaseInfo(name, module, description) for name, (module, description) in USE_CASES.items()}
+    for name, use_case in base.use_cases.items():
+        if name not in infos:
+            infos[name] = UseCaseInfo(name, use_case.__module__, use_case.description)
+    return infos
+
+
+def load_use_case(name: str) -> configurable:
+    """Imports only the module that defines the use case and returns the registered use case."""
+    if name not in base.use_cases:
+        if name not in USE_CASES:
+            raise KeyError(f"Unknown use case {name}")
+        importlib.import_module(USE_CASES[name][0])
+        if name not in base.use_cases:
+            raise KeyError(f"Module {USE_CASES[name][0]} did not register the use case {name}, the manifest is outdated")
+    return base.use_cases[name]
+
+
+def discover_use_cases() -> Dict[str, tuple[str, str]]:
+    """Imports every module of the usecases package and returns name -> (module, description) of all use cases."""
+    package = importlib.import_module("hackingBuddyGPT.usecases")
+    for module in pkgutil.walk_packages(package.__path__, package.__name__ + "."):
+        importlib.import_module(module.name)
+    return {
+        name: (use_case.__module__, use_case.description)
+        for name, use_case in sorted(base.use_cases.items())
+    }
+
+
+def write_manifest(path: Path = MANIFEST_PATH):
+    entries = "".join(f"    {name!r}: {entry!r},\n" for name, entry in discover_use_cases().items())
+    path.write_text(f"{MANIFEST_HEADER}USE_CASES = {{\n{entries}}}\n")
+
+
+if __name__ == "__main__":
+    write_manifest()
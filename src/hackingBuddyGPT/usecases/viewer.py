@@ -1,16 +1,19 @@
 #!/usr/bin/python3
 
 import asyncio
+import collections
 import datetime
+import functools
 import json
 import os
 import random
 import string
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from dataclasses import dataclass, field
 from enum import Enum
 import time
-from typing import Optional, Union
+from typing import Any, Callable, Optional, TypeVar, Union
 
 from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.responses import FileResponse, HTMLResponse
@@ -23,14 +26,17 @@ from hackingBuddyGPT.utils.db_storage import DbStorage
 from hackingBuddyGPT.utils.db_storage.db_storage import (
     Message,
     MessageStreamPart,
+    ReadOnlyDbPool,
     Run,
     Section,
     ToolCall,
     ToolCallStreamPart,
+    record_to_dict,
 )
 from dataclasses_json import dataclass_json
 
 from hackingBuddyGPT.utils.logging import GlobalLocalLogger, GlobalRemoteLogger
+from hackingBuddyGPT.utils.replay import ReplayFile, ReplayWriter
 
 INGRESS_TOKEN = os.environ.get("INGRESS_TOKEN", None)
 VIEWER_TOKEN = os.environ.get("VIEWER_TOKEN", random.choices(string.ascii_letters + string.digits, k=32))
@@ -41,11 +47,20 @@ RESOURCE_DIR = BASE_DIR + "../resources/webui"
 TEMPLATE_DIR = RESOURCE_DIR + "/templates"
 STATIC_DIR = RESOURCE_DIR + "/static"
 
+# number of frame ids the ingress remembers to recognize frames that a RemoteLogger sent again after a reconnect
+MAX_REMEMBERED_FRAMES = 10000
+
+T = TypeVar("T")
+
 
 @dataclass_json
 @dataclass(frozen=True)
 class MessageRequest:
     follow_run: Optional[int] = None
+    # cursor into the run: the first message (and everything belonging to it) that should be sent, and the maximum
+    # number of messages to send, the rest is requested page by page with the next_message of the returned Batch
+    from_message: int = 0
+    limit: Optional[int] = None
 
 
 MessageData = Union[MessageRequest, Run, Section, Message, MessageStreamPart, ToolCall, ToolCallStreamPart]
@@ -59,6 +74,10 @@ class MessageType(str, Enum):
     MESSAGE_STREAM_PART = "MessageStreamPart"
     TOOL_CALL = "ToolCall"
     TOOL_CALL_STREAM_PART = "ToolCallStreamPart"
+    # many records in one frame, sent to clients (see Client.send_batch) and by batching RemoteLoggers to the ingress
+    BATCH = "Batch"
+    # the answer to a frame of a RemoteLogger that has an id, once it is stored
+    ACK = "Ack"
 
     def get_class(self) -> MessageData:
         return {
@@ -86,34 +105,239 @@ class ReplayMessage:
     message: ControlMessage
 
 
+def interleave(messages: list[Message], tool_calls: list[ToolCall], sections: list[Section]) -> list[ControlMessage]:
+    """
+    Merges the records of a run into the order the client displays them in: every section before the message it starts
+    at, every tool call after its message. All three lists have to be sorted the way the database returns them, records
+    without a matching message are kept in order and the ones after the last message are appended at the end.
+    """
+    records = []
+    t = s = 0
+    for message in messages:
+        while s < len(sections) and sections[s].from_message <= message.id:
+            records.append(ControlMessage(MessageType.SECTION, sections[s]))
+            s += 1
+        while t < len(tool_calls) and tool_calls[t].message_id < message.id:
+            records.append(ControlMessage(MessageType.TOOL_CALL, tool_calls[t]))
+            t += 1
+        records.append(ControlMessage(MessageType.MESSAGE, message))
+        while t < len(tool_calls) and tool_calls[t].message_id == message.id:
+            records.append(ControlMessage(MessageType.TOOL_CALL, tool_calls[t]))
+            t += 1
+
+    records.extend(ControlMessage(MessageType.TOOL_CALL, tool_call) for tool_call in tool_calls[t:])
+    records.extend(ControlMessage(MessageType.SECTION, section) for section in sections[s:])
+    return records
+
+
+class DbWriter:
+    """
+    Applies the writes of all ingress connections to the database in the order they were submitted, on a single task.
+    The writes are run in a dedicated thread, so that neither a commit nor a full write queue of the storage blocks the
+    event loop. Writes that piled up while the previous ones were running are applied in one go.
+    """
+
+    def __init__(self, db: DbStorage):
+        self.db = db
+        self.queue: asyncio.Queue[tuple[Callable[[], Any], asyncio.Future]] = asyncio.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="viewer-db-writer")
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await self.flush()
+        self._task.cancel()
+        self._executor.shutdown(wait=True)
+
+    def submit(self, write: Callable[[], T]) -> "asyncio.Future[T]":
+        """Queues the write, the returned future is resolved with its result once it was applied."""
+        future = asyncio.get_running_loop().create_future()
+        self.queue.put_nowait((write, future))
+        return future
+
+    async def flush(self):
+        """Waits until all writes submitted so far were applied."""
+        await self.submit(lambda: None)
+
+    @staticmethod
+    def _apply(batch: list[tuple[Callable[[], Any], asyncio.Future]]) -> list[tuple[bool, Any]]:
+        results = []
+        for write, _future in batch:
+            try:
+                results.append((True, write()))
+            except Exception as e:
+                results.append((False, e))
+        return results
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            while not self.queue.empty():
+                batch.append(self.queue.get_nowait())
+
+            results = await loop.run_in_executor(self._executor, self._apply, batch)
+            for (_write, future), (ok, result) in zip(batch, results, strict=True):
+                if ok:
+                    future.set_result(result)
+                else:
+                    print(f"Error writing to the database: {result}")
+                    future.set_exception(result)
+                    # nobody might be waiting for this write, which is fine as the error was printed
+                    future.exception()
+
+
+class Broadcaster:
+    """
+    Fans the messages of the ingress out to the connected clients. Every client has its own bounded queue, which is
+    filled without waiting, so that neither many nor slow clients hold up the ingress, and a stalled client can not
+    grow the memory of the server (see Client.offer).
+    """
+
+    def __init__(self):
+        self.clients: list[Client] = []
+
+    def add(self, client: "Client"):
+        self.clients.append(client)
+
+    def remove(self, client: "Client"):
+        self.clients.remove(client)
+
+    def publish(self, message: ControlMessage):
+        for client in self.clients:
+            client.offer(message)
+
+    def metrics(self) -> dict[str, Any]:
+        depths = [client.queue.qsize() for client in self.clients]
+        return {
+            "clients": len(self.clients),
+            "queue_depth_max": max(depths, default=0),
+            "queue_depth_total": sum(depths),
+            "dropped": sum(client.dropped for client in self.clients),
+            "resyncs": sum(client.resyncs for client in self.clients),
+            "per_client": [
+                {
+                    "current_run": client.current_run,
+                    "queue_depth": depth,
+                    "queue_size": client.queue_size,
+                    "dropped": client.dropped,
+                    "resyncs": client.resyncs,
+                }
+                for client, depth in zip(self.clients, depths, strict=True)
+            ],
+        }
+
+
 @dataclass
 class Client:
     websocket: WebSocket
-    db: DbStorage
+    db: ReadOnlyDbPool
+    writer: Optional[DbWriter] = None
+    page_size: int = 500
+    queue_size: int = 1000
 
-    queue: asyncio.Queue[ControlMessage] = field(default_factory=asyncio.Queue)
+    queue: asyncio.Queue[ControlMessage] = field(init=False)
 
     current_run = None
     follow_new_runs = False
 
+    # a client that does not keep up with the ingress misses messages, which are then resent from the database
+    resync_needed = False
+    dropped = 0
+    resyncs = 0
+    dropped_runs: dict[int, Run] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+
+    def offer(self, message: ControlMessage):
+        """
+        Queues a message of the ingress for the client, if the client is interested in it, without ever waiting. If the
+        queue is full the message is dropped and the client is resynchronized from the database once it caught up.
+        """
+        if message.type != MessageType.RUN and getattr(message.data, "run_id", None) != self.current_run:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.resync_needed = True
+            if message.type == MessageType.RUN:
+                self.dropped_runs[message.data.id] = message.data
+
+    async def resync(self):
+        """
+        Resends what the client might have missed: the runs that were queued or dropped, and the current run from the
+        database.
+        """
+        self.resync_needed = False
+        self.resyncs += 1
+        # the messages of the current run that are queued are older than what is read from the database now, only the
+        # updates of runs and the requests of the client itself are kept
+        runs: dict[int, Run] = {}
+        requests = []
+        while not self.queue.empty():
+            message = self.queue.get_nowait()
+            if message.type == MessageType.RUN:
+                runs[message.data.id] = message.data
+            elif message.type == MessageType.MESSAGE_REQUEST:
+                requests.append(message)
+
+        # the dropped updates came in after the queue was full, so they are newer than the queued ones
+        runs.update(self.dropped_runs)
+        self.dropped_runs = {}
+        for run in runs.values():
+            await self.send(MessageType.RUN, run)
+        if self.current_run is not None:
+            await self.switch_to_run(self.current_run)
+        for request in requests:
+            await self.handle_request(request.data)
+
+    async def handle_request(self, request: MessageRequest):
+        if request.follow_run is not None:
+            await self.switch_to_run(request.follow_run, request.from_message, request.limit)
+
+    async def sync_with_ingress(self):
+        """Waits until the messages that were already received by the ingress are in the database."""
+        if self.writer is not None:
+            await self.writer.flush()
+
     async def send_message(self, message: ControlMessage) -> None:
         await self.websocket.send_text(message.to_json())
 
     async def send(self, type: MessageType, message: MessageData) -> None:
         await self.send_message(ControlMessage(type, message))
 
+    async def send_batch(self, run_id: int, records: list[ControlMessage], next_message: Optional[int]) -> None:
+        """
+        Sends many records of a run in a single frame. next_message is the cursor for the next page, None once the run
+        is complete.
+        """
+        await self.websocket.send_text(json.dumps({
+            "type": MessageType.BATCH.value,
+            "data": {
+                "run_id": run_id,
+                "records": [{"type": record.type.value, "data": record_to_dict(record.data)} for record in records],
+                "next_message": next_message,
+            },
+        }))
+
     async def send_messages(self) -> None:
-        runs = self.db.get_runs()
+        await self.sync_with_ingress()
+        runs = await self.db.get_runs()
         for r in runs:
             await self.send(MessageType.RUN, r)
 
         while True:
             try:
+                if self.resync_needed:
+                    await self.resync()
                 msg: ControlMessage = await self.queue.get()
                 data = msg.data
                 if msg.type == MessageType.MESSAGE_REQUEST:
-                    if data.follow_run is not None:
-                        await self.switch_to_run(data.follow_run)
+                    await self.handle_request(data)
 
                 elif msg.type == MessageType.RUN:
                     await self.send_message(msg)
@@ -152,9 +376,10 @@ class Client:
                     print("Invalid message")
                     continue
 
+                limit = data.get("limit")
                 message = ControlMessage(
                     type=MessageType.MESSAGE_REQUEST,
-                    data=MessageRequest(int(data["follow_run"])),
+                    data=MessageRequest(int(data["follow_run"]), int(data.get("from_message", 0)), int(limit) if limit is not None else None),
                 )
                 # we don't process the message here, as having all message processing done in lockstep in the send_messages
                 # function means that we don't have to worry about race conditions between reading from the database and
@@ -164,60 +389,58 @@ class Client:
                 print(f"Error receiving message: {e}")
                 raise e
 
-    async def switch_to_run(self, run_id: int):
+    async def switch_to_run(self, run_id: int, from_message: int = 0, limit: Optional[int] = None):
+        """
+        Follows the run and sends one page of it, starting at from_message. Only a page worth of records is read from
+        the database and held in memory at a time, no matter how long the run is.
+        """
+        if from_message > 0 and run_id != self.current_run:
+            # the next page of a run the client switched away from in the meantime
+            return
+        limit = min(limit, self.page_size) if limit is not None and limit > 0 else self.page_size
+
         self.current_run = run_id
-        messages = self.db.get_messages_by_run(run_id)
-
-        tool_calls = list(self.db.get_tool_calls_by_run(run_id))
-        tool_calls_per_message = dict()
-        for tc in tool_calls:
-            if tc.message_id not in tool_calls_per_message:
-                tool_calls_per_message[tc.message_id] = []
-            tool_calls_per_message[tc.message_id].append(tc)
-
-        sections: list[Section] = list(self.db.get_sections_by_run(run_id))
-        sections_starting_with_message = dict()
-        for s in sections:
-            if s.from_message not in sections_starting_with_message:
-                sections_starting_with_message[s.from_message] = []
-            sections_starting_with_message[s.from_message].append(s)
-
-        for msg in messages:
-            if msg.id in sections_starting_with_message:
-                for s in sections_starting_with_message[msg.id]:
-                    await self.send(MessageType.SECTION, s)
-                    sections.remove(s)
-            await self.send(MessageType.MESSAGE, msg)
-            if msg.id in tool_calls_per_message:
-                for tc in tool_calls_per_message[msg.id]:
-                    await self.send(MessageType.TOOL_CALL, tc)
-                    tool_calls.remove(tc)
-
-        for tc in tool_calls:
-            await self.send(MessageType.TOOL_CALL, tc)
-
-        for s in sections:
-            await self.send(MessageType.SECTION, s)
+        await self.sync_with_ingress()
+        # one message more than requested tells whether there is a next page, and where it starts
+        messages = await self.db.get_messages_by_run(run_id, from_message, limit + 1)
+        next_message = to_message = None
+        if len(messages) > limit:
+            next_message = messages[limit].id
+            to_message = next_message - 1
+            messages = messages[:limit]
+
+        # the two reads are independent of each other, so they run in parallel on the pool
+        tool_calls, sections = await asyncio.gather(
+            self.db.get_tool_calls_by_run(run_id, from_message, to_message),
+            self.db.get_sections_by_run(run_id, from_message, to_message),
+        )
+        await self.send_batch(run_id, interleave(messages, tool_calls, sections), next_message)
 
 
 @use_case("Webserver for (live) log viewing")
 class Viewer(UseCase):
     """
-    TODOs:
-    - [ ] This server needs to be as async as possible to allow good performance, but the database accesses are not yet, might be an issue?
+    The server is fully async: the clients read from the database through a pool of read-only connections in worker
+    threads, and all writes of the ingress go through a single writer task (see ReadOnlyDbPool and DbWriter), so that
+    neither blocks the event loop for the other clients.
     """
     log: GlobalLocalLogger = None
     log_db: DbStorage = None
     log_server_address: str = "127.0.0.1:4444"
     save_playback_dir: str = ""
+    read_connections: int = parameter(desc="Number of read-only database connections that serve the clients in parallel", default=4)
+    page_size: int = parameter(desc="Maximum number of messages of a run that are sent to a client in one batch", default=500)
+    client_queue_size: int = parameter(desc="Maximum number of messages queued for a client, a client that falls further behind is resynchronized from the database", default=1000)
+
+    playback_fsync_interval: float = parameter(desc="Seconds between syncs of the playback recordings to disk", default=1.0)
+
+    _replays: Optional[ReplayWriter] = None
 
     async def save_message(self, message: ControlMessage):
-        if not self.save_playback_dir or len(self.save_playback_dir) == 0:
+        if self._replays is None:
             return
 
-        # check if a file with the name of the message run id already exists in the save_playback_dir
-        # if it does, append the message to the json lines file
-        # if it doesn't, create a new file with the name of the message run id and write the message to it
+        # every run is recorded into its own json lines file, which stays open while the run goes on
         if isinstance(message.data, Run):
             run_id = message.data.id
         elif hasattr(message.data, "run_id"):
@@ -225,23 +448,37 @@ class Viewer(UseCase):
         else:
             raise ValueError("gotten message without run_id", message)
 
-        if not os.path.exists(self.save_playback_dir):
-            os.makedirs(self.save_playback_dir)
-
-        file_path = os.path.join(self.save_playback_dir, f"{run_id}.jsonl")
-        with open(file_path, "a") as f:
-            f.write(ReplayMessage(datetime.datetime.now(), message).to_json() + "\n")
+        at = datetime.datetime.now()
+        message_id = message.data.id if message.type == MessageType.MESSAGE else None
+        self._replays.write(run_id, at.timestamp(), ReplayMessage(at, message).to_json(), message_id)
+        if isinstance(message.data, Run) and message.data.stopped_at is not None:
+            self._replays.close_run(run_id)
 
-    def run(self, config):
+    def create_app(self) -> FastAPI:
         @asynccontextmanager
         async def lifespan(app: FastAPI):
             app.state.db = self.log_db
-            app.state.clients = []
+            app.state.reader = ReadOnlyDbPool(self.log_db, self.read_connections)
+            app.state.writer = DbWriter(self.log_db)
+            app.state.writer.start()
+            app.state.broadcaster = Broadcaster()
+            # ids of the frames of RemoteLoggers that were stored recently, mapped to the runs they were answered with
+            app.state.frames = collections.OrderedDict()
+            if self.save_playback_dir:
+                self._replays = ReplayWriter(self.save_playback_dir, self.playback_fsync_interval)
 
             yield
 
-            for client in app.state.clients:
+            for client in app.state.broadcaster.clients:
                 await client.websocket.close()
+            await app.state.writer.stop()
+            app.state.reader.close()
+            # uvicorn re-raises a SIGTERM once it is shut down, which ends the process without running the atexit
+            # handler that writes the remaining queued log entries
+            self.log_db.wait_for_writes()
+            if self._replays is not None:
+                self._replays.close()
+                self._replays = None
 
         app = FastAPI(lifespan=lifespan)
 
@@ -267,6 +504,69 @@ class Viewer(UseCase):
         async def admin_ui(request: Request):
             return templates.TemplateResponse("index.html", {"request": request})
 
+        @app.get("/metrics")
+        async def metrics():
+            return app.state.broadcaster.metrics()
+
+        async def handle_ingress(data: dict) -> ControlMessage:
+            message_type = MessageType(data["type"])
+            # parse the data according to the message type into the appropriate dataclass
+            message = message_type.get_class().from_dict(data["data"])
+
+            # all writes go through the writer task, only the creation of a run has to be waited for, as the ingress
+            # needs to know its id
+            db, writer = app.state.db, app.state.writer
+            if message_type == MessageType.RUN:
+                if message.id is None:
+                    message.started_at = datetime.datetime.now()
+                    message.id = await writer.submit(functools.partial(db.create_run, message.model, message.tag, message.started_at, message.configuration))
+                    data["data"]["id"] = message.id  # set the id also in the raw data, so we can properly serialize it to replays
+                else:
+                    writer.submit(functools.partial(db.update_run, message.id, message.model, message.state, message.tag, message.started_at, message.stopped_at, message.configuration))
+
+            elif message_type == MessageType.MESSAGE:
+                writer.submit(functools.partial(db.add_or_update_message, message.run_id, message.id, message.conversation, message.role, message.content, message.tokens_query, message.tokens_response, message.duration))
+
+            elif message_type == MessageType.MESSAGE_STREAM_PART:
+                writer.submit(functools.partial(db.handle_message_update, message.run_id, message.message_id, message.action, message.content))
+
+            elif message_type == MessageType.TOOL_CALL:
+                writer.submit(functools.partial(db.add_tool_call, message.run_id, message.message_id, message.id, message.function_name, message.arguments, message.result_text, message.duration))
+
+            elif message_type == MessageType.SECTION:
+                writer.submit(functools.partial(db.add_section, message.run_id, message.id, message.name, message.from_message, message.to_message, message.duration))
+
+            else:
+                print("UNHANDLED ingress", message)
+
+            control_message = ControlMessage(type=message_type, data=message)
+            await self.save_message(control_message)
+            app.state.broadcaster.publish(control_message)
+            return control_message
+
+        async def handle_frame(frame_id: str, records: list[dict]) -> list[dict]:
+            """
+            Stores the records of a frame, unless it was stored before (it is sent again by a RemoteLogger that did not
+            get the acknowledgement), and returns the runs that the run messages of the frame are answered with.
+            """
+            frames = app.state.frames
+            stored = frames.get(frame_id)
+            if stored is None:
+                stored = frames[frame_id] = asyncio.get_running_loop().create_future()
+                while len(frames) > MAX_REMEMBERED_FRAMES:
+                    frames.popitem(last=False)
+                try:
+                    messages = [await handle_ingress(record) for record in records]
+                    # the frame is only acknowledged once its writes were applied
+                    await app.state.writer.flush()
+                except BaseException as e:
+                    # the frame can be sent again, and whoever waits for it fails as well
+                    frames.pop(frame_id, None)
+                    stored.set_exception(e)
+                    raise
+                stored.set_result([message.data.to_dict(encode_json=True) for message in messages if message.type == MessageType.RUN])
+            return await asyncio.shield(stored)
+
         @app.websocket("/ingress")
         async def ingress_endpoint(websocket: WebSocket):
             await websocket.accept()
@@ -274,38 +574,18 @@ class Viewer(UseCase):
                 while True:
                     # Receive messages from the ingress websocket
                     data = await websocket.receive_json()
-                    message_type = MessageType(data["type"])
-                    # parse the data according to the message type into the appropriate dataclass
-                    message = message_type.get_class().from_dict(data["data"])
-
-                    if message_type == MessageType.RUN:
-                        if message.id is None:
-                            message.started_at = datetime.datetime.now()
-                            message.id = app.state.db.create_run(message.model, message.tag, message.started_at, message.configuration)
-                            data["data"]["id"] = message.id  # set the id also in the raw data, so we can properly serialize it to replays
-                        else:
-                            app.state.db.update_run(message.id, message.model, message.state, message.tag, message.started_at, message.stopped_at, message.configuration)
-                        await websocket.send_text(message.to_json())
-
-                    elif message_type == MessageType.MESSAGE:
-                        app.state.db.add_or_update_message(message.run_id, message.id, message.conversation, message.role, message.content, message.tokens_query, message.tokens_response, message.duration)
-
-                    elif message_type == MessageType.MESSAGE_STREAM_PART:
-                        app.state.db.handle_message_update(message.run_id, message.message_id, message.action, message.content)
-
-                    elif message_type == MessageType.TOOL_CALL:
-                        app.state.db.add_tool_call(message.run_id, message.message_id, message.id, message.function_name, message.arguments, message.result_text, message.duration)
-
-                    elif message_type == MessageType.SECTION:
-                        app.state.db.add_section(message.run_id, message.id, message.name, message.from_message, message.to_message, message.duration)
-
-                    else:
-                        print("UNHANDLED ingress", message)
-
-                    control_message = ControlMessage(type=message_type, data=message)
-                    await self.save_message(control_message)
-                    for client in app.state.clients:
-                        await client.queue.put(control_message)
+                    if data["type"] == MessageType.BATCH.value and "frame" in data["data"]:
+                        # a RemoteLogger, which keeps the frame until it is acknowledged
+                        runs = await handle_frame(data["data"]["frame"], data["data"]["records"])
+                        await websocket.send_json({"type": MessageType.ACK.value, "data": {"frame": data["data"]["frame"], "runs": runs}})
+                        continue
+
+                    # control messages of other senders are handled one by one, run messages are answered with the run
+                    records = data["data"]["records"] if data["type"] == MessageType.BATCH.value else [data]
+                    for record in records:
+                        message = await handle_ingress(record)
+                        if message.type == MessageType.RUN:
+                            await websocket.send_text(message.data.to_json())
 
             except WebSocketDisconnect as e:
                 import traceback
@@ -315,27 +595,33 @@ class Viewer(UseCase):
         @app.websocket("/client")
         async def client_endpoint(websocket: WebSocket):
             await websocket.accept()
-            client = Client(websocket, app.state.db)
-            app.state.clients.append(client)
-
-            # run the receiving and sending tasks in the background until one of them returns
-            tasks = ()
+            client = Client(websocket, app.state.reader, app.state.writer, self.page_size, self.client_queue_size)
+            app.state.broadcaster.add(client)
+
+            # run the receiving and sending tasks in the background until one of them returns, which it does (with a
+            # WebSocketDisconnect) when the client disconnects
+            tasks = (
+                asyncio.create_task(client.send_messages()),
+                asyncio.create_task(client.receive_messages()),
+            )
             try:
-                tasks = (
-                    asyncio.create_task(client.send_messages()),
-                    asyncio.create_task(client.receive_messages()),
-                )
-                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
-            except WebSocketDisconnect:
+                done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
                 # read the task exceptions, close remaining tasks
-                for task in tasks:
-                    if task.exception():
+                for task in pending:
+                    task.cancel()
+                for task in done:
+                    if task.exception() and not isinstance(task.exception(), WebSocketDisconnect):
                         print(task.exception())
-                    else:
-                        task.cancel()
-                app.state.clients.remove(client)
+            finally:
+                # otherwise every message would still be queued for the client that is gone
+                app.state.broadcaster.remove(client)
                 print("Egress WebSocket disconnected")
 
+        return app
+
+    def run(self, config):
+        app = self.create_app()
+
         import uvicorn
         listen_parts = self.log_server_address.split(":", 1)
         if len(listen_parts) != 2:
@@ -359,11 +645,21 @@ class Viewer(UseCase):
 
 @use_case("Tool to replay the .jsonl logs generated by the Viewer (not well tested)")
 class Replayer(UseCase):
+    """
+    Replays a recording of the Viewer (see save_playback_dir) to a log server, in the pace it was recorded in.
+
+    The replay can start at any point of the recording, given in seconds or as message id, which is looked up in the
+    index of the recording instead of reading everything before it. With fast_forward, everything before that point is
+    sent without delay, so that the run is complete up to there.
+    """
     log: GlobalRemoteLogger = None
     replay_file: str = None
     pause_on_message: bool = False
     pause_on_tool_calls: bool = False
     playback_speed: float = 1.0
+    start_at: float = parameter(desc="Seconds into the recording at which the replay starts", default=0)
+    start_at_message: int = parameter(desc="Id of the message at which the replay starts (instead of start_at), -1 for none", default=-1)
+    fast_forward: bool = parameter(desc="Send everything before the start of the replay without delay, instead of skipping it", default=False)
 
     def get_name(self) -> str:
         return "replayer"
@@ -371,29 +667,49 @@ class Replayer(UseCase):
     def init(self, configuration):
         self.log.init_websocket()  # we don't want to automatically start a run here
 
-    def run(self):
-        recording_start: Optional[datetime.datetime] = None
-        replay_start: datetime.datetime = datetime.datetime.now()
+    @staticmethod
+    def parse(data: dict) -> ReplayMessage:
+        msg: ReplayMessage = ReplayMessage.from_dict(data)
+        msg.message.type = MessageType(data["message"]["type"])
+        msg.message.data = msg.message.type.get_class().from_dict(data["message"]["data"])
+        return msg
 
+    def run(self):
         print(f"replaying {self.replay_file}")
-        for line in open(self.replay_file, "r"):
-            data = json.loads(line)
-            msg: ReplayMessage = ReplayMessage.from_dict(data)
-            msg.message.type = MessageType(data["message"]["type"])
-            msg.message.data = msg.message.type.get_class().from_dict(data["message"]["data"])
-
-            if recording_start is None:
-                if msg.message.type != MessageType.RUN:
-                    raise ValueError("First message must be a RUN message, is", msg.message.type)
-                recording_start = msg.at
-                self.log.start_run(msg.message.data.model, msg.message.data.tag, msg.message.data.configuration, msg.at)
-
-            # wait until the message should be sent
-            sleep_time = ((msg.at - recording_start) / self.playback_speed) - (datetime.datetime.now() - replay_start)
-            if sleep_time.total_seconds() > 3:
-                print(msg)
-                print(f"sleeping for {sleep_time.total_seconds()}s")
-            time.sleep(max(sleep_time.total_seconds(), 0))
+        replay = ReplayFile(self.replay_file)
+        first = replay.first_record()
+        if first is None or first["message"]["type"] != MessageType.RUN.value:
+            raise ValueError("First message must be a RUN message, is", first and first["message"]["type"])
+        first = self.parse(first)
+        self.log.start_run(first.message.data.model, first.message.data.configuration, first.message.data.tag, first.at)
+
+        if self.start_at_message >= 0:
+            start_offset = replay.offset_of_message(self.start_at_message)
+            if start_offset is None:
+                raise ValueError(f"Message {self.start_at_message} is not part of the recording")
+            start_time = None
+        else:
+            start_time = replay.start + self.start_at
+            # the index points to a line shortly before the start time, the rest up to it is skipped while reading
+            start_offset = replay.offset_at(start_time)
+
+        # the pace is measured from the first message that is replayed (and from every pause)
+        paced_from: Optional[tuple[float, float]] = None
+        for offset, data in replay.records(0 if self.fast_forward else start_offset):
+            before_start = offset < start_offset or (start_time is not None and data["at"] < start_time)
+            if before_start and not self.fast_forward:
+                continue
+            msg = self.parse(data)
+
+            if not before_start:
+                if paced_from is None:
+                    paced_from = (time.monotonic(), data["at"])
+                # wait until the message should be sent
+                sleep_time = (data["at"] - paced_from[1]) / self.playback_speed - (time.monotonic() - paced_from[0])
+                if sleep_time > 3:
+                    print(msg)
+                    print(f"sleeping for {sleep_time}s")
+                time.sleep(max(sleep_time, 0))
 
             if isinstance(msg.message.data, Run):
                 msg.message.data.id = self.log.run.id
@@ -402,10 +718,9 @@ class Replayer(UseCase):
             else:
                 raise ValueError("Message has no run_id", msg.message.data)
 
-            if self.pause_on_message and msg.message.type == MessageType.MESSAGE \
-               or self.pause_on_tool_calls and msg.message.type == MessageType.TOOL_CALL:
+            if not before_start and (self.pause_on_message and msg.message.type == MessageType.MESSAGE
+                                     or self.pause_on_tool_calls and msg.message.type == MessageType.TOOL_CALL):
                 input("Paused, press Enter to continue")
-                replay_start = datetime.datetime.now() - (msg.at - recording_start)
+                paced_from = (time.monotonic(), data["at"])
 
-            print("sending")
             self.log.send(msg.message.type, msg.message.data)
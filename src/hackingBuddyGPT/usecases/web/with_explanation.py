@@ -1,10 +1,10 @@
 from dataclasses import field
-from typing import List, Any, Union, Dict, Iterable, Optional
+from typing import List, Any, Union, Iterable, Optional
 
 from openai.types.chat import ChatCompletionMessageParam, ChatCompletionMessage
 from openai.types.chat.chat_completion_chunk import ChoiceDelta
 
-from hackingBuddyGPT.capabilities import Capability
+from hackingBuddyGPT.capabilities import CapabilityRegistry
 from hackingBuddyGPT.capabilities.http_request import HTTPRequest
 from hackingBuddyGPT.capabilities.submit_flag import SubmitFlag
 from hackingBuddyGPT.usecases.agents import Agent
@@ -35,7 +35,7 @@ class WebTestingWithExplanation(Agent):
 
     _prompt_history: Prompt = field(default_factory=list)
     _context: Context = field(default_factory=lambda: {"notes": list()})
-    _capabilities: Dict[str, Capability] = field(default_factory=dict)
+    _capabilities: CapabilityRegistry = field(default_factory=CapabilityRegistry)
     _all_flags_found: bool = False
 
     def init(self):
@@ -1,7 +1,6 @@
 from dataclasses import field
-from typing import Dict
 
-from hackingBuddyGPT.capabilities import Capability
+from hackingBuddyGPT.capabilities import CapabilityRegistry
 from hackingBuddyGPT.capabilities.http_request import HTTPRequest
 from hackingBuddyGPT.capabilities.record_note import RecordNote
 from hackingBuddyGPT.usecases.agents import Agent
@@ -28,7 +27,7 @@ class SimpleWebAPIDocumentation(Agent):
         host (str): The host URL of the website to test.
         _prompt_history (Prompt): The history of prompts and responses.
         _context (Context): The context containing notes.
-        _capabilities (Dict[str, Capability]): The capabilities of the agent.
+        _capabilities (CapabilityRegistry): The capabilities of the agent.
         _all_http_methods_found (bool): Flag indicating if all HTTP methods were found.
         _http_method_description (str): Description for expected HTTP methods.
         _http_method_template (str): Template to format HTTP methods in API requests.
@@ -39,7 +38,7 @@ class SimpleWebAPIDocumentation(Agent):
     host: str = parameter(desc="The host to test", default="https://jsonplaceholder.typicode.com")
     _prompt_history: Prompt = field(default_factory=list)
     _context: Context = field(default_factory=lambda: {"notes": list()})
-    _capabilities: Dict[str, Capability] = field(default_factory=dict)
+    _capabilities: CapabilityRegistry = field(default_factory=CapabilityRegistry)
     _all_http_methods_found: bool = False
 
     # Description for expected HTTP methods
@@ -72,7 +71,7 @@ class SimpleWebAPIDocumentation(Agent):
     def _setup_capabilities(self):
         """Sets up the capabilities for the agent."""
         notes = self._context["notes"]
-        self._capabilities = {"http_request": HTTPRequest(self.host), "record_note": RecordNote(notes)}
+        self._capabilities = CapabilityRegistry({"http_request": HTTPRequest(self.host), "record_note": RecordNote(notes)})
 
     def _setup_initial_prompt(self):
         """Sets up the initial prompt for the agent."""
@@ -5,7 +5,7 @@ from typing import Any, Dict, List
 import pydantic_core
 from rich.panel import Panel
 
-from hackingBuddyGPT.capabilities import Capability
+from hackingBuddyGPT.capabilities import CapabilityRegistry
 from hackingBuddyGPT.capabilities.http_request import HTTPRequest
 from hackingBuddyGPT.capabilities.record_note import RecordNote
 from hackingBuddyGPT.usecases.agents import Agent
@@ -37,7 +37,7 @@ class SimpleWebAPITesting(Agent):
         http_methods (str): Comma-separated list of HTTP methods expected in the API response.
         _prompt_history (Prompt): The history of prompts sent to the language model.
         _context (Context): Contextual data for the test session.
-        _capabilities (Dict[str, Capability]): Available capabilities for the agent.
+        _capabilities (CapabilityRegistry): Available capabilities for the agent.
         _all_http_methods_found (bool): Flag indicating if all HTTP methods have been found.
     """
 
@@ -58,7 +58,7 @@ class SimpleWebAPITesting(Agent):
 
     _prompt_history: Prompt = field(default_factory=list)
     _context: Context = field(default_factory=lambda: {"notes": list()})
-    _capabilities: Dict[str, Capability] = field(default_factory=dict)
+    _capabilities: CapabilityRegistry = field(default_factory=CapabilityRegistry)
     _all_http_methods_found: bool = False
 
     def init(self) -> None:
@@ -123,11 +123,11 @@ class SimpleWebAPITesting(Agent):
             self.http_method_template.format(method=method) for method in self.http_methods.split(",")
         }
         notes: List[str] = self._context["notes"]
-        self._capabilities = {
+        self._capabilities = CapabilityRegistry({
             "submit_http_method": HTTPRequest(self.host),
             "http_request": HTTPRequest(self.host),
             "record_note": RecordNote(notes),
-        }
+        })
 
     def perform_round(self, turn: int) -> None:
         """
@@ -1,28 +1,53 @@
+from collections import deque
+from dataclasses import dataclass
 from typing import Optional
 
-from .llm_util import LLM, trim_result_front, remove_think_block
+from .llm_util import LLM, trim_result_back, trim_result_front, remove_think_block
+
+
+@dataclass
+class HistoryEntry:
+    cmd: str
+    output: Optional[str]  # None for entries added through add_command_only
+    text: str
+    token_count: int
 
 
 class SlidingCliHistory:
+    """
+    Keeps the most recent commands (and their outputs) that fit into the context size of the model.
+
+    Every entry is tokenized exactly once when it is added and the token count of all entries is kept as a running
+    total, so evicting the oldest entries and rendering a history for a smaller budget only ever touches the entries
+    that are evicted or rendered.
+    """
     model: LLM
     maximum_target_size: int
-    sliding_history: str
+    entries: deque
+    total_tokens: int
     last_output: str
+    last_output_tokens: int
     summarize_template: Optional[object]
 
     def __init__(self, used_model: LLM, summarize_template=None, reasoning=False):
         self.model = used_model
         self.maximum_target_size = used_model.context_size
-        self.sliding_history = ""
+        self.entries = deque()
+        self.total_tokens = 0
         self.last_output = ""
+        self.last_output_tokens = 0
         self.summarize_template = summarize_template
         self.reasoning = reasoning
 
+    @property
+    def sliding_history(self) -> str:
+        return "".join(entry.text for entry in self.entries)
+
     def _summarize_output(self, cmd: str, output: str) -> str:
         """Summarize long output using the provided template."""
         if self.summarize_template is None:
             return output
-        
+
         try:
             result = self.model.get_response(
                 self.summarize_template,
@@ -38,24 +63,66 @@ class SlidingCliHistory:
                 return output[:500] + '\n...\n[OUTPUT TRUNCATED - TOO LONG]\n...\n' + output[-500:]
             return output
 
+    def _append(self, cmd: str, output: Optional[str], text: str, budget: int):
+        budget = max(budget, 0)
+        token_count = self.model.count_tokens(text)
+        if token_count > budget:
+            # a single entry that is larger than the whole history keeps its beginning (the command line itself)
+            text = trim_result_front(self.model, budget, text)
+            token_count = self.model.count_tokens(text)
+
+        self.entries.append(HistoryEntry(cmd, output, text, token_count))
+        self.total_tokens += token_count
+        self._evict(budget)
+
+    def _evict(self, budget: int):
+        while self.entries and self.total_tokens > budget:
+            self.total_tokens -= self.entries.popleft().token_count
+
+    def _render(self, budget: int) -> tuple[str, int]:
+        """
+        Renders the newest entries that fit into budget tokens, if there is budget left the entry before them is cut
+        down to its end. Returns the rendered history and its token count.
+        """
+        if self.total_tokens <= budget:
+            return self.sliding_history, self.total_tokens
+
+        parts = []
+        used = 0
+        for entry in reversed(self.entries):
+            if used + entry.token_count > budget:
+                remaining = budget - used
+                if remaining > 0:
+                    partial = trim_result_back(self.model, remaining, entry.text)
+                    parts.append(partial)
+                    used += self.model.count_tokens(partial)
+                break
+            parts.append(entry.text)
+            used += entry.token_count
+
+        return "".join(reversed(parts)), used
+
     def add_command(self, cmd: str, output: str):
         if len(output) > 5000:
             output = self._summarize_output(cmd, output)
-        
-        self.sliding_history += f"$ {cmd}\n{output}\n"
-        self.sliding_history = trim_result_front(self.model, self.maximum_target_size, self.sliding_history)
+
+        self._append(cmd, output, f"$ {cmd}\n{output}\n", self.maximum_target_size)
 
     def get_history(self, target_size: int) -> str:
-        return trim_result_front(self.model, min(self.maximum_target_size, target_size), self.sliding_history)
+        return self._render(min(self.maximum_target_size, target_size))[0]
 
     def add_command_only(self, cmd: str, output: str):
-        self.sliding_history +=  f"$ {cmd}\n"
         self.last_output = output
-        last_output_size = self.model.count_tokens(self.last_output)
-        if self.maximum_target_size - last_output_size < 0:
-            last_output_size = 0
+        self.last_output_tokens = self.model.count_tokens(self.last_output)
+        if self.maximum_target_size - self.last_output_tokens < 0:
+            self.last_output_tokens = 0
             self.last_output = ''
-        self.sliding_history = trim_result_front(self.model, self.maximum_target_size - last_output_size, self.sliding_history)
+
+        self._append(cmd, None, f"$ {cmd}\n", self.maximum_target_size - self.last_output_tokens)
 
     def get_commands_and_last_output(self, target_size: int) -> str:
-        return trim_result_front(self.model, min(self.maximum_target_size, target_size), self.sliding_history + self.last_output)
\ No newline at end of file
+        budget = min(self.maximum_target_size, target_size)
+        commands, used = self._render(budget)
+        if used + self.last_output_tokens <= budget:
+            return commands + self.last_output
+        return commands + trim_result_front(self.model, budget - used, self.last_output)
@@ -531,13 +531,14 @@ CommandMap = dict[str, Union["CommandMap[C]", Parseable[C]]]
 
 def _to_help(name: str, commands: Union[CommandMap[C], Parseable[C]], level: int = 0, max_length: int = 0) -> str:
     h = ""
-    if isinstance(commands, Parseable):
-        h += f"{indent(level)}{COMMAND_COLOR}{name}{COLOR_RESET}{' ' * (max_length - len(name)+4)} {commands.description}\n"
-    elif isinstance(commands, dict):
+    if isinstance(commands, dict):
         h += f"{indent(level)}{COMMAND_COLOR}{name}{COLOR_RESET}:\n"
         max_length = max(max_length, level*INDENT_WIDTH + max(len(k) for k in commands.keys()))
         for name, parser in commands.items():
             h += _to_help(name, parser, level + 1, max_length)
+    else:
+        # a Parseable, or anything else with a description for a command that is not loaded yet
+        h += f"{indent(level)}{COMMAND_COLOR}{name}{COLOR_RESET}{' ' * (max_length - len(name)+4)} {commands.description}\n"
     return h
 
 
@@ -1,8 +1,17 @@
 from dataclasses import dataclass, field
 from dataclasses_json import config, dataclass_json
+import asyncio
+import atexit
+import dataclasses
 import datetime
+import functools
+import pathlib
+import queue
 import sqlite3
-from typing import Literal, Optional, Union
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Literal, Optional, Union
 
 from hackingBuddyGPT.utils.configurable import Global, configurable, parameter
 
@@ -91,77 +100,246 @@ class ToolCallStreamPart:
 LogTypes = Union[Run, Section, Message, MessageStreamPart, ToolCall, ToolCallStreamPart]
 
 
+@functools.lru_cache(maxsize=None)
+def _field_encoders(cls: type) -> tuple[tuple[str, Optional[Callable[[Any], Any]]], ...]:
+    return tuple((f.name, f.metadata.get("dataclasses_json", {}).get("encoder")) for f in dataclasses.fields(cls))
+
+
+def record_to_dict(record: LogTypes) -> dict[str, Any]:
+    """
+    The same as record.to_dict(), but without the generic machinery of dataclasses_json, which is much slower and not
+    needed as all fields of the log records are plain values (or have an encoder).
+    """
+    result = {}
+    for name, encoder in _field_encoders(type(record)):
+        value = getattr(record, name)
+        result[name] = encoder(value) if encoder is not None else value
+    return result
+
+# schema migrations, the n-th entry migrates a database from schema version n-1 to n (stored as PRAGMA user_version).
+# Only ever append to this list, databases that were created before the migrations existed have version 0, which is
+# why the initial migration uses CREATE TABLE IF NOT EXISTS.
+MIGRATIONS = [
+    # 1: initial schema
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+        id INTEGER PRIMARY KEY,
+        model text,
+        state TEXT,
+        tag TEXT,
+        started_at text,
+        stopped_at text,
+        configuration TEXT
+    );
+    CREATE TABLE IF NOT EXISTS sections (
+        run_id INTEGER,
+        id INTEGER,
+        name TEXT,
+        from_message INTEGER,
+        to_message INTEGER,
+        duration REAL,
+        PRIMARY KEY (run_id, id),
+        FOREIGN KEY (run_id) REFERENCES runs (id)
+    );
+    CREATE TABLE IF NOT EXISTS messages (
+        run_id INTEGER,
+        conversation TEXT,
+        id INTEGER,
+        version INTEGER DEFAULT 0,
+        role TEXT,
+        content TEXT,
+        duration REAL,
+        tokens_query INTEGER,
+        tokens_response INTEGER,
+        PRIMARY KEY (run_id, id),
+        FOREIGN KEY (run_id) REFERENCES runs (id)
+    );
+    CREATE TABLE IF NOT EXISTS tool_calls (
+        run_id INTEGER,
+        message_id INTEGER,
+        id TEXT,
+        version INTEGER DEFAULT 0,
+        function_name TEXT,
+        arguments TEXT,
+        state TEXT,
+        result_text TEXT,
+        duration REAL,
+        PRIMARY KEY (run_id, message_id, id),
+        FOREIGN KEY (run_id, message_id) REFERENCES messages (run_id, id)
+    );
+    """,
+    # 2: sections are read ordered by their first message
+    """
+    CREATE INDEX IF NOT EXISTS sections_by_from_message ON sections (run_id, from_message);
+    """,
+]
+
+# upper bound of statements that are grouped into a single transaction by the background writer
+MAX_BATCH_SIZE = 1000
+
+
+def _message_range(query: str, column: str, run_id: int, from_message: int, to_message: Optional[int]) -> tuple[str, tuple]:
+    query += f" AND {column} >= ?"
+    parameters = (run_id, from_message)
+    if to_message is not None:
+        query += f" AND {column} <= ?"
+        parameters += (to_message,)
+    return query, parameters
+
+
 @configurable("db_storage", "Stores the results of the experiments in a SQLite database")
+@dataclass
 class RawDbStorage:
-    def __init__(
-        self, connection_string: str = parameter(desc="sqlite3 database connection string for logs", default="wintermute.sqlite3")
-    ):
-        self.connection_string = connection_string
+    """
+    Writes are by default handed to a background writer thread through a bounded queue, which groups them into one
+    transaction per flush_interval, so that logging does not wait for a sqlite transaction (and fsync) per message.
+
+    Reads and create_run first wait for all queued writes, run_was_success and run_was_failure wait until the run is
+    fully persisted. Errors of queued writes are raised from the next flush().
+    """
+
+    connection_string: str = parameter(desc="sqlite3 database connection string for logs", default="wintermute.sqlite3")
+    write_behind: bool = parameter(desc="Write log entries from a background thread in batched transactions", default=True)
+    flush_interval: float = parameter(desc="Maximum number of seconds queued log entries are held before they are written", default=0.2)
+    queue_size: int = parameter(desc="Maximum number of queued log entries before logging blocks", default=10000)
+    busy_timeout: float = parameter(desc="Seconds to wait for another process that is writing to the same database", default=30)
+
+    _lock: threading.RLock = field(default_factory=threading.RLock)
+    _queue: Optional[queue.Queue] = None
+    _writer: Optional[threading.Thread] = None
+    _errors: list[Exception] = field(default_factory=list)
+    # read-only storages only open a read-only connection to an existing database, see ReadOnlyDbPool
+    _read_only: bool = False
 
     def init(self):
         self.connect()
+        if self._read_only:
+            return
         self.setup_db()
+        if self.write_behind:
+            self.start_writer()
 
     def connect(self):
-        self.db = sqlite3.connect(self.connection_string, isolation_level=None)
+        if self._read_only:
+            uri = f"{pathlib.Path(self.connection_string).absolute().as_uri()}?mode=ro"
+            self.db = sqlite3.connect(uri, uri=True, check_same_thread=False, timeout=self.busy_timeout)
+            self.db.row_factory = sqlite3.Row
+            self.cursor = self.db.cursor()
+            return
+
+        # the connection is shared with the writer thread, all access to it is serialized through self._lock
+        self.db = sqlite3.connect(self.connection_string, isolation_level=None, check_same_thread=False, timeout=self.busy_timeout)
         self.db.row_factory = sqlite3.Row
         self.cursor = self.db.cursor()
+        # WAL lets the viewer read while an agent is writing, and only needs to fsync on checkpoints
+        self.cursor.execute("PRAGMA journal_mode=WAL")
+        self.cursor.execute("PRAGMA synchronous=NORMAL")
+
+    def start_writer(self):
+        if self._writer is not None:
+            return
+        self._queue = queue.Queue(maxsize=self.queue_size)
+        self._writer = threading.Thread(target=self._write_loop, name="db-storage-writer", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Writes all queued statements and stops the writer thread."""
+        if self._writer is None:
+            return
+        self._queue.put(None)
+        self._writer.join()
+        self._writer = None
+        atexit.unregister(self.close)
+
+    def flush(self):
+        """Blocks until all statements queued so far are committed, and raises the first error that occurred while writing them."""
+        self.wait_for_writes()
+        if self._errors:
+            errors, self._errors = self._errors, []
+            raise errors[0]
+
+    def wait_for_writes(self):
+        """Blocks until all statements queued so far are written, without raising the errors of failed ones."""
+        if self._writer is not None:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+
+    def _write(self, query: str, params: tuple = ()):
+        if self._writer is None:
+            with self._lock:
+                self.cursor.execute(query, params)
+        else:
+            # blocks if the writer falls behind, which puts backpressure on the agent instead of growing without bounds
+            self._queue.put((query, params))
+
+    def _read(self, query: str, params: tuple = ()) -> list[sqlite3.Row]:
+        self.flush()
+        with self._lock:
+            return self.db.execute(query, params).fetchall()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            batch = []
+            waiters = []
+            stop = False
+            deadline = time.monotonic() + self.flush_interval
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= MAX_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            self._write_batch(batch)
+            for waiter in waiters:
+                waiter.set()
+            if stop:
+                return
+
+    def _write_batch(self, batch: list[tuple[str, tuple]]):
+        if not batch:
+            return
+
+        with self._lock:
+            try:
+                # the write lock is taken right away, so that concurrent writers (like the runs of an experiment) wait
+                # for each other instead of failing when upgrading from a read lock
+                self.db.execute("BEGIN IMMEDIATE")
+                for query, params in batch:
+                    self.db.execute(query, params)
+                self.db.execute("COMMIT")
+                return
+            except sqlite3.Error:
+                if self.db.in_transaction:
+                    self.db.execute("ROLLBACK")
+
+            # a single failing statement must not take the rest of the batch with it
+            for query, params in batch:
+                try:
+                    self.db.execute(query, params)
+                except sqlite3.Error as e:
+                    self._errors.append(e)
 
     def setup_db(self):
-        # create tables
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS runs (
-                id INTEGER PRIMARY KEY,
-                model text,
-                state TEXT,
-                tag TEXT,
-                started_at text,
-                stopped_at text,
-                configuration TEXT
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sections (
-                run_id INTEGER,
-                id INTEGER,
-                name TEXT,
-                from_message INTEGER,
-                to_message INTEGER,
-                duration REAL,
-                PRIMARY KEY (run_id, id),
-                FOREIGN KEY (run_id) REFERENCES runs (id)
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                run_id INTEGER,
-                conversation TEXT,
-                id INTEGER,
-                version INTEGER DEFAULT 0,
-                role TEXT,
-                content TEXT,
-                duration REAL,
-                tokens_query INTEGER,
-                tokens_response INTEGER,
-                PRIMARY KEY (run_id, id),
-                FOREIGN KEY (run_id) REFERENCES runs (id)
-            )
-        """)
-        self.cursor.execute("""
-            CREATE TABLE IF NOT EXISTS tool_calls (
-                run_id INTEGER,
-                message_id INTEGER,
-                id TEXT,
-                version INTEGER DEFAULT 0,
-                function_name TEXT,
-                arguments TEXT,
-                state TEXT,
-                result_text TEXT,
-                duration REAL,
-                PRIMARY KEY (run_id, message_id, id),
-                FOREIGN KEY (run_id, message_id) REFERENCES messages (run_id, id)
-            )
-        """)
+        # the schema version is kept in the user_version of the database, every migration that is newer than that is
+        # applied in its own transaction
+        version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+        if version > len(MIGRATIONS):
+            raise RuntimeError(f"database {self.connection_string} has schema version {version}, which is newer than the supported version {len(MIGRATIONS)}")
+
+        for number, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            self.db.executescript(f"BEGIN;\n{migration}\nPRAGMA user_version = {number};\nCOMMIT;")
 
     def get_runs(self) -> list[Run]:
         def deserialize(row):
@@ -170,79 +348,82 @@ class RawDbStorage:
             row["stopped_at"] = datetime.datetime.fromisoformat(row["stopped_at"]) if row["stopped_at"] else None
             return row
 
-        self.cursor.execute("SELECT * FROM runs")
-        return [Run(**deserialize(row)) for row in self.cursor.fetchall()]
+        return [Run(**deserialize(row)) for row in self._read("SELECT * FROM runs ORDER BY id")]
 
-    def get_sections_by_run(self, run_id: int) -> list[Section]:
+    def get_sections_by_run(self, run_id: int, from_message: int = 0, to_message: Optional[int] = None) -> list[Section]:
+        """The sections of the run that start at a message in [from_message, to_message] (to_message None is open)."""
         def deserialize(row):
             row = dict(row)
             row["duration"] = datetime.timedelta(seconds=row["duration"])
             return row
 
-        self.cursor.execute("SELECT * FROM sections WHERE run_id = ?", (run_id,))
-        return [Section(**deserialize(row)) for row in self.cursor.fetchall()]
+        query, parameters = _message_range("SELECT * FROM sections WHERE run_id = ?", "from_message", run_id, from_message, to_message)
+        return [Section(**deserialize(row)) for row in self._read(query + " ORDER BY from_message, id", parameters)]
 
-    def get_messages_by_run(self, run_id: int) -> list[Message]:
+    def get_messages_by_run(self, run_id: int, from_message: int = 0, limit: Optional[int] = None) -> list[Message]:
+        """The messages of the run starting at the id from_message, at most limit of them (all if limit is None)."""
         def deserialize(row):
             row = dict(row)
             row["duration"] = datetime.timedelta(seconds=row["duration"])
             return row
 
-        self.cursor.execute("SELECT * FROM messages WHERE run_id = ?", (run_id,))
-        return [Message(**deserialize(row)) for row in self.cursor.fetchall()]
+        query = "SELECT * FROM messages WHERE run_id = ? AND id >= ? ORDER BY id"
+        parameters = (run_id, from_message)
+        if limit is not None:
+            query += " LIMIT ?"
+            parameters += (limit,)
+        return [Message(**deserialize(row)) for row in self._read(query, parameters)]
 
-    def get_tool_calls_by_run(self, run_id: int) -> list[ToolCall]:
+    def get_tool_calls_by_run(self, run_id: int, from_message: int = 0, to_message: Optional[int] = None) -> list[ToolCall]:
+        """The tool calls of the run that belong to a message in [from_message, to_message] (to_message None is open)."""
         def deserialize(row):
             row = dict(row)
             row["duration"] = datetime.timedelta(seconds=row["duration"])
             return row
 
-        self.cursor.execute("SELECT * FROM tool_calls WHERE run_id = ?", (run_id,))
-        return [ToolCall(**deserialize(row)) for row in self.cursor.fetchall()]
+        query, parameters = _message_range("SELECT * FROM tool_calls WHERE run_id = ?", "message_id", run_id, from_message, to_message)
+        return [ToolCall(**deserialize(row)) for row in self._read(query + " ORDER BY message_id, id", parameters)]
 
     def create_run(self, model: str, tag: str, started_at: datetime.datetime, configuration: str) -> int:
-        self.cursor.execute(
-            "INSERT INTO runs (model, state, tag, started_at, configuration) VALUES (?, ?, ?, ?, ?)",
-            (model, "in progress", tag, started_at, configuration),
-        )
-        return self.cursor.lastrowid
+        # the id of the run is needed right away, so this is written synchronously
+        self.flush()
+        with self._lock:
+            self.cursor.execute(
+                "INSERT INTO runs (model, state, tag, started_at, configuration) VALUES (?, ?, ?, ?, ?)",
+                (model, "in progress", tag, started_at, configuration),
+            )
+            return self.cursor.lastrowid
 
     def add_message(self, run_id: int, message_id: int, conversation: Optional[str], role: str, content: str, tokens_query: int, tokens_response: int, duration: datetime.timedelta):
-        self.cursor.execute(
+        self._write(
             "INSERT INTO messages (run_id, conversation, id, role, content, tokens_query, tokens_response, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
             (run_id, conversation, message_id, role, content, tokens_query, tokens_response, duration.total_seconds())
         )
 
     def add_or_update_message(self, run_id: int, message_id: int, conversation: Optional[str], role: str, content: str, tokens_query: int, tokens_response: int, duration: datetime.timedelta):
-        self.cursor.execute(
-            "SELECT COUNT(*) FROM messages WHERE run_id = ? AND id = ?",
-            (run_id, message_id),
+        # an empty content keeps the content that is already stored, which might have been streamed in before
+        self._write(
+            """
+            INSERT INTO messages (run_id, conversation, id, role, content, tokens_query, tokens_response, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (run_id, id) DO UPDATE SET
+                conversation = excluded.conversation,
+                role = excluded.role,
+                content = CASE WHEN length(excluded.content) > 0 THEN excluded.content ELSE messages.content END,
+                tokens_query = excluded.tokens_query,
+                tokens_response = excluded.tokens_response,
+                duration = excluded.duration
+            """,
+            (run_id, conversation, message_id, role, content, tokens_query, tokens_response, duration.total_seconds()),
         )
-        if self.cursor.fetchone()[0] == 0:
-            self.cursor.execute(
-                "INSERT INTO messages (run_id, conversation, id, role, content, tokens_query, tokens_response, duration) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                (run_id, conversation, message_id, role, content, tokens_query, tokens_response, duration.total_seconds()),
-            )
-        else:
-            if len(content) > 0:
-                self.cursor.execute(
-                    "UPDATE messages SET conversation = ?, role = ?, content = ?, tokens_query = ?, tokens_response = ?, duration = ? WHERE run_id = ? AND id = ?",
-                    (conversation, role, content, tokens_query, tokens_response, duration.total_seconds(), run_id, message_id),
-                )
-            else:
-                self.cursor.execute(
-                    "UPDATE messages SET conversation = ?, role = ?, tokens_query = ?, tokens_response = ?, duration = ? WHERE run_id = ? AND id = ?",
-                    (conversation, role, tokens_query, tokens_response, duration.total_seconds(), run_id, message_id),
-                )
 
     def add_section(self, run_id: int, section_id: int, name: str, from_message: int, to_message: int, duration: datetime.timedelta):
-        self.cursor.execute(
+        self._write(
             "INSERT OR REPLACE INTO sections (run_id, id, name, from_message, to_message, duration) VALUES (?, ?, ?, ?, ?, ?)",
             (run_id, section_id, name, from_message, to_message, duration.total_seconds())
         )
 
     def add_tool_call(self, run_id: int, message_id: int, tool_call_id: str, function_name: str, arguments: str, result_text: str, duration: datetime.timedelta):
-        self.cursor.execute(
+        self._write(
             "INSERT INTO tool_calls (run_id, message_id, id, function_name, arguments, result_text, duration) VALUES (?, ?, ?, ?, ?, ?, ?)",
             (run_id, message_id, tool_call_id, function_name, arguments, result_text, duration.total_seconds()),
         )
@@ -250,42 +431,102 @@ class RawDbStorage:
     def handle_message_update(self, run_id: int, message_id: int, action: StreamAction, content: str):
         if action != "append":
             raise ValueError("unsupported action" + action)
-        self.cursor.execute(
+        self._write(
             "UPDATE messages SET content = content || ?, version = version + 1 WHERE run_id = ? AND id = ?",
             (content, run_id, message_id),
         )
 
     def finalize_message(self, run_id: int, message_id: int, tokens_query: int, tokens_response: int, duration: datetime.timedelta, overwrite_finished_message: Optional[str] = None):
         if overwrite_finished_message:
-            self.cursor.execute(
+            self._write(
                 "UPDATE messages SET content = ?, tokens_query = ?, tokens_response = ?, duration = ? WHERE run_id = ? AND id = ?",
                 (overwrite_finished_message, tokens_query, tokens_response, duration.total_seconds(), run_id, message_id),
             )
         else:
-            self.cursor.execute(
+            self._write(
                 "UPDATE messages SET tokens_query = ?, tokens_response = ?, duration = ? WHERE run_id = ? AND id = ?",
                 (tokens_query, tokens_response, duration.total_seconds(), run_id, message_id),
             )
 
     def update_run(self, run_id: int, model: str, state: str, tag: str, started_at: datetime.datetime, stopped_at: datetime.datetime, configuration: str):
-        self.cursor.execute(
+        self._write(
             "UPDATE runs SET model = ?, state = ?, tag = ?, started_at = ?, stopped_at = ?, configuration = ? WHERE id = ?",
             (model, state, tag, started_at, stopped_at, configuration, run_id),
         )
 
     def run_was_success(self, run_id):
-        self.cursor.execute(
+        self._write(
             "update runs set state=?,stopped_at=datetime('now') where id = ?",
             ("got root", run_id),
         )
-        self.db.commit()
+        self.flush()
 
     def run_was_failure(self, run_id: int, reason: str):
-        self.cursor.execute(
+        self._write(
             "update runs set state=?, stopped_at=datetime('now') where id = ?",
             (reason, run_id),
         )
-        self.db.commit()
+        self.flush()
 
 
 DbStorage = Global(RawDbStorage)
+
+
+class ReadOnlyDbPool:
+    """
+    Runs the reads of a storage on a pool of worker threads, each with its own read-only connection to the database, so
+    that an asyncio application (like the Viewer) does not block its event loop while reading, and reads do not wait for
+    each other or for the writer.
+
+    The read-only connections only see committed data, so reads first wait until everything queued on the storage is
+    written. Databases that can not be opened a second time (":memory:") are read through the storage itself.
+    """
+
+    def __init__(self, storage: RawDbStorage, size: int = 4):
+        self.storage = storage
+        self.size = size
+        self._shared = storage.connection_string == ":memory:" or "mode=memory" in storage.connection_string
+        self._executor = ThreadPoolExecutor(max_workers=1 if self._shared else size, thread_name_prefix="db-reader")
+        self._local = threading.local()
+        self._readers: list[RawDbStorage] = []
+        self._lock = threading.Lock()
+
+    def _reader(self) -> RawDbStorage:
+        if self._shared:
+            return self.storage
+
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            reader = RawDbStorage(self.storage.connection_string, write_behind=False, busy_timeout=self.storage.busy_timeout, _read_only=True)
+            reader.init()
+            self._local.reader = reader
+            with self._lock:
+                self._readers.append(reader)
+        return reader
+
+    def _read(self, method: str, *args):
+        self.storage.wait_for_writes()
+        return getattr(self._reader(), method)(*args)
+
+    async def read(self, method: str, *args):
+        """Calls the given get_* method of the storage in a worker thread."""
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._read, method, *args)
+
+    async def get_runs(self) -> list[Run]:
+        return await self.read("get_runs")
+
+    async def get_sections_by_run(self, run_id: int, from_message: int = 0, to_message: Optional[int] = None) -> list[Section]:
+        return await self.read("get_sections_by_run", run_id, from_message, to_message)
+
+    async def get_messages_by_run(self, run_id: int, from_message: int = 0, limit: Optional[int] = None) -> list[Message]:
+        return await self.read("get_messages_by_run", run_id, from_message, limit)
+
+    async def get_tool_calls_by_run(self, run_id: int, from_message: int = 0, to_message: Optional[int] = None) -> list[ToolCall]:
+        return await self.read("get_tool_calls_by_run", run_id, from_message, to_message)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            readers, self._readers = self._readers, []
+        for reader in readers:
+            reader.db.close()
@@ -0,0 +1,85 @@
+import datetime
+import socket
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# connection setup happens synchronously on the thread that sends the request, so a thread local is enough to hand the
+# time spent in connect() (TCP + TLS handshake) from the urllib3 connection back up to the adapter
+_timings = threading.local()
+
+
+def _record_connect(duration: float):
+    _timings.connect = getattr(_timings, "connect", 0.0) + duration
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        tic = time.perf_counter()
+        super().connect()
+        _record_connect(time.perf_counter() - tic)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        tic = time.perf_counter()
+        super().connect()
+        _record_connect(time.perf_counter() - tic)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """
+    A requests adapter that keeps a pool of connections open to each host and records how long it took to set up a
+    connection for every request that is sent through it (zero if an already open connection was reused).
+
+    The connect duration is attached to the returned response as `connect_duration`.
+    """
+
+    def __init__(self, pool_size: int = 10, keep_alive: bool = True, **kwargs):
+        self.keep_alive = keep_alive
+        super().__init__(pool_connections=pool_size, pool_maxsize=pool_size, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        if self.keep_alive:
+            # TCP keepalive probes stop NATs and load balancers from silently dropping idle pooled connections, which
+            # would otherwise only be noticed when the next request fails
+            pool_kwargs.setdefault(
+                "socket_options", HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+            )
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        if not self.keep_alive:
+            request.headers["Connection"] = "close"
+
+        _timings.connect = 0.0
+        response = super().send(request, **kwargs)
+        response.connect_duration = datetime.timedelta(seconds=_timings.connect)
+        return response
+
+
+def create_session(pool_size: int = 10, keep_alive: bool = True) -> requests.Session:
+    """
+    Creates a requests.Session that reuses connections through a PooledHTTPAdapter for both http and https.
+    """
+    session = requests.Session()
+    adapter = PooledHTTPAdapter(pool_size=pool_size, keep_alive=keep_alive)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
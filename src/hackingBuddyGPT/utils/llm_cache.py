@@ -0,0 +1,165 @@
+import hashlib
+import json
+import pickle
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional, Union
+
+from hackingBuddyGPT.utils.configurable import configurable, parameter
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+
+# attributes of an LLM connection that influence the sampling and therefore need to be part of the cache key
+SAMPLING_ATTRIBUTES = ("temperature", "top_p", "max_tokens", "seed", "api_path")
+
+
+class CacheMissError(Exception):
+    """
+    Raised by a CachedLLM in replay only mode, when a prompt was not recorded before.
+    """
+
+    def __init__(self, key: str, model: str):
+        super().__init__(f"No recorded response for prompt {key} (model '{model}') and the cache is in replay only mode")
+        self.key = key
+        self.model = model
+
+
+@configurable("sqlite", "Content addressed on-disk cache of LLM responses")
+@dataclass
+class LLMCache:
+    cache_file: str = parameter(desc="sqlite3 file in which the LLM responses are cached", default="llm_cache.sqlite3")
+    max_size: int = parameter(desc="Maximum size of all cached responses in bytes, least recently used ones are evicted first (0 for unlimited)", default=256 * 1024 * 1024)
+    replay_only: bool = parameter(desc="Only answer from the cache and fail on prompts that were not recorded before", default=False)
+
+    _db: sqlite3.Connection = None
+    _lock: threading.Lock = None
+
+    hits: int = field(init=False, default=0)
+    misses: int = field(init=False, default=0)
+
+    def init(self):
+        # the cache can be used from worker threads (see LLM.aget_response), so access is serialized through a lock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(self.cache_file, isolation_level=None, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                value BLOB,
+                size INTEGER,
+                created_at REAL,
+                last_used REAL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+
+    def get(self, key: str) -> Optional[LLMResult]:
+        with self._lock:
+            row = self._db.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._db.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return pickle.loads(row[0])
+
+    def put(self, key: str, model: str, result: LLMResult):
+        value = pickle.dumps(result)
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, value, size, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, value, len(value), now, now),
+            )
+            self._evict()
+
+    def size(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def _evict(self):
+        if self.max_size <= 0:
+            return
+
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_size:
+            return
+
+        evict = []
+        for key, size in self._db.execute("SELECT key, size FROM responses ORDER BY last_used ASC"):
+            if total <= self.max_size:
+                break
+            evict.append((key,))
+            total -= size
+        self._db.executemany("DELETE FROM responses WHERE key = ?", evict)
+
+
+class CachedLLM(LLM):
+    """
+    Wraps any LLM, so that responses are answered from an LLMCache if the same model was already queried with the same
+    rendered prompt and sampling parameters.
+
+    With a cache in replay only mode, an agent can be run deterministically and offline against a recorded trace.
+    Everything apart from get_response is passed through to the wrapped LLM.
+    """
+
+    def __init__(self, llm: LLM, cache: LLMCache):
+        self.llm = llm
+        self.cache = cache
+
+    def __getattr__(self, name: str) -> Any:
+        # only called if the attribute was not found on the CachedLLM itself, so things like context_size and model
+        # come from the wrapped LLM
+        return getattr(self.__dict__["llm"], name)
+
+    def cache_key(self, prompt, **kwargs) -> str:
+        params = {name: getattr(self.llm, name) for name in SAMPLING_ATTRIBUTES if hasattr(self.llm, name)}
+        for name, value in kwargs.items():
+            if name == "capabilities" and isinstance(value, dict):
+                value = sorted(value.keys())
+            params[name] = value
+
+        key_data = {"model": getattr(self.llm, "model", type(self.llm).__name__), "prompt": prompt, "params": params}
+        serialized = json.dumps(key_data, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode()).hexdigest()
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
+        # render templates up front, so that the key is built from the prompt that is actually sent
+        if hasattr(prompt, "render"):
+            prompt = prompt.render(**kwargs)
+            kwargs = {}
+
+        key = self.cache_key(prompt, **kwargs)
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+
+        model = getattr(self.llm, "model", type(self.llm).__name__)
+        if self.cache.replay_only:
+            raise CacheMissError(key, model)
+
+        result = self.llm.get_response(prompt, **kwargs)
+        self.cache.put(key, model, result)
+        return result
+
+    def encode(self, query) -> list[int]:
+        return self.llm.encode(query)
+
+    def decode(self, tokens: list[int]) -> str:
+        return self.llm.decode(tokens)
+
+    def count_tokens(self, query) -> int:
+        return self.llm.count_tokens(query)
+
+
+@configurable("none", "Do not cache LLM responses")
+@dataclass
+class NoLLMCache:
+    pass
+
+
+# the cache is opt-in, e.g. `--llm_cache=sqlite --llm_cache.cache_file=trace.sqlite3 --llm_cache.replay_only=True` re-runs
+# an agent against the responses that were recorded into trace.sqlite3 before
+LLMCacheChoice = Union[NoLLMCache, LLMCache]
+llm_cache_param = parameter(desc="cache for the LLM responses, to record agent runs and replay them offline", default="none")
@@ -0,0 +1,183 @@
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+from hackingBuddyGPT.utils.rate_limit import TransientError, jittered_backoff
+
+
+class NoBackendAvailableError(Exception):
+    """Raised by an LLMPool if the circuits of all backends are open, or all of them failed for a request."""
+
+
+@dataclass
+class Backend:
+    """One LLM of an LLMPool together with the statistics that the routing is based on."""
+
+    name: str
+    llm: LLM
+    in_flight: int = 0
+    # exponentially weighted moving average of the request duration in seconds, None until the first response
+    latency: Optional[float] = None
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    # the circuit is open (no requests are sent) from opened_at until recovery_time has passed, then a single request
+    # is let through to probe whether the backend is back (half open)
+    opened_at: Optional[float] = None
+    probing: bool = False
+
+    def expected_wait(self) -> float:
+        return (self.in_flight + 1) * (self.latency or 0)
+
+
+class LLMPool(LLM):
+    """
+    Balances the requests over several LLMs that serve the same model (e.g. multiple local inference servers).
+
+    Every request goes to the healthy backend that is expected to answer first, which is the one with the smallest
+    (in-flight requests + 1) * EWMA latency. Backends without a measured latency yet are tried first.
+
+    A backend that failed failure_threshold requests in a row is ejected (its circuit opens) for recovery_time seconds,
+    after which a single probe request decides whether it is taken back. Only TransientErrors (timeouts, connection
+    errors, rate-limits and server errors) count as failures of a backend, any other error is caused by the request
+    itself and is raised right away.
+
+    A request that fails on one backend is retried on the next best one. Once it failed on all of them (or all are
+    ejected), the pool backs off and tries again, up to retries times, waiting at least until the first ejected backend
+    may be probed again.
+    """
+
+    def __init__(
+        self,
+        backends: dict[str, LLM],
+        latency_smoothing: float = 0.3,
+        failure_threshold: int = 3,
+        recovery_time: float = 30,
+        retries: int = 3,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        if not backends:
+            raise ValueError("An LLMPool needs at least one backend")
+        self.backends = [Backend(name, llm) for name, llm in backends.items()]
+        self.latency_smoothing = latency_smoothing
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.clock = clock
+        self.sleep = sleep
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name: str) -> Any:
+        # attributes like model and context_size are the same for all backends
+        return getattr(self.__dict__["backends"][0].llm, name)
+
+    def _available(self, backend: Backend, now: float) -> bool:
+        if backend.opened_at is None:
+            return True
+        return not backend.probing and now - backend.opened_at >= self.recovery_time
+
+    def acquire(self, exclude: set[str] = frozenset()) -> Optional[Backend]:
+        """Picks the backend for the next request and counts the request as in flight on it."""
+        with self._lock:
+            now = self.clock()
+            candidates = [backend for backend in self.backends if backend.name not in exclude and self._available(backend, now)]
+            if not candidates:
+                return None
+            backend = min(candidates, key=lambda backend: (backend.latency is not None, backend.expected_wait(), backend.in_flight))
+            if backend.opened_at is not None:
+                backend.probing = True
+            backend.in_flight += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend: Backend, duration: Optional[float]):
+        """Ends a request on the backend, duration is None if it failed."""
+        with self._lock:
+            backend.in_flight -= 1
+            backend.probing = False
+            if duration is None:
+                backend.failures += 1
+                backend.consecutive_failures += 1
+                if backend.opened_at is not None or backend.consecutive_failures >= self.failure_threshold:
+                    backend.opened_at = self.clock()
+                return
+
+            backend.consecutive_failures = 0
+            backend.opened_at = None
+            if backend.latency is None:
+                backend.latency = duration
+            else:
+                backend.latency += self.latency_smoothing * (duration - backend.latency)
+
+    def cancel(self, backend: Backend):
+        """Ends a request that failed because of the request itself, it does not count for or against the backend."""
+        with self._lock:
+            backend.in_flight -= 1
+            backend.probing = False
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
+        # render templates once, instead of once per backend that is tried
+        if hasattr(prompt, "render"):
+            prompt = prompt.render(**kwargs)
+            kwargs = {}
+
+        attempt = 0
+        while True:
+            tried = set()
+            error = None
+            while (backend := self.acquire(exclude=tried)) is not None:
+                tried.add(backend.name)
+                tic = time.monotonic()
+                try:
+                    result = backend.llm.get_response(prompt, **kwargs)
+                except TransientError as e:
+                    self.release(backend, None)
+                    print(f"[LLMPool] request to {backend.name} failed: {e}")
+                    error = e
+                    continue
+                except BaseException:
+                    self.cancel(backend)
+                    raise
+                self.release(backend, time.monotonic() - tic)
+                result.backend = backend.name
+                return result
+
+            if attempt >= self.retries:
+                if error is not None:
+                    raise NoBackendAvailableError(f"The request failed on all available backends ({', '.join(sorted(tried))})") from error
+                raise NoBackendAvailableError("All backends are ejected after failing too often")
+
+            delay = self.retry_delay(attempt, error)
+            print(f"[LLMPool] no backend could answer the request, retrying in {delay:.1f} seconds")
+            self.sleep(delay)
+            attempt += 1
+
+    def retry_delay(self, attempt: int, error: Optional[Exception]) -> float:
+        """
+        The jittered backoff before retry number attempt (honoring a Retry-After the error carries), but at least until
+        the first backend is available again.
+        """
+        delay = jittered_backoff(attempt, getattr(error, "retry_after", None), self.backoff_base, self.backoff_max)
+        with self._lock:
+            now = self.clock()
+            available_in = min(
+                0 if backend.opened_at is None else backend.opened_at + self.recovery_time - now
+                for backend in self.backends
+            )
+        return max(delay, available_in)
+
+    def encode(self, query) -> list[int]:
+        return self.backends[0].llm.encode(query)
+
+    def decode(self, tokens: list[int]) -> str:
+        return self.backends[0].llm.decode(tokens)
+
+    def count_tokens(self, query) -> int:
+        return self.backends[0].llm.count_tokens(query)
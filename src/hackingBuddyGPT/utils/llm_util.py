@@ -1,9 +1,15 @@
 import abc
+import asyncio
+import collections
 import datetime
+import functools
+import hashlib
 import re
+import threading
 import typing
 from dataclasses import dataclass
 
+import tiktoken
 from openai.types.chat import (
     ChatCompletionAssistantMessageParam,
     ChatCompletionFunctionMessageParam,
@@ -14,6 +20,8 @@ from openai.types.chat import (
 
 SAFETY_MARGIN = 128
 STEP_CUT_TOKENS = 128
+TOKEN_COUNT_CACHE_SIZE = 256
+TRIM_WINDOW_FACTOR = 8
 
 
 @dataclass
@@ -24,6 +32,12 @@ class LLMResult:
     duration: datetime.timedelta = datetime.timedelta(0)
     tokens_query: int = 0
     tokens_response: int = 0
+    # `duration` is the total time of the request, these split out how much of it was spent on setting up a new
+    # connection (zero if a pooled connection was reused) and on waiting for the first byte of the response
+    duration_connect: datetime.timedelta = datetime.timedelta(0)
+    duration_first_byte: datetime.timedelta = datetime.timedelta(0)
+    # the endpoint that answered, which is of interest if the requests are balanced over several (see LLMPool)
+    backend: str = ""
 
 
 class LLM(abc.ABC):
@@ -36,12 +50,127 @@ class LLM(abc.ABC):
         """
         pass
 
+    async def aget_response(self, prompt, **kwargs) -> LLMResult:
+        """
+        aget_response is the asyncio variant of get_response, which allows to run multiple independent LLM queries at the
+        same time.
+        By default, the synchronous get_response is run in a worker thread, so that it does not block the event loop.
+        Connectors that have a native async client should override this.
+        """
+        return await asyncio.to_thread(self.get_response, prompt, **kwargs)
+
+    async def astream_response(self, prompt, **kwargs) -> typing.AsyncIterator[typing.Any]:
+        """
+        astream_response is the asyncio variant of streaming a response. It yields the incremental updates as they come
+        in, followed by the final LLMResult as the last element.
+        By default no incremental updates are available, so only the final LLMResult of aget_response is yielded.
+        """
+        yield await self.aget_response(prompt, **kwargs)
+
     @abc.abstractmethod
     def encode(self, query) -> list[int]:
         pass
 
+    def decode(self, tokens: list[int]) -> str:
+        """
+        decode turns tokens as returned from encode back into text. This is optional, but allows to cut text at exact
+        token boundaries (see trim_result_front).
+        """
+        raise NotImplementedError()
+
+    _token_count_cache: typing.Optional["TokenCountCache"] = None
+
     def count_tokens(self, query) -> int:
-        return len(self.encode(query))
+        # the same strings (templates, the current state, the history) get counted multiple times per round, so the
+        # counts of the most recently seen strings are memoized
+        if self._token_count_cache is None:
+            self._token_count_cache = TokenCountCache(TOKEN_COUNT_CACHE_SIZE)
+        return self._token_count_cache.count(query, self.encode)
+
+    def token_count_cache_info(self) -> typing.Optional["TokenCountCacheInfo"]:
+        """
+        Returns the hits / misses / size statistics of the token count memo (None if nothing was counted yet).
+        """
+        if self._token_count_cache is None:
+            return None
+        return self._token_count_cache.cache_info()
+
+
+class TokenCountCacheInfo(typing.NamedTuple):
+    """Statistics of a TokenCountCache, like those of functools.lru_cache."""
+
+    hits: int
+    misses: int
+    maxsize: int
+    currsize: int
+
+
+class TokenCountCache:
+    """
+    Memo of the token counts of the most recently counted strings. It is keyed on a digest of the string instead of the
+    string itself, so that it does not keep large command outputs (like that of `find /`) alive.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._counts: collections.OrderedDict[bytes, int] = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, query: str, encode: typing.Callable[[str], list[int]]) -> int:
+        key = hashlib.blake2b(query.encode("utf-8", errors="surrogatepass"), digest_size=16).digest()
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return count
+            self.misses += 1
+
+        count = len(encode(query))
+        with self._lock:
+            self._counts[key] = count
+            if len(self._counts) > self.maxsize:
+                self._counts.popitem(last=False)
+        return count
+
+    def cache_info(self) -> TokenCountCacheInfo:
+        return TokenCountCacheInfo(self.hits, self.misses, self.maxsize, len(self._counts))
+
+
+def get_responses(llm: LLM, *queries: tuple[typing.Any, dict]) -> list[LLMResult]:
+    """
+    Sends independent queries (prompt and template arguments) to the LLM at the same time (see LLM.aget_response) and
+    returns the results in the same order.
+
+    This blocks until all results are there, so it is only for synchronous code like the steps of an agent. If the
+    calling thread already runs an event loop (an agent driven from async code), the queries can not be awaited here
+    and are sent one after the other instead.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        async def query_all():
+            return await asyncio.gather(*(llm.aget_response(prompt, **kwargs) for prompt, kwargs in queries))
+
+        return list(asyncio.run(query_all()))
+    return [llm.get_response(prompt, **kwargs) for prompt, kwargs in queries]
+
+
+@functools.lru_cache(maxsize=None)
+def encoding_for_model(model: str) -> tiktoken.Encoding:
+    """
+    tiktoken.encoding_for_model has to resolve the model name to an encoding on every call, as this happens for every
+    token count, the resolved encoding is cached per model.
+    """
+    return tiktoken.encoding_for_model(model)
+
+
+def decode_tokens(encoding: tiktoken.Encoding, tokens: list[int]) -> str:
+    # a cut token sequence can end (or start) in the middle of a multibyte character, which is dropped instead of
+    # being turned into a replacement character
+    return encoding.decode_bytes(tokens).decode("utf-8", errors="ignore")
 
 
 def system_message(content: str) -> ChatCompletionSystemMessageParam:
@@ -189,6 +318,96 @@ def cmd_output_fixer(cmd: str, capabilities=None, reasoning=False) -> str:
     return cmd.strip()
 
 
+def _encode_window(model: LLM, result: str, target_size: int, from_front: bool) -> typing.Optional[list[int]]:
+    """
+    Encodes only as much of the front (or the back) of result as is needed to get more than target_size tokens out of
+    it, growing the window geometrically, so that a 'find /' output does not have to be encoded as a whole.
+    Cutting the text can change how the tokens right at the cut are merged, so a window is only used if it has some
+    tokens to spare. Returns None, if the whole result has to be encoded anyway.
+    """
+    window = TRIM_WINDOW_FACTOR * target_size
+    while window < len(result):
+        tokens = model.encode(result[:window] if from_front else result[-window:])
+        if len(tokens) >= target_size + STEP_CUT_TOKENS:
+            return tokens
+        window *= 2
+    return None
+
+
+def _encode_for_trim(model: LLM, result: str, target_size: int, from_front: bool) -> typing.Optional[list[int]]:
+    """
+    Returns the tokens to cut target_size tokens from, or None if result already fits into target_size.
+    """
+    tokens = _encode_window(model, result, target_size, from_front)
+    if tokens is None:
+        if model.count_tokens(result) <= target_size:
+            return None
+        tokens = model.encode(result)
+    return tokens
+
+
+def trim_result_front(model: LLM, target_size: int, result: str) -> str:
+    """
+    Keeps the front of result, cutting off the end so that at most target_size tokens remain.
+
+    The result is cut at the exact token boundary and only the part that is kept needs to be encoded, which keeps this
+    linear in the size of the result. Only for LLMs that can not decode tokens back into text, the old approximation by
+    cutting off characters is used.
+    """
+    if target_size <= 0:
+        return ""
+
+    tokens = _encode_for_trim(model, result, target_size, from_front=True)
+    if tokens is None:
+        return result
+
+    try:
+        return model.decode(tokens[:target_size])
+    except NotImplementedError:
+        return _trim_result_by_steps(model, target_size, result, keep_front=True)
+
+
+def trim_result_back(model: LLM, target_size: int, result: str) -> str:
+    """
+    Keeps the end of result, cutting off the front so that at most target_size tokens remain.
+    """
+    if target_size <= 0:
+        return ""
+
+    tokens = _encode_for_trim(model, result, target_size, from_front=False)
+    if tokens is None:
+        return result
+
+    try:
+        return model.decode(tokens[-target_size:])
+    except NotImplementedError:
+        return _trim_result_by_steps(model, target_size, result, keep_front=False)
+
+
+ELISION_MARKER = "\n[...]\n"
+
+
+def trim_result_middle(model: LLM, target_size: int, result: str, marker: str = ELISION_MARKER) -> str:
+    """
+    Keeps the front and the end of result and replaces the middle with marker, so that at most target_size tokens
+    (including the marker) remain. This is useful for command outputs, where both the start and the final lines (eg.
+    error messages or a shell prompt) are of interest.
+    """
+    if target_size <= 0:
+        return ""
+
+    if _encode_for_trim(model, result, target_size, from_front=True) is None:
+        return result
+
+    budget = target_size - model.count_tokens(marker)
+    if budget <= 1:
+        return trim_result_front(model, target_size, result)
+
+    head = budget // 2
+    tail = budget - head
+    return trim_result_front(model, head, result) + marker + trim_result_back(model, tail, result)
+
+
 # this is ugly, but basically we only have an approximation how many tokens
 # we are currently using. So we cannot just cut down to the desired size
 # what we're doing is:
@@ -199,21 +418,23 @@ def cmd_output_fixer(cmd: str, capabilities=None, reasoning=False) -> str:
 #       than the unschaerfe introduced by the string-.token conversion
 #   - do a 'binary search' to cut-down to the desired size afterwards
 #
-# this should reduce the time needed to do the string->token conversion
-# as this can be long-running if the LLM puts in a 'find /' output
-def trim_result_front(model: LLM, target_size: int, result: str) -> str:
+# this is only used as fallback for LLMs that do not support decoding tokens
+def _trim_result_by_steps(model: LLM, target_size: int, result: str, keep_front: bool = True) -> str:
+    def cut(text: str, length: int) -> str:
+        return text[:length] if keep_front else text[len(text) - length:]
+
     cur_size = model.count_tokens(result)
     TARGET_SIZE_FACTOR = 3
     if cur_size > TARGET_SIZE_FACTOR * target_size:
         print(f"big step trim-down from {cur_size} to {2 * target_size}")
-        result = result[: TARGET_SIZE_FACTOR * target_size]
+        result = cut(result, TARGET_SIZE_FACTOR * target_size)
         cur_size = model.count_tokens(result)
 
     while cur_size > target_size:
         print(f"need to trim down from {cur_size} to {target_size}")
         diff = cur_size - target_size
         step = int((diff + STEP_CUT_TOKENS) / 2)
-        result = result[:-step]
+        result = cut(result, max(len(result) - step, 0))
         cur_size = model.count_tokens(result)
 
     return result
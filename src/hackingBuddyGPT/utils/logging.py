@@ -1,22 +1,30 @@
+import atexit
 import datetime
+import json
+import queue
 from enum import Enum
 import time
 from dataclasses import dataclass, field
 from functools import wraps
 from typing import Optional, Union
 import threading
+import uuid
 
 from dataclasses_json.api import dataclass_json
 
 from hackingBuddyGPT.utils import Console, DbStorage, LLMResult, configurable, parameter
-from hackingBuddyGPT.utils.db_storage.db_storage import StreamAction
+from hackingBuddyGPT.utils.db_storage.db_storage import StreamAction, record_to_dict
 from hackingBuddyGPT.utils.configurable import Global, Transparent
 from rich.console import Group
 from rich.panel import Panel
+from websockets.exceptions import WebSocketException
 from websockets.sync.client import ClientConnection, connect as ws_connect
 
 from hackingBuddyGPT.utils.db_storage.db_storage import Run, Section, Message, MessageStreamPart, ToolCall, ToolCallStreamPart
 
+# upper bound of control messages that are sent to the log server in one frame
+MAX_BATCH_SIZE = 1000
+
 
 def log_section(name: str, logger_field_name: str = "log"):
     def outer(fun):
@@ -51,6 +59,10 @@ class MessageType(str, Enum):
     MESSAGE_STREAM_PART = "MessageStreamPart"
     TOOL_CALL = "ToolCall"
     TOOL_CALL_STREAM_PART = "ToolCallStreamPart"
+    # many control messages in one frame, see RemoteLogger
+    BATCH = "Batch"
+    # the answer of the log server to a frame of a RemoteLogger, once it stored it
+    ACK = "Ack"
 
     def get_class(self):
         return {
@@ -84,6 +96,8 @@ class LocalLogger:
     console: Console
 
     tag: str = parameter(desc="Tag for your current run", default="")
+    stream_flush_size: int = parameter(desc="Number of streamed characters that are collected before they are logged as one update", default=512)
+    stream_flush_interval: float = parameter(desc="Maximum number of seconds streamed characters are collected before they are logged", default=0.5)
 
     run: Run = field(init=False, default=None)  # field and not a parameter, since this can not be user configured
 
@@ -159,7 +173,7 @@ class LocalLogger:
         message_id = self._last_message_id
         self._last_message_id += 1
 
-        return MessageStreamLogger(self, message_id, self._current_conversation, role)
+        return MessageStreamLogger(self, message_id, self._current_conversation, role, self.stream_flush_size, self.stream_flush_interval)
 
     def add_message_update(self, message_id: int, action: StreamAction, content: str):
         self.log_db.handle_message_update(self.run.id, message_id, action, content)
@@ -168,10 +182,29 @@ class LocalLogger:
 @configurable("remote_logger", "Remote Logger")
 @dataclass
 class RemoteLogger:
+    """
+    Control messages are handed to a background sender thread through a bounded buffer, which collects them for
+    batch_interval seconds and sends them as one (permessage-deflate compressed) frame, instead of one frame per
+    message and stream part.
+
+    Starting a run does not wait for the log server either: the sender creates the run and fills in its id in all
+    messages that were logged before the id was known.
+
+    Every frame is kept until the log server acknowledged it. If the connection is lost, the sender reconnects and sends
+    the frames that were not acknowledged again (the log server recognizes frames it already stored by their id), only
+    when the log server stays unreachable for reconnect_timeout seconds the messages are dropped and the error is raised
+    from the next call. run_was_success and run_was_failure wait until everything is stored.
+    """
     console: Console
     log_server_address: str = parameter(desc="address:port of the log server to be used", default="localhost:4444")
 
     tag: str = parameter(desc="Tag for your current run", default="")
+    stream_flush_size: int = parameter(desc="Number of streamed characters that are collected before they are logged as one update", default=512)
+    stream_flush_interval: float = parameter(desc="Maximum number of seconds streamed characters are collected before they are logged", default=0.5)
+    batch_interval: float = parameter(desc="Maximum number of seconds control messages are collected to be sent to the log server in one frame, 0 sends every message in its own frame", default=0.1)
+    compression: bool = parameter(desc="Compress the frames sent to the log server (permessage-deflate)", default=True)
+    buffer_size: int = parameter(desc="Maximum number of control messages that are buffered for the log server before logging blocks", default=10000)
+    reconnect_timeout: float = parameter(desc="Number of seconds to keep trying to reconnect to the log server before giving up", default=30)
 
     run: Run = field(init=False, default=None)  # field and not a parameter, since this can not be user configured
 
@@ -179,19 +212,146 @@ class RemoteLogger:
     _last_section_id: int = 0
     _current_conversation: Optional[str] = None
     _upstream_websocket: ClientConnection = None
+    _queue: Optional[queue.Queue] = None
+    _sender: Optional[threading.Thread] = None
+    _error: Optional[Exception] = None
+    # frames are identified by the sender and the number of frames that were acknowledged before
+    _sender_id: str = ""
+    _acknowledged_frames: int = 0
 
-    def __del__(self):
-        if self._upstream_websocket:
-            self._upstream_websocket.close()
+    def connect(self) -> ClientConnection:
+        # TODO: we want to support wss at some point
+        return ws_connect(f"ws://{self.log_server_address}/ingress", compression="deflate" if self.compression else None)
 
     def init_websocket(self):
-        self._upstream_websocket = ws_connect(f"ws://{self.log_server_address}/ingress")  # TODO: we want to support wss at some point
+        """Connects to the log server (raising if it is not reachable) and starts the sender thread."""
+        if self._sender is not None:
+            return
+        self._upstream_websocket = self.connect()
+        self._sender_id = uuid.uuid4().hex
+        self._queue = queue.Queue(maxsize=self.buffer_size)
+        self._sender = threading.Thread(target=self._send_loop, name="remote-logger-sender", daemon=True)
+        self._sender.start()
+        atexit.register(self.close)
+
+    def close(self):
+        """Sends all buffered control messages, stops the sender thread and closes the connection."""
+        if self._sender is None:
+            return
+        self._queue.put(None)
+        self._sender.join()
+        self._sender = None
+        self._upstream_websocket.close()
+        atexit.unregister(self.close)
+
+    def flush(self):
+        """Blocks until all control messages logged so far are sent, raises if the log server was not reachable."""
+        if self._sender is not None:
+            done = threading.Event()
+            self._queue.put(done)
+            done.wait()
+        if self._error is not None:
+            raise self._error
 
     def send(self, type: MessageType, data: MessageData):
-        self._upstream_websocket.send(ControlMessage(type, data).to_json())
+        if self._error is not None:
+            raise self._error
+        # blocks if the log server falls behind, which puts backpressure on the agent instead of growing without bounds
+        self._queue.put((type, data))
+
+    def _send_loop(self):
+        while True:
+            item = self._queue.get()
+            records = []
+            waiters = []
+            stop = False
+            deadline = time.monotonic() + self.batch_interval
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    waiters.append(item)
+                    break
+                records.append(item)
+                if len(records) >= MAX_BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            try:
+                while records and self._error is None:
+                    try:
+                        self._send_records(records)
+                    except (OSError, WebSocketException) as e:
+                        self._reconnect(e)
+            except Exception as e:
+                # anything else (like an unexpected answer of the log server) is raised from the next call as well, the
+                # sender keeps running to drop the following messages, so that nobody waits for it forever
+                print(f"[RemoteLogger] sending to {self.log_server_address} failed: {e!r}")
+                self._error = e
+            finally:
+                for waiter in waiters:
+                    waiter.set()
+            if stop:
+                return
+
+    def _encode(self, type: MessageType, data: MessageData) -> dict:
+        # messages that were logged before the run was created carry no run id yet
+        encoded = record_to_dict(data)
+        if self.run is not None:
+            if type == MessageType.RUN and encoded["id"] is None:
+                encoded["id"] = self.run.id
+            elif encoded.get("run_id", 0) is None:
+                encoded["run_id"] = self.run.id
+        return {"type": type.value, "data": encoded}
+
+    def _send_records(self, records: list[tuple[MessageType, MessageData]]):
+        """Sends the records in order and removes the ones that were acknowledged from the list, so that the rest can be
+        sent again after a reconnect."""
+        while records:
+            type, data = records[0]
+            # the run is created on its own, as its id is needed for all other messages
+            creates_run = type == MessageType.RUN and self.run is not None and self.run.id is None
+            frame = records[:1] if creates_run or self.batch_interval <= 0 else records
+            runs = self._send_frame([self._encode(type, data) for type, data in frame])
+            if creates_run:
+                self.run.id = runs[0]["id"]
+            del records[:len(frame)]
+
+    def _send_frame(self, records: list[dict]) -> list[dict]:
+        """Sends the records as one frame and waits until the log server stored them, returns the runs it answered the
+        run messages with."""
+        frame_id = f"{self._sender_id}-{self._acknowledged_frames}"
+        self._upstream_websocket.send(json.dumps({"type": MessageType.BATCH.value, "data": {"frame": frame_id, "records": records}}))
+        ack = json.loads(self._upstream_websocket.recv())
+        if ack["type"] != MessageType.ACK.value or ack["data"]["frame"] != frame_id:
+            raise ValueError(f"unexpected answer of the log server: {ack}")
+        self._acknowledged_frames += 1
+        return ack["data"]["runs"]
+
+    def _reconnect(self, error: Exception):
+        print(f"[RemoteLogger] connection to {self.log_server_address} lost ({error}), reconnecting")
+        self._upstream_websocket.close()
+        deadline = time.monotonic() + self.reconnect_timeout
+        delay = 0.1
+        while True:
+            try:
+                self._upstream_websocket = self.connect()
+                return
+            except (OSError, WebSocketException) as e:
+                if time.monotonic() + delay > deadline:
+                    print(f"[RemoteLogger] giving up reconnecting to {self.log_server_address}: {e}")
+                    self._error = ConnectionError(f"Log server {self.log_server_address} is not reachable")
+                    self._error.__cause__ = e
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, 5)
 
     def start_run(self, name: str, configuration: str, tag: Optional[str] = None, start_time: Optional[datetime.datetime] = None, end_time: Optional[datetime.datetime] = None):
-        if self._upstream_websocket is None:
+        if self._sender is None:
             self.init_websocket()
 
         if self.run is not None:
@@ -203,9 +363,9 @@ class RemoteLogger:
         if start_time is None:
             start_time = datetime.datetime.now()
 
+        # the id is filled in by the sender, once the log server created the run
         self.run = Run(None, name, None, tag, start_time, None, configuration)
         self.send(MessageType.RUN, self.run)
-        self.run = Run.from_json(self._upstream_websocket.recv())
 
     def section(self, name: str) -> "LogSectionContext":
         return LogSectionContext(self, name, self._last_message_id)
@@ -254,7 +414,7 @@ class RemoteLogger:
         self.run.stopped_at = datetime.datetime.now()
         self.run.state = "success"
         self.send(MessageType.RUN, self.run)
-        self.run = Run.from_json(self._upstream_websocket.recv())
+        self.flush()
 
     def run_was_failure(self, reason: str, details: Optional[str] = None):
         full_reason = reason + ("" if details is None else f": {details}")
@@ -262,7 +422,7 @@ class RemoteLogger:
         self.run.stopped_at = datetime.datetime.now()
         self.run.state = reason
         self.send(MessageType.RUN, self.run)
-        self.run = Run.from_json(self._upstream_websocket.recv())
+        self.flush()
 
     def status_message(self, message: str):
         self.add_message("status", message, 0, 0, datetime.timedelta(0))
@@ -278,7 +438,7 @@ class RemoteLogger:
         message_id = self._last_message_id
         self._last_message_id += 1
 
-        return MessageStreamLogger(self, message_id, self._current_conversation, role)
+        return MessageStreamLogger(self, message_id, self._current_conversation, role, self.stream_flush_size, self.stream_flush_interval)
 
     def add_message_update(self, message_id: int, action: StreamAction, content: str):
         part = MessageStreamPart(id=None, run_id=self.run.id, message_id=message_id, action=action, content=content)
@@ -334,12 +494,23 @@ class LogConversationContext:
 
 @dataclass
 class MessageStreamLogger:
+    """
+    Streamed content is collected and only handed to the logger as one update once flush_size characters or
+    flush_interval seconds have accumulated, as every update has to be appended to the stored message. On finalize the
+    complete message is written once, with any content that was not flushed yet.
+    """
     logger: Logger
     message_id: int
     conversation: Optional[str]
     role: str
+    flush_size: int = 512
+    flush_interval: float = 0.5
 
     _completed: bool = False
+    _content: list[str] = field(default_factory=list)
+    _buffer: list[str] = field(default_factory=list)
+    _buffered: int = 0
+    _last_flush: float = field(default_factory=time.monotonic)
 
     def __post_init__(self):
         self.logger._add_or_update_message(self.message_id, self.conversation, self.role, "", 0, 0, datetime.timedelta(0))
@@ -352,9 +523,24 @@ class MessageStreamLogger:
     def append(self, content: str):
         if self._completed:
             raise ValueError("MessageStreamLogger already finalized")
-        self.logger.add_message_update(self.message_id, "append", content)
+        self._content.append(content)
+        self._buffer.append(content)
+        self._buffered += len(content)
+        if self._buffered >= self.flush_size or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if self._buffer:
+            self.logger.add_message_update(self.message_id, "append", "".join(self._buffer))
+        self._buffer = []
+        self._buffered = 0
+        self._last_flush = time.monotonic()
 
     def finalize(self, tokens_query: int, tokens_response: int, duration: datetime.timedelta, overwrite_finished_message: Optional[str] = None):
         self._completed = True
-        self.logger._add_or_update_message(self.message_id, self.conversation, self.role, "", tokens_query, tokens_response, duration)
+        content = overwrite_finished_message if overwrite_finished_message else "".join(self._content)
+        # the complete content replaces whatever was flushed before, so pending updates do not need to be sent anymore
+        self._buffer = []
+        self._buffered = 0
+        self.logger._add_or_update_message(self.message_id, self.conversation, self.role, content, tokens_query, tokens_response, duration)
         return self.message_id
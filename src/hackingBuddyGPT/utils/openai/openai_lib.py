@@ -1,10 +1,9 @@
 import datetime
 from dataclasses import dataclass
-from typing import Dict, Iterable, Optional, Union
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional, TypeVar, Union
 
 import instructor
 import openai
-import tiktoken
 from dataclasses import dataclass
 from openai.types import CompletionUsage
 from openai.types.chat import (
@@ -21,6 +20,10 @@ from hackingBuddyGPT.capabilities import Capability
 from hackingBuddyGPT.capabilities.capability import capabilities_to_tools
 from hackingBuddyGPT.utils import LLM, LLMResult, configurable
 from hackingBuddyGPT.utils.configurable import parameter
+from hackingBuddyGPT.utils.llm_util import decode_tokens, encoding_for_model
+from hackingBuddyGPT.utils.rate_limit import RateLimiter, RateLimitError, RateLimitHeaders, TransientError, shared_rate_limiter
+
+T = TypeVar("T")
 
 
 @configurable("openai-lib", "OpenAI Library based connection")
@@ -32,17 +35,80 @@ class OpenAILib(LLM):
     api_url: str = parameter(desc="URL of the OpenAI API", default="https://api.openai.com/v1")
     api_timeout: int = parameter(desc="Timeout for the API request", default=60)
     api_retries: int = parameter(desc="Number of retries when running into rate-limits", default=3)
+    api_backoff: int = parameter(desc="Maximum backoff time in seconds between retries, unless the API asks for a longer one", default=60)
+    api_requests_per_minute: int = parameter(desc="Maximum number of requests per minute (0 to only follow the rate-limits reported by the API)", default=0)
+    api_tokens_per_minute: int = parameter(desc="Maximum number of tokens per minute (0 to only follow the rate-limits reported by the API)", default=0)
+    api_max_concurrency: int = parameter(desc="Maximum number of concurrent requests, which is reduced while running into rate-limits", default=8)
 
     _client: openai.OpenAI = None
+    _async_client: openai.AsyncOpenAI = None
+    _rate_limiter: RateLimiter = None
 
     def init(self):
+        # the requests are retried by the rate limiter, which coordinates the backoff with all other connections
         self._client = openai.OpenAI(
             api_key=self.api_key,
             base_url=self.api_url,
             timeout=self.api_timeout,
-            max_retries=self.api_retries,
+            max_retries=0,
+        )
+        self._async_client = openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.api_url,
+            timeout=self.api_timeout,
+            max_retries=0,
         )
 
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        # shared with all other connections to the same endpoint in this process, see OpenAIConnection
+        if self._rate_limiter is None:
+            self._rate_limiter = shared_rate_limiter(
+                (self.api_url, self.api_key, self.model),
+                requests_per_minute=self.api_requests_per_minute,
+                tokens_per_minute=self.api_tokens_per_minute,
+                max_concurrency=self.api_max_concurrency,
+            )
+        return self._rate_limiter
+
+    def _tokens(self, prompt) -> int:
+        if not self.rate_limiter.limits_tokens:
+            return 0
+        contents = (message.get("content") if isinstance(message, dict) else getattr(message, "content", None) for message in prompt)
+        return sum(self.count_tokens(content) for content in contents if isinstance(content, str))
+
+    def _translate_errors(self, create: Callable[[], T]) -> T:
+        try:
+            return create()
+        except openai.APIError as e:
+            transient_error = self._transient_error(e)
+            if transient_error is None:
+                raise
+            raise transient_error from e
+
+    async def _atranslate_errors(self, create: Callable[[], Awaitable[T]]) -> T:
+        try:
+            return await create()
+        except openai.APIError as e:
+            transient_error = self._transient_error(e)
+            if transient_error is None:
+                raise
+            raise transient_error from e
+
+    def _transient_error(self, error: openai.APIError) -> Optional[TransientError]:
+        """The TransientError the limiter retries an error of the openai library as (the same ones OpenAIConnection retries)."""
+        if isinstance(error, openai.APITimeoutError):
+            return TransientError("Timeout while contacting LLM REST endpoint")
+        if isinstance(error, openai.APIConnectionError):
+            return TransientError(f"Connection error ({error})")
+        if isinstance(error, openai.APIStatusError) and (error.status_code in (408, 429) or error.status_code >= 500):
+            headers = RateLimitHeaders.parse(error.response.headers)
+            self.rate_limiter.update(headers)
+            if error.status_code == 429:
+                return RateLimitError("Running into rate-limits", headers.retry_after)
+            return TransientError(f"Error from Gateway ({error.status_code})", headers.retry_after)
+        return None
+
     @property
     def client(self) -> openai.OpenAI:
         return self._client
@@ -68,23 +134,52 @@ class OpenAILib(LLM):
         if capabilities:
             tools = capabilities_to_tools(capabilities)
 
-        tic = datetime.datetime.now()
-        response = self._client.chat.completions.create(
-            model=self.model,
-            messages=prompt,
-            tools=tools,
-        )
-        duration = datetime.datetime.now() - tic
-        message = response.choices[0].message
+        def request() -> LLMResult:
+            tic = datetime.datetime.now()
+            response = self._translate_errors(lambda: self._client.chat.completions.create(
+                model=self.model,
+                messages=prompt,
+                tools=tools,
+            ))
+            duration = datetime.datetime.now() - tic
+            message = response.choices[0].message
 
-        return LLMResult(
-            message,
-            str(prompt),
-            message.content,
-            duration,
-            response.usage.prompt_tokens,
-            response.usage.completion_tokens,
-        )
+            return LLMResult(
+                message,
+                str(prompt),
+                message.content,
+                duration,
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens,
+            )
+
+        return self.rate_limiter.call(request, self._tokens(prompt), _tokens_used, retries=self.api_retries, backoff_max=self.api_backoff)
+
+    async def aget_response(self, prompt, *, capabilities: Optional[Dict[str, Capability]] = None, **kwargs) -> LLMResult:
+        tools = None
+        if capabilities:
+            tools = capabilities_to_tools(capabilities)
+
+        async def request() -> LLMResult:
+            tic = datetime.datetime.now()
+            response = await self._atranslate_errors(lambda: self._async_client.chat.completions.create(
+                model=self.model,
+                messages=prompt,
+                tools=tools,
+            ))
+            duration = datetime.datetime.now() - tic
+            message = response.choices[0].message
+
+            return LLMResult(
+                message,
+                str(prompt),
+                message.content,
+                duration,
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens,
+            )
+
+        return await self.rate_limiter.acall(request, self._tokens(prompt), _tokens_used, retries=self.api_retries, backoff_max=self.api_backoff)
 
     def stream_response(self, prompt: Iterable[ChatCompletionMessageParam], console: Console, capabilities: Dict[str, Capability] = None, get_individual_updates=False) -> Union[LLMResult, Iterable[Union[ChoiceDelta, LLMResult]]]:
         generator = self._stream_response(prompt, console, capabilities)
@@ -100,85 +195,141 @@ class OpenAILib(LLM):
             tools = capabilities_to_tools(capabilities)
 
         tic = datetime.datetime.now()
-        chunks = self._client.chat.completions.create(
+        # only opening the stream goes through the rate limiter, the tokens are accounted for by the next update of the
+        # limits the API reports
+        chunks = self.rate_limiter.call(lambda: self._translate_errors(lambda: self._client.chat.completions.create(
             model=self.model,
             messages=prompt,
             tools=tools,
             stream=True,
             stream_options={"include_usage": True},
-        )
-
-        state = None
-        message = ChatCompletionMessage(role="assistant", content="", tool_calls=[])
-        usage: Optional[CompletionUsage] = None
+        )), retries=self.api_retries, backoff_max=self.api_backoff)
 
+        stream = _StreamAccumulator(console)
         for chunk in chunks:
-            outputs = 0
-            if len(chunk.choices) > 0:
-                if len(chunk.choices) > 1:
-                    print("WARNING: Got more than one choice in the stream response")
-
-                delta = chunk.choices[0].delta
-                if delta.role is not None and delta.role != message.role:
-                    print(f"WARNING: Got a role change to '{delta.role}' in the stream response")
-
-                if delta.content is not None:
-                    message.content += delta.content
-                    if state != "content":
-                        state = "content"
-                        console.print("\n\n[bold blue]ASSISTANT:[/bold blue]")
-                    console.print(delta.content, end="")
-                    outputs += 1
+            delta = stream.add(chunk)
+            if stream.aborted:
+                return
+            if delta is not None:
+                yield delta
 
-                if delta.tool_calls is not None and len(delta.tool_calls) > 0:
-                    if state != "tool_call":
-                        state = "tool_call"
-                    for tool_call in delta.tool_calls:
-                        if len(message.tool_calls) <= tool_call.index:
-                            if len(message.tool_calls) != tool_call.index:
-                                print(
-                                    f"WARNING: Got a tool call with index {tool_call.index} but expected {len(message.tool_calls)}"
-                                )
-                                return
-                            console.print(f"\n\n[bold red]TOOL CALL - {tool_call.function.name}:[/bold red]")
-                            message.tool_calls.append(
-                                ChatCompletionMessageToolCall(
-                                    id=tool_call.id,
-                                    function=Function(
-                                        name=tool_call.function.name, arguments=tool_call.function.arguments
-                                    ),
-                                    type="function",
-                                )
-                            )
-                        console.print(tool_call.function.arguments, end="")
-                        message.tool_calls[tool_call.index].function.arguments += tool_call.function.arguments
-                        outputs += 1
+        yield stream.finish(prompt, datetime.datetime.now() - tic)
 
+    async def astream_response(self, prompt: Iterable[ChatCompletionMessageParam], console: Console, capabilities: Dict[str, Capability] = None) -> AsyncIterator[Union[ChoiceDelta, LLMResult]]:
+        tools = None
+        if capabilities:
+            tools = capabilities_to_tools(capabilities)
+
+        tic = datetime.datetime.now()
+        # only opening the stream goes through the rate limiter, see _stream_response
+        chunks = await self.rate_limiter.acall(lambda: self._atranslate_errors(lambda: self._async_client.chat.completions.create(
+            model=self.model,
+            messages=prompt,
+            tools=tools,
+            stream=True,
+            stream_options={"include_usage": True},
+        )), retries=self.api_retries, backoff_max=self.api_backoff)
+
+        stream = _StreamAccumulator(console)
+        async for chunk in chunks:
+            delta = stream.add(chunk)
+            if stream.aborted:
+                return
+            if delta is not None:
                 yield delta
 
-            if chunk.usage is not None:
-                usage = chunk.usage
+        yield stream.finish(prompt, datetime.datetime.now() - tic)
+
+    def encode(self, query) -> list[int]:
+        return encoding_for_model(self.model).encode(query)
+
+    def decode(self, tokens: list[int]) -> str:
+        return decode_tokens(encoding_for_model(self.model), tokens)
+
+
+def _tokens_used(result: LLMResult) -> int:
+    return result.tokens_query + result.tokens_response
 
-            if outputs > 1:
-                print("WARNING: Got more than one output in the stream response")
 
-        console.print()
-        if usage is None:
+class _StreamAccumulator:
+    """
+    Collects the chunks of a streamed chat completion into the final message and prints them to the console as they
+    come in. This is shared by the sync and the async streaming implementations.
+    """
+
+    def __init__(self, console: Console):
+        self.console = console
+        self.state = None
+        self.message = ChatCompletionMessage(role="assistant", content="", tool_calls=[])
+        self.usage: Optional[CompletionUsage] = None
+        self.aborted = False
+
+    def add(self, chunk: ChatCompletionChunk) -> Optional[ChoiceDelta]:
+        outputs = 0
+        delta = None
+        if len(chunk.choices) > 0:
+            if len(chunk.choices) > 1:
+                print("WARNING: Got more than one choice in the stream response")
+
+            delta = chunk.choices[0].delta
+            if delta.role is not None and delta.role != self.message.role:
+                print(f"WARNING: Got a role change to '{delta.role}' in the stream response")
+
+            if delta.content is not None:
+                self.message.content += delta.content
+                if self.state != "content":
+                    self.state = "content"
+                    self.console.print("\n\n[bold blue]ASSISTANT:[/bold blue]")
+                self.console.print(delta.content, end="")
+                outputs += 1
+
+            if delta.tool_calls is not None and len(delta.tool_calls) > 0:
+                if self.state != "tool_call":
+                    self.state = "tool_call"
+                for tool_call in delta.tool_calls:
+                    if len(self.message.tool_calls) <= tool_call.index:
+                        if len(self.message.tool_calls) != tool_call.index:
+                            print(
+                                f"WARNING: Got a tool call with index {tool_call.index} but expected {len(self.message.tool_calls)}"
+                            )
+                            self.aborted = True
+                            return None
+                        self.console.print(f"\n\n[bold red]TOOL CALL - {tool_call.function.name}:[/bold red]")
+                        self.message.tool_calls.append(
+                            ChatCompletionMessageToolCall(
+                                id=tool_call.id,
+                                function=Function(
+                                    name=tool_call.function.name, arguments=tool_call.function.arguments
+                                ),
+                                type="function",
+                            )
+                        )
+                    self.console.print(tool_call.function.arguments, end="")
+                    self.message.tool_calls[tool_call.index].function.arguments += tool_call.function.arguments
+                    outputs += 1
+
+        if chunk.usage is not None:
+            self.usage = chunk.usage
+
+        if outputs > 1:
+            print("WARNING: Got more than one output in the stream response")
+
+        return delta
+
+    def finish(self, prompt, duration: datetime.timedelta) -> LLMResult:
+        self.console.print()
+        if self.usage is None:
             print("WARNING: Did not get usage information in the stream response")
-            usage = CompletionUsage(completion_tokens=0, prompt_tokens=0, total_tokens=0)
+            self.usage = CompletionUsage(completion_tokens=0, prompt_tokens=0, total_tokens=0)
 
-        if len(message.tool_calls) == 0:  # the openAI API does not like getting empty tool call lists
-            message.tool_calls = None
+        if len(self.message.tool_calls) == 0:  # the openAI API does not like getting empty tool call lists
+            self.message.tool_calls = None
 
-        toc = datetime.datetime.now()
-        yield LLMResult(
-            message,
+        return LLMResult(
+            self.message,
             str(prompt),
-            message.content,
-            toc - tic,
-            usage.prompt_tokens,
-            usage.completion_tokens,
+            self.message.content,
+            duration,
+            self.usage.prompt_tokens,
+            self.usage.completion_tokens,
         )
-
-    def encode(self, query) -> list[int]:
-        return tiktoken.encoding_for_model(self.model).encode(query)
@@ -1,13 +1,17 @@
-import time
+import dataclasses
 import datetime
 from dataclasses import dataclass
+from typing import Union
 
 import requests
 import tiktoken
 from urllib.parse import urlparse
 
 from hackingBuddyGPT.utils.configurable import configurable, parameter
-from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+from hackingBuddyGPT.utils.http_pool import create_session
+from hackingBuddyGPT.utils.llm_pool import LLMPool
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult, decode_tokens, encoding_for_model
+from hackingBuddyGPT.utils.rate_limit import RateLimiter, RateLimitError, RateLimitHeaders, TransientError, shared_rate_limiter
 
 
 @configurable("openai-compatible-llm-api", "OpenAI-compatible LLM API")
@@ -29,16 +33,50 @@ class OpenAIConnection(LLM):
     api_url: str = parameter(desc="URL of the OpenAI API", default="https://api.openai.com")
     api_path: str = parameter(desc="Path to the OpenAI API", default="/v1/chat/completions")
     api_timeout: int = parameter(desc="Timeout for the API request", default=240)
-    api_backoff: int = parameter(desc="Backoff time in seconds when running into rate-limits", default=60)
-    api_retries: int = parameter(desc="Number of retries when running into rate-limits", default=3)
-
-    def get_response(self, prompt, *, retry: int = 0,azure_retry: int = 0, **kwargs) -> LLMResult:
-        if retry >= self.api_retries:
-            raise Exception("Failed to get response from OpenAI API")
-
+    api_backoff: int = parameter(desc="Maximum backoff time in seconds between retries, unless the API asks for a longer one", default=60)
+    api_retries: int = parameter(desc="Number of retries when running into rate-limits, timeouts or connection errors", default=3)
+    api_pool_size: int = parameter(desc="Number of HTTP connections to the API that are kept open for reuse", default=4)
+    api_keep_alive: bool = parameter(desc="Keep HTTP connections to the API open between requests", default=True)
+    api_requests_per_minute: int = parameter(desc="Maximum number of requests per minute (0 to only follow the rate-limits reported by the API)", default=0)
+    api_tokens_per_minute: int = parameter(desc="Maximum number of tokens per minute (0 to only follow the rate-limits reported by the API)", default=0)
+    api_max_concurrency: int = parameter(desc="Maximum number of concurrent requests, which is reduced while running into rate-limits", default=8)
+
+    _session: requests.Session = None
+    _rate_limiter: RateLimiter = None
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            self._session = create_session(pool_size=self.api_pool_size, keep_alive=self.api_keep_alive)
+        return self._session
+
+    @property
+    def rate_limiter(self) -> RateLimiter:
+        # all connections to the same endpoint in this process share their rate limits
+        if self._rate_limiter is None:
+            self._rate_limiter = shared_rate_limiter(
+                (self.api_url, self.api_key, self.model),
+                requests_per_minute=self.api_requests_per_minute,
+                tokens_per_minute=self.api_tokens_per_minute,
+                max_concurrency=self.api_max_concurrency,
+            )
+        return self._rate_limiter
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
         if hasattr(prompt, "render"):
             prompt = prompt.render(**kwargs)
 
+        # the completion is not known up front, so only the prompt is counted and the rest is accounted for afterwards
+        tokens = self.count_tokens(prompt) if self.rate_limiter.limits_tokens else 0
+        return self.rate_limiter.call(
+            lambda: self._request(prompt),
+            tokens,
+            lambda result: result.tokens_query + result.tokens_response,
+            retries=self.api_retries,
+            backoff_max=self.api_backoff,
+        )
+
+    def _request(self, prompt: str) -> LLMResult:
         if urlparse(self.api_url).hostname and urlparse(self.api_url).hostname.endswith(".azure.com"):
             # azure ai header
             headers = {"api-key": f"{self.api_key}"}
@@ -50,50 +88,98 @@ class OpenAIConnection(LLM):
 
         try:
             tic = datetime.datetime.now()
-            response = requests.post(f'{self.api_url}{self.api_path}', headers=headers, json=data, timeout=self.api_timeout)
+            response = self.session.post(f'{self.api_url}{self.api_path}', headers=headers, json=data, timeout=self.api_timeout, stream=True)
+            duration_first_byte = datetime.datetime.now() - tic
+            # read the whole body right away, so that the connection is handed back to the pool
+            _ = response.content
+        except requests.exceptions.ConnectionError as e:
+            raise TransientError(f"Connection error ({e})") from e
+        except requests.exceptions.Timeout as e:
+            raise TransientError("Timeout while contacting LLM REST endpoint") from e
 
-            if response.status_code == 429:
-                print(f"[RestAPI-Connector] running into rate-limits, waiting for {self.api_backoff} seconds")
-                time.sleep(self.api_backoff)
-                return self.get_response(prompt, retry=retry + 1)
+        rate_limits = RateLimitHeaders.parse(response.headers)
+        self.rate_limiter.update(rate_limits)
 
-            if response.status_code == 408:
-                if azure_retry < self.api_retries:
-                    print("Received 408 Status Code, trying again.")
-                    return self.get_response(prompt, azure_retry = azure_retry + 1)
-                else:
-                    raise Exception(f"Error from Gateway ({response.status_code})")
+        if response.status_code == 429:
+            raise RateLimitError("Running into rate-limits", rate_limits.retry_after)
 
-            if response.status_code != 200:
-                raise Exception(f"Error from OpenAI Gateway ({response.status_code})")
+        if response.status_code == 408 or response.status_code >= 500:
+            raise TransientError(f"Error from Gateway ({response.status_code})", rate_limits.retry_after)
 
-        except requests.exceptions.ConnectionError:
-            print("Connection error! Retrying in 5 seconds..")
-            time.sleep(5)
-            return self.get_response(prompt, retry=retry + 1)
-
-        except requests.exceptions.Timeout:
-            print("Timeout while contacting LLM REST endpoint")
-            return self.get_response(prompt, retry=retry + 1)
+        if response.status_code != 200:
+            raise Exception(f"Error from OpenAI Gateway ({response.status_code})")
 
         # now extract the JSON status message
         # TODO: error handling..
+        duration_connect = response.connect_duration
         response = response.json()
         result = response["choices"][0]["message"]["content"]
         tok_query = response["usage"]["prompt_tokens"]
         tok_res = response["usage"]["completion_tokens"]
         duration = datetime.datetime.now() - tic
 
-        return LLMResult(result, prompt, result, duration, tok_query, tok_res)
+        return LLMResult(result, prompt, result, duration, tok_query, tok_res, duration_connect, duration_first_byte, self.api_url)
 
-    def encode(self, query) -> list[int]:
+    def _encoding(self) -> tiktoken.Encoding:
         # I know this is crappy for all non-openAI models but sadly this
         # has to be good enough for now
         if self.model.startswith("gpt-") and not self.model.startswith("gpt-4o"):
-            encoding = tiktoken.encoding_for_model(self.model)
+            return encoding_for_model(self.model)
         else:
-            encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
-        return encoding.encode(query)
+            return encoding_for_model("gpt-3.5-turbo")
+
+    def encode(self, query) -> list[int]:
+        return self._encoding().encode(query)
+
+    def decode(self, tokens: list[int]) -> str:
+        return decode_tokens(self._encoding(), tokens)
+
+
+@configurable("openai-compatible-llm-api-pool", "Several OpenAI-compatible LLM APIs serving the same model")
+@dataclass
+class OpenAIConnectionPool(OpenAIConnection):
+    """
+    Balances the requests over several OpenAI-compatible APIs (e.g. multiple Ollama or vLLM instances) that serve the
+    same model, see LLMPool for how the backend for a request is chosen and failing backends are ejected.
+
+    All other parameters are shared by the connections to the different APIs. Each API has its own rate limiter, as the
+    rate limits of local inference servers are independent of each other.
+    """
+
+    api_urls: str = parameter(desc="Comma separated URLs of the OpenAI-compatible APIs (default: only api_url)", default="")
+    failure_threshold: int = parameter(desc="Number of failed requests in a row after which an API is ejected", default=3)
+    recovery_time: int = parameter(desc="Seconds after which an ejected API is probed with a request again", default=30)
+    latency_smoothing: float = parameter(desc="Weight of the newest request in the moving average of the latency of an API", default=0.3)
+
+    _pool: LLMPool = None
+
+    def init(self):
+        urls = [url.strip() for url in self.api_urls.split(",") if url.strip()] or [self.api_url]
+        settings = {field.name: getattr(self, field.name) for field in dataclasses.fields(OpenAIConnection) if not field.name.startswith("_")}
+        self._pool = LLMPool(
+            # failures are retried on the next API by the pool, instead of waiting for the same API to come back, and
+            # only once all APIs failed, the pool backs off for api_backoff and retries up to api_retries times
+            {url: OpenAIConnection(**{**settings, "api_url": url, "api_retries": 0}) for url in urls},
+            latency_smoothing=self.latency_smoothing,
+            failure_threshold=self.failure_threshold,
+            recovery_time=self.recovery_time,
+            retries=self.api_retries,
+            backoff_max=self.api_backoff,
+        )
+
+    @property
+    def pool(self) -> LLMPool:
+        if self._pool is None:
+            self.init()
+        return self._pool
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
+        return self.pool.get_response(prompt, **kwargs)
+
+
+# lets the user choose between a single API and a pool of them, for use cases that work with any OpenAI-compatible API
+OpenAICompatibleLLM = Union[OpenAIConnection, OpenAIConnectionPool]
+llm_param = parameter(desc="choice of OpenAI-compatible LLM connector", default="openai-compatible-llm-api")
 
 
 @configurable("openai/gpt-3.5-turbo", "OpenAI GPT-3.5 Turbo")
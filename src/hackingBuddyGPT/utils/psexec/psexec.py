@@ -1,10 +1,19 @@
+import atexit
+import threading
 from dataclasses import dataclass
-from typing import Tuple
+from typing import Callable, Optional, Tuple
 
 from pypsexec.client import Client
 
 from hackingBuddyGPT.utils.configurable import configurable
 
+from .shell_session import PSExecShellSession
+
+# the PAExec service (and its executable) is named after the local process, so all connections of this process to a host
+# share one service. It is installed by the first connection that needs it and removed again when the last one is closed
+_services_lock = threading.Lock()
+_service_users: dict[Tuple[str, int], int] = {}
+
 
 @configurable("psexec", "connects to a remote host via PSExec")
 @dataclass
@@ -14,13 +23,42 @@ class PSExecConnection:
     username: str
     password: str
     port: int = 445
+    timeout: int = 2  # seconds after which a command is stopped (or, in a shell session, no longer waited for)
+    connect_timeout: int = 60
+    use_shell_session: bool = False  # run commands in one long-lived shell instead of a new process per command
+    shell: str = "cmd"  # cmd or powershell, the shell used for the shell session
 
     _conn: Client = None
+    _shell: PSExecShellSession = None
+    _has_service: bool = False
 
     def init(self):
-        self._conn = Client(self.host, username=self.username, password=self.password, port=self.port)
-        self._conn.connect()
-        self._conn.create_service()
+        conn = Client(self.host, username=self.username, password=self.password, port=self.port)
+        conn.connect(timeout=self.connect_timeout)
+        try:
+            self._acquire_service(conn)
+        except Exception:
+            conn.disconnect()
+            raise
+        self._conn = conn
+        atexit.register(self.close)
+
+    def _acquire_service(self, conn: Client):
+        key = (self.host, self.port)
+        with _services_lock:
+            if not _service_users.get(key):
+                conn.create_service()
+            _service_users[key] = _service_users.get(key, 0) + 1
+            self._has_service = True
+
+    def _release_service(self):
+        key = (self.host, self.port)
+        with _services_lock:
+            self._has_service = False
+            _service_users[key] -= 1
+            if _service_users[key] == 0:
+                del _service_users[key]
+                self._conn.remove_service()
 
     def new_with(self, *, host=None, hostname=None, username=None, password=None, port=None) -> "PSExecConnection":
         return PSExecConnection(
@@ -29,8 +67,42 @@ class PSExecConnection:
             username=username or self.username,
             password=password or self.password,
             port=port or self.port,
+            timeout=self.timeout,
+            connect_timeout=self.connect_timeout,
+            use_shell_session=self.use_shell_session,
+            shell=self.shell,
         )
 
-    def run(self, cmd) -> Tuple[str, str, int]:
-        stdout, stderr, rc = self._conn.run_executable("cmd.exe", arguments=f"/c {cmd}", timeout_seconds=2)
+    def shell_session(self) -> PSExecShellSession:
+        """Returns the long-lived shell of this connection, which is started on first use (or if it ended)."""
+        if self._shell is None or self._shell.closed:
+            self._shell = PSExecShellSession.open(self._conn, self.shell)
+        return self._shell
+
+    def run(self, cmd, timeout: Optional[int] = None, on_output: Optional[Callable[[str], None]] = None) -> Tuple[str, str, Optional[int]]:
+        """
+        Runs cmd and returns stdout, stderr and the exit code. In a shell session stderr is part of stdout, and the exit
+        code is None if the command did not finish in time.
+        """
+        timeout = timeout if timeout is not None else self.timeout
+        if self.use_shell_session:
+            output, exit_code = self.shell_session().run(cmd, timeout, on_output)
+            return output, "", exit_code
+
+        stdout, stderr, rc = self._conn.run_executable("cmd.exe", arguments=f"/c {cmd}", timeout_seconds=timeout)
         return str(stdout), str(stderr), rc
+
+    def close(self):
+        """Ends the shell session, removes the PAExec service (if this is its last user) and disconnects."""
+        if self._conn is None:
+            return
+        atexit.unregister(self.close)
+        try:
+            if self._shell is not None:
+                self._shell.close()
+                self._shell = None
+            if self._has_service:
+                self._release_service()
+        finally:
+            self._conn.disconnect()
+            self._conn = None
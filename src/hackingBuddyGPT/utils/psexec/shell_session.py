@@ -0,0 +1,193 @@
+import codecs
+import functools
+import queue
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Callable, Optional, Tuple
+
+from pypsexec.client import Client
+from pypsexec.pipe import OutputPipe
+
+SENTINEL_PREFIX = "__HBG_DONE_"
+
+# number of characters at the end of the received output that are held back, as they could be the beginning of the
+# sentinel line
+HOLD_BACK = 128
+
+
+@dataclass(frozen=True)
+class ShellDialect:
+    executable: str
+    arguments: str
+    setup: str  # run once after the start, switches the output to UTF-8
+    sentinel: str  # prints the sentinel (with {marker} as placeholder) followed by the exit code of the last command
+
+
+SHELLS = {
+    # /q turns off the echo, so neither the prompt nor the sent commands show up in the output. %errorlevel% is expanded
+    # when the line is read, which is after the command before it finished
+    "cmd": ShellDialect("cmd.exe", "/q", "chcp 65001 >nul", "echo.& echo {marker} %errorlevel%"),
+    "powershell": ShellDialect(
+        "powershell.exe",
+        "-NoLogo -NoProfile -NonInteractive -Command -",
+        "[Console]::OutputEncoding = [Text.Encoding]::UTF8",
+        'Write-Output "`n{marker} $(if ($?) {{ 0 }} else {{ 1 }})"',
+    ),
+}
+
+
+class _StreamingOutputPipe(OutputPipe):
+    """Output pipe that hands every received chunk to sink right away, instead of collecting it until the process ended."""
+
+    def __init__(self, tree, name, sink: Callable[[bytes], None]):
+        self.sink = sink
+        super().__init__(tree, name)
+
+    def handle_output(self, output: bytes):
+        self.sink(output)
+
+    def get_output(self) -> bytes:
+        return b""
+
+
+class PSExecShellSession:
+    """
+    A long-lived cmd.exe or PowerShell process on the remote host, started once through the PAExec service, so that
+    neither the process start (and the setup of its pipes) has to be paid for every command, nor state like the working
+    directory or environment variables is lost between commands.
+
+    Commands are written to the stdin of the process, each followed by a command that prints a unique sentinel marker
+    and the exit code. stdout and stderr are streamed back while the command runs, so the end of the output is known as
+    soon as the marker arrives.
+
+    There is no way to interrupt a remote command over PAExec, so a command that does not finish within its timeout keeps
+    running. The next command is only sent once its marker arrived, until then `run` reports that it is still running.
+    """
+
+    def __init__(self, client: Client, dialect: ShellDialect):
+        self.client = client
+        self.dialect = dialect
+
+        self._stdin: queue.Queue[Optional[bytes]] = queue.Queue()
+        self._output: queue.Queue[Optional[bytes]] = queue.Queue()
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._pending = ""
+        self._running_marker: Optional[re.Pattern] = None
+        self._process: Optional[threading.Thread] = None
+        self.error: Optional[Exception] = None
+        self.closed = False
+
+    @classmethod
+    def open(cls, client: Client, shell: str = "cmd", setup_timeout: float = 30) -> "PSExecShellSession":
+        if shell not in SHELLS:
+            raise ValueError(f"unknown shell {shell!r}, expected one of {', '.join(SHELLS)}")
+        session = cls(client, SHELLS[shell])
+        session._process = threading.Thread(target=session._run_process, daemon=True)
+        session._process.start()
+
+        output, exit_code = session.run(session.dialect.setup, setup_timeout)
+        if exit_code is None:
+            session.close()
+            raise TimeoutError(f"{shell} did not get ready within {setup_timeout} seconds: {output!r}")
+        return session
+
+    def _run_process(self):
+        pipe = functools.partial(_StreamingOutputPipe, sink=self._output.put)
+        try:
+            self.client.run_executable(
+                self.dialect.executable,
+                arguments=self.dialect.arguments,
+                stdout=pipe,
+                stderr=pipe,
+                stdin=self._stdin_lines,
+            )
+        except Exception as e:
+            self.error = e
+        finally:
+            self.closed = True
+            self._output.put(None)
+
+    def _stdin_lines(self):
+        while True:
+            data = self._stdin.get()
+            if data is None:
+                return
+            yield data
+
+    def run(self, command: str, timeout: float, on_output: Optional[Callable[[str], None]] = None) -> Tuple[str, Optional[int]]:
+        """
+        Runs the command in the shell and returns its output (stdout and stderr in the order they arrived) and exit code.
+        The exit code is None if the command did not finish within timeout seconds or the shell is gone. on_output is
+        called with every part of the output as soon as it was received.
+        """
+        deadline = time.monotonic() + timeout
+        parts = []
+
+        def output(data: str):
+            if data:
+                parts.append(data)
+                if on_output is not None:
+                    on_output(data)
+
+        if self._running_marker is not None:
+            # the output of the previous command after its timeout is not of interest anymore, but it has to be finished
+            exit_code = self._read_until(self._running_marker, deadline, lambda data: None)
+            if exit_code is None and not self.closed:
+                return "the previous command is still running, wait for it to finish before sending the next one\n", None
+
+        if self.closed:
+            return self._closed_message(), None
+
+        token = uuid.uuid4().hex
+        sentinel = self.dialect.sentinel.format(marker=SENTINEL_PREFIX + token)
+        self._stdin.put(f"{command}\r\n{sentinel}\r\n".encode())
+        self._running_marker = re.compile(r"(\r?\n)?" + re.escape(SENTINEL_PREFIX + token) + r" (-?\d+)\r?\n")
+
+        exit_code = self._read_until(self._running_marker, deadline, output)
+        if exit_code is None and self.closed:
+            output(self._closed_message())
+        return "".join(parts), exit_code
+
+    def _read_until(self, marker: re.Pattern, deadline: float, output: Callable[[str], None]) -> Optional[int]:
+        while True:
+            match = marker.search(self._pending)
+            if match is not None:
+                output(self._pending[:match.start()])
+                self._pending = self._pending[match.end():]
+                self._running_marker = None
+                return int(match.group(2))
+
+            if len(self._pending) > HOLD_BACK:
+                output(self._pending[:-HOLD_BACK])
+                self._pending = self._pending[-HOLD_BACK:]
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            try:
+                data = self._output.get(timeout=remaining)
+            except queue.Empty:
+                return None
+            if data is None:  # the process ended
+                self._output.put(None)
+                output(self._pending + self._decoder.decode(b"", final=True))
+                self._pending = ""
+                return None
+
+            self._pending += self._decoder.decode(data)
+
+    def _closed_message(self) -> str:
+        if self.error is not None:
+            return f"the shell is gone: {self.error}\n"
+        return "the shell is gone\n"
+
+    def close(self, timeout: float = 5):
+        """Ends the shell, a command that is still running keeps it alive until it finished or the connection is closed."""
+        if not self.closed:
+            self._stdin.put(b"exit\r\n")
+        self._stdin.put(None)
+        if self._process is not None:
+            self._process.join(timeout)
@@ -0,0 +1,381 @@
+import asyncio
+import email.utils
+import math
+import random
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Mapping, Optional, TypeVar
+
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+
+T = TypeVar("T")
+
+# how often asyncio tasks check whether the limiter lets their request through while all slots are in use
+ASYNC_POLL_INTERVAL = 0.05
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+_DURATION = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class TransientError(Exception):
+    """
+    A request failed in a way that is worth retrying after a backoff (connection errors, timeouts, 408, 5xx).
+    retry_after is the time in seconds the server asked to wait before the next request, if it did.
+    """
+
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class RateLimitError(TransientError):
+    """The endpoint rejected a request because of its rate limits (HTTP 429)."""
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parses durations as sent in rate-limit headers, either plain seconds ("1.5") or with units ("6m0s", "20ms")."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _DURATION_UNITS[unit] for number, unit in parts)
+
+
+def jittered_backoff(attempt: int, retry_after: Optional[float] = None, base: float = 1, maximum: float = 60) -> float:
+    """
+    The time to wait before retry number attempt (starting at 0), growing exponentially from base up to maximum. The
+    jitter keeps clients that failed at the same time from retrying at the same time again.
+    """
+    cap = min(maximum, base * 2 ** attempt)
+    if retry_after is not None:
+        return retry_after + random.uniform(0, cap)
+    return cap / 2 + random.uniform(0, cap / 2)
+
+
+def _parse_int(value: Optional[str]) -> Optional[int]:
+    try:
+        return int(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+@dataclass
+class RateLimitHeaders:
+    """The rate-limit state an endpoint reported with a response (OpenAI style x-ratelimit-* and Retry-After headers)."""
+
+    retry_after: Optional[float] = None
+    limit_requests: Optional[int] = None
+    remaining_requests: Optional[int] = None
+    reset_requests: Optional[float] = None
+    limit_tokens: Optional[int] = None
+    remaining_tokens: Optional[int] = None
+    reset_tokens: Optional[float] = None
+
+    @classmethod
+    def parse(cls, headers: Mapping[str, str]) -> "RateLimitHeaders":
+        headers = {name.lower(): value for name, value in headers.items()}
+
+        retry_after = None
+        if "retry-after-ms" in headers:
+            retry_after = parse_duration(headers["retry-after-ms"])
+            retry_after = retry_after / 1000 if retry_after is not None else None
+        elif "retry-after" in headers:
+            retry_after = parse_duration(headers["retry-after"])
+            if retry_after is None:
+                # Retry-After can also be an HTTP date
+                try:
+                    retry_after = max(0.0, email.utils.parsedate_to_datetime(headers["retry-after"]).timestamp() - time.time())
+                except (TypeError, ValueError):
+                    retry_after = None
+
+        return cls(
+            retry_after=retry_after,
+            limit_requests=_parse_int(headers.get("x-ratelimit-limit-requests")),
+            remaining_requests=_parse_int(headers.get("x-ratelimit-remaining-requests")),
+            reset_requests=parse_duration(headers.get("x-ratelimit-reset-requests")),
+            limit_tokens=_parse_int(headers.get("x-ratelimit-limit-tokens")),
+            remaining_tokens=_parse_int(headers.get("x-ratelimit-remaining-tokens")),
+            reset_tokens=parse_duration(headers.get("x-ratelimit-reset-tokens")),
+        )
+
+
+class TokenBucket:
+    """
+    Allows per_minute units per minute, refilled continuously. A bucket without a limit (per_minute = 0) never waits,
+    until the endpoint reports its limit through the rate-limit headers.
+    """
+
+    def __init__(self, per_minute: float = 0):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    @property
+    def active(self) -> bool:
+        return self.capacity > 0
+
+    def _refill(self, now: float):
+        if self.active:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until amount units are available."""
+        if not self.active:
+            return 0
+        self._refill(now)
+        # a single request that is larger than the whole bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        # the level may become negative if usage was underestimated, which delays the following requests accordingly
+        if self.active:
+            self.level -= amount
+
+    def sync(self, limit: Optional[int], remaining: Optional[int], reset: Optional[float], now: float):
+        """Adopts the limit and remaining units the endpoint reported, which also account for other clients."""
+        if limit:
+            self._refill(now)
+            if not self.active:
+                self.level = float(limit)
+            self.capacity = float(limit)
+        if remaining is None or not self.active:
+            return
+        self._refill(now)
+        if reset:
+            # the endpoint is back at its full limit after reset seconds, so a continuously refilled bucket can at most
+            # be at this level right now
+            remaining = min(remaining, self.capacity - reset * self.capacity / 60)
+        self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    """
+    Client side rate limiting for one LLM endpoint, shared by everyone that sends requests to it (see
+    shared_rate_limiter), so that concurrent requests do not all run into the rate limit and then back off together.
+
+    - requests and tokens per minute are limited by token buckets, which are kept in sync with the x-ratelimit-*
+      headers of the responses (limits that are not configured are learned from them)
+    - the number of concurrent requests is adapted AIMD style: it is halved on every rate-limit and increased by one
+      per max_concurrency successful requests again
+    - a Retry-After pauses all requests, failed requests are retried with jittered exponential backoff
+
+    retries and backoff_max are defaults, connections that share the limiter can pass their own to call.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 0,
+        tokens_per_minute: int = 0,
+        max_concurrency: int = 8,
+        retries: int = 3,
+        backoff_base: float = 1,
+        backoff_max: float = 60,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.sleep = sleep
+
+        self.concurrency = float(max_concurrency)
+        self.in_flight = 0
+        self.rate_limited = 0
+
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+
+    @property
+    def limits_tokens(self) -> bool:
+        """Whether requests have to provide an estimate of the tokens they use."""
+        return self._tokens.active
+
+    def _try_acquire(self, tokens: int) -> float:
+        """
+        Starts a request if it may be sent right now and returns 0, otherwise the time to wait before trying again
+        (infinite while the maximum number of requests is in flight, until one is released). Needs the lock.
+        """
+        now = time.monotonic()
+        if self.in_flight >= max(1, int(self.concurrency)):
+            return math.inf
+        delay = max(self._paused_until - now, self._requests.delay(1, now), self._tokens.delay(tokens, now))
+        if delay > 0:
+            return delay
+        self._requests.take(1)
+        self._tokens.take(tokens)
+        self.in_flight += 1
+        return 0
+
+    def acquire(self, tokens: int = 0):
+        """Blocks until a request that uses about the given number of tokens may be sent."""
+        with self._condition:
+            while (delay := self._try_acquire(tokens)) > 0:
+                self._condition.wait(None if delay == math.inf else delay)
+
+    async def aacquire(self, tokens: int = 0):
+        """
+        The asyncio variant of acquire, which polls the limiter instead of blocking a thread. Nothing is acquired if the
+        task is cancelled while it waits.
+        """
+        while True:
+            with self._condition:
+                delay = self._try_acquire(tokens)
+            if delay == 0:
+                return
+            await asyncio.sleep(min(delay, ASYNC_POLL_INTERVAL))
+
+    def release(self, tokens: int = 0, tokens_used: Optional[int] = None, succeeded: bool = False, rate_limited: bool = False, retry_after: Optional[float] = None):
+        """Ends a request started with acquire, tokens_used corrects the estimate once the actual usage is known."""
+        with self._condition:
+            self.in_flight -= 1
+            if tokens_used is not None:
+                self._tokens.take(tokens_used - tokens)
+            if rate_limited:
+                self.rate_limited += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+                if retry_after:
+                    self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+            elif succeeded:
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1 / self.concurrency)
+            self._condition.notify_all()
+
+    def update(self, headers: RateLimitHeaders):
+        """Takes over the rate-limit state the endpoint reported with a response."""
+        with self._condition:
+            now = time.monotonic()
+            self._requests.sync(headers.limit_requests, headers.remaining_requests, headers.reset_requests, now)
+            self._tokens.sync(headers.limit_tokens, headers.remaining_tokens, headers.reset_tokens, now)
+            self._condition.notify_all()
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None, backoff_max: Optional[float] = None) -> float:
+        """The time to wait before retry number attempt (starting at 0), see jittered_backoff."""
+        return jittered_backoff(attempt, retry_after, self.backoff_base, self.backoff_max if backoff_max is None else backoff_max)
+
+    def _failed(self, error: TransientError, tokens: int, attempt: int, retries: Optional[int], backoff_max: Optional[float]) -> Optional[float]:
+        """Ends a failed attempt, returns the time to wait before the next one or None if all retries are used up."""
+        self.release(tokens, rate_limited=isinstance(error, RateLimitError), retry_after=error.retry_after)
+        if attempt >= (self.retries if retries is None else retries):
+            return None
+        delay = self.backoff(attempt, error.retry_after, backoff_max)
+        print(f"[RateLimiter] {error}, retrying in {delay:.1f} seconds")
+        return delay
+
+    def call(self, request: Callable[[], T], tokens: int = 0, tokens_used: Optional[Callable[[T], int]] = None, retries: Optional[int] = None, backoff_max: Optional[float] = None) -> T:
+        """
+        Sends request through the limiter and retries it while it fails with a TransientError. The last error is
+        raised once all retries are used up.
+        """
+        attempt = 0
+        while True:
+            self.acquire(tokens)
+            try:
+                result = request()
+            except TransientError as e:
+                delay = self._failed(e, tokens, attempt, retries, backoff_max)
+                if delay is None:
+                    raise
+                self.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.release(tokens)
+                raise
+            else:
+                self.release(tokens, tokens_used(result) if tokens_used is not None else None, succeeded=True)
+                return result
+
+    async def acall(self, request: Callable[[], Awaitable[T]], tokens: int = 0, tokens_used: Optional[Callable[[T], int]] = None, retries: Optional[int] = None, backoff_max: Optional[float] = None) -> T:
+        """
+        The asyncio variant of call, which waits for the limiter without blocking the event loop (see aacquire).
+        """
+        attempt = 0
+        while True:
+            await self.aacquire(tokens)
+            try:
+                result = await request()
+            except TransientError as e:
+                delay = self._failed(e, tokens, attempt, retries, backoff_max)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+            except BaseException:
+                self.release(tokens)
+                raise
+            else:
+                self.release(tokens, tokens_used(result) if tokens_used is not None else None, succeeded=True)
+                return result
+
+
+_shared_limiters: dict[tuple, RateLimiter] = {}
+_shared_limiters_lock = threading.Lock()
+
+
+def shared_rate_limiter(key: tuple, **settings) -> RateLimiter:
+    """
+    The rate limiter for the given endpoint key, which is shared by all connections in this process. The settings are
+    only used by whoever creates it first, so they should only describe the limits of the endpoint; retries and backoff
+    are a matter of each connection and are passed to RateLimiter.call instead.
+    """
+    with _shared_limiters_lock:
+        limiter = _shared_limiters.get(key)
+        if limiter is None:
+            limiter = _shared_limiters[key] = RateLimiter(**settings)
+        return limiter
+
+
+class RateLimitedLLM(LLM):
+    """
+    Wraps any LLM, so that its requests go through a RateLimiter. Errors of the wrapped LLM that carry a 429 status
+    code (like the ones of the openai library) are handled like a RateLimitError. Everything apart from get_response is
+    passed through to the wrapped LLM.
+    """
+
+    def __init__(self, llm: LLM, limiter: RateLimiter):
+        self.llm = llm
+        self.limiter = limiter
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.__dict__["llm"], name)
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
+        if hasattr(prompt, "render"):
+            prompt = prompt.render(**kwargs)
+            kwargs = {}
+
+        tokens = self.llm.count_tokens(prompt) if self.limiter.limits_tokens and isinstance(prompt, str) else 0
+        return self.limiter.call(lambda: self._request(prompt, kwargs), tokens, lambda result: result.tokens_query + result.tokens_response)
+
+    def _request(self, prompt, kwargs) -> LLMResult:
+        try:
+            return self.llm.get_response(prompt, **kwargs)
+        except TransientError:
+            raise
+        except Exception as e:
+            if getattr(e, "status_code", None) != 429:
+                raise
+            response = getattr(e, "response", None)
+            headers = RateLimitHeaders.parse(response.headers) if response is not None else RateLimitHeaders()
+            self.limiter.update(headers)
+            raise RateLimitError(str(e), headers.retry_after) from e
+
+    def encode(self, query) -> list[int]:
+        return self.llm.encode(query)
+
+    def decode(self, tokens: list[int]) -> str:
+        return self.llm.decode(tokens)
+
+    def count_tokens(self, query) -> int:
+        return self.llm.count_tokens(query)
@@ -0,0 +1,226 @@
+import bisect
+import collections
+import json
+import os
+import threading
+from dataclasses import dataclass
+from typing import Iterator, Optional
+
+
+@dataclass(frozen=True)
+class IndexEntry:
+    offset: int
+    # seconds since the epoch, like the "at" of the recorded lines
+    at: float
+    message_id: Optional[int] = None
+
+    def to_line(self) -> str:
+        return f"{self.offset} {self.at} {'-' if self.message_id is None else self.message_id}\n"
+
+    @classmethod
+    def from_line(cls, line: str) -> "IndexEntry":
+        offset, at, message_id = line.split()
+        return cls(int(offset), float(at), None if message_id == "-" else int(message_id))
+
+
+def index_path(path: str) -> str:
+    return path + ".idx"
+
+
+class _Recording:
+    """The open recording of a single run, together with what is needed to continue its index."""
+
+    def __init__(self, path: str, index_interval: float):
+        self.file = open(path, "ab")
+        self.index = open(index_path(path), "a")
+        self.index_interval = index_interval
+        self.dirty = False
+        self.last_message_id = -1
+        self.last_indexed_at = None
+
+        # continue the index of a recording that was opened before (or written by an older version without an index)
+        if os.path.exists(index_path(path)) and os.path.getsize(index_path(path)) > 0:
+            entries = read_index(index_path(path))
+        else:
+            entries = build_index(path, index_interval)
+            self.index.writelines(entry.to_line() for entry in entries)
+        for entry in entries:
+            self._track(entry)
+
+    def _track(self, entry: IndexEntry):
+        if entry.message_id is not None:
+            self.last_message_id = max(self.last_message_id, entry.message_id)
+        else:
+            self.last_indexed_at = entry.at
+
+    def write(self, at: float, line: str, message_id: Optional[int]):
+        offset = self.file.tell()
+        self.file.write(line.encode() + b"\n")
+        self.dirty = True
+
+        entry = None
+        if message_id is not None and message_id > self.last_message_id:
+            entry = IndexEntry(offset, at, message_id)
+        elif self.last_indexed_at is None or at - self.last_indexed_at >= self.index_interval:
+            entry = IndexEntry(offset, at)
+        if entry is not None:
+            self.index.write(entry.to_line())
+            self._track(entry)
+
+    def flush(self):
+        self.file.flush()
+        self.index.flush()
+
+    def close(self):
+        self.flush()
+        os.fsync(self.file.fileno())
+        os.fsync(self.index.fileno())
+        self.file.close()
+        self.index.close()
+
+
+class ReplayWriter:
+    """
+    Writes the replay files of the Viewer, one <run_id>.jsonl per run, which stays open while the run is recorded
+    (at most max_open_files at a time, the least recently written ones are closed and reopened when needed).
+
+    Next to every recording an index <run_id>.jsonl.idx is kept, with the byte offset of the first line of every
+    message and of a line every index_interval seconds, so that a ReplayFile can seek without reading the recording.
+
+    The files are flushed to the operating system after every line, and synced to disk every fsync_interval seconds
+    by a background thread, so that writing never waits for the disk.
+    """
+
+    def __init__(self, directory: str, fsync_interval: float = 1.0, index_interval: float = 1.0, max_open_files: int = 64):
+        self.directory = directory
+        self.fsync_interval = fsync_interval
+        self.index_interval = index_interval
+        self.max_open_files = max_open_files
+        self._recordings: collections.OrderedDict[int, _Recording] = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._syncer = threading.Thread(target=self._sync_loop, name="replay-writer-sync", daemon=True)
+        self._syncer.start()
+
+    def path(self, run_id: int) -> str:
+        return os.path.join(self.directory, f"{run_id}.jsonl")
+
+    def write(self, run_id: int, at: float, line: str, message_id: Optional[int] = None):
+        """Appends a line (without line break) to the recording of the run, message_id is set for Message lines."""
+        with self._lock:
+            recording = self._recordings.get(run_id)
+            if recording is None:
+                recording = self._recordings[run_id] = _Recording(self.path(run_id), self.index_interval)
+                if len(self._recordings) > self.max_open_files:
+                    _run_id, evicted = self._recordings.popitem(last=False)
+                    evicted.close()
+            else:
+                self._recordings.move_to_end(run_id)
+            recording.write(at, line, message_id)
+            recording.flush()
+
+    def close_run(self, run_id: int):
+        """Syncs and closes the recording of a finished run, it is reopened if anything is written to it later."""
+        with self._lock:
+            recording = self._recordings.pop(run_id, None)
+            if recording is not None:
+                recording.close()
+
+    def sync(self):
+        """Syncs everything written so far to disk."""
+        with self._lock:
+            # duplicates of the descriptors stay valid even if a recording is closed while they are synced
+            descriptors = []
+            for recording in self._recordings.values():
+                if recording.dirty:
+                    recording.dirty = False
+                    descriptors += [os.dup(recording.file.fileno()), os.dup(recording.index.fileno())]
+        for descriptor in descriptors:
+            try:
+                os.fsync(descriptor)
+            finally:
+                os.close(descriptor)
+
+    def _sync_loop(self):
+        while not self._stop.wait(self.fsync_interval):
+            self.sync()
+
+    def close(self):
+        self._stop.set()
+        self._syncer.join()
+        with self._lock:
+            recordings, self._recordings = list(self._recordings.values()), collections.OrderedDict()
+        for recording in recordings:
+            recording.close()
+
+
+def read_index(path: str) -> list[IndexEntry]:
+    with open(path, "r") as f:
+        # the last line might be incomplete if the writer was killed while writing it
+        return [IndexEntry.from_line(line) for line in f if line.endswith("\n")]
+
+
+def build_index(path: str, index_interval: float = 1.0) -> list[IndexEntry]:
+    """Builds the index of a recording by reading all of it, for recordings that were written without one."""
+    entries = []
+    last_message_id = -1
+    last_indexed_at = None
+    for offset, record in read_records(path):
+        at = record["at"]
+        message = record["message"]
+        message_id = message["data"]["id"] if message["type"] == "Message" else None
+        if message_id is not None and message_id > last_message_id:
+            entries.append(IndexEntry(offset, at, message_id))
+            last_message_id = message_id
+        elif last_indexed_at is None or at - last_indexed_at >= index_interval:
+            entries.append(IndexEntry(offset, at))
+            last_indexed_at = at
+    return entries
+
+
+def read_records(path: str, offset: int = 0) -> Iterator[tuple[int, dict]]:
+    """Yields the offset and content of every line of the recording from offset on, reading it lazily."""
+    if not os.path.exists(path):
+        return
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                # a line that is still being written
+                return
+            yield offset, json.loads(line)
+            offset += len(line)
+
+
+class ReplayFile:
+    """A recording of the Viewer, which can be read from any message or point in time by using its index."""
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.exists(index_path(path)):
+            self.index = read_index(index_path(path))
+        else:
+            self.index = build_index(path)
+            with open(index_path(path), "w") as f:
+                f.writelines(entry.to_line() for entry in self.index)
+        self._times = [entry.at for entry in self.index]
+        self._messages = {entry.message_id: entry.offset for entry in self.index if entry.message_id is not None}
+
+    @property
+    def start(self) -> Optional[float]:
+        return self._times[0] if self._times else None
+
+    def offset_at(self, at: float) -> int:
+        """The offset of an indexed line at or before the point in time, reading from it reaches the time quickly."""
+        position = bisect.bisect_right(self._times, at) - 1
+        return self.index[position].offset if position >= 0 else 0
+
+    def offset_of_message(self, message_id: int) -> Optional[int]:
+        return self._messages.get(message_id)
+
+    def records(self, offset: int = 0) -> Iterator[tuple[int, dict]]:
+        return read_records(self.path, offset)
+
+    def first_record(self) -> Optional[dict]:
+        return next((record for _offset, record in self.records()), None)
@@ -0,0 +1,86 @@
+from collections import deque
+from typing import Optional
+
+from invoke import StreamWatcher
+from invoke.exceptions import WatcherError
+
+
+class OutputCapReached(WatcherError):
+    pass
+
+
+class CappedOutput(StreamWatcher):
+    """
+    Sink for streamed command output, that only keeps the first and the last keep_bytes / 2 bytes of it and drops
+    everything in between.
+
+    Once more than max_bytes bytes or max_lines lines were written, `exceeded` is set. Used as invoke watcher, it then
+    aborts the command (which closes the channel and with it ends the remote process), so that no more output is
+    transferred than is needed. A limit of 0 disables it.
+    """
+
+    def __init__(self, max_bytes: int = 0, max_lines: int = 0, keep_bytes: int = 0):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.head_bytes = keep_bytes // 2
+        self.tail_bytes = keep_bytes - self.head_bytes
+
+        self.total_bytes = 0
+        self.total_lines = 0
+        self.exceeded = False
+
+        self._head: list[str] = []
+        self._head_size = 0
+        self._tail: deque[tuple[str, int]] = deque()
+        self._tail_size = 0
+
+    def write(self, data: str):
+        size = len(data.encode("utf-8", errors="replace"))
+        self.total_bytes += size
+        self.total_lines += data.count("\n")
+        if (self.max_bytes and self.total_bytes > self.max_bytes) or (self.max_lines and self.total_lines > self.max_lines):
+            self.exceeded = True
+
+        if not self.tail_bytes or self._head_size < self.head_bytes:
+            self._head.append(data)
+            self._head_size += size
+            return
+
+        self._tail.append((data, size))
+        self._tail_size += size
+        # only whole chunks are dropped here, the oldest one is cut down to size in getvalue
+        while len(self._tail) > 1 and self._tail_size - self._tail[0][1] >= self.tail_bytes:
+            self._tail_size -= self._tail.popleft()[1]
+
+    def flush(self):
+        pass
+
+    def submit(self, stream: str) -> list[str]:
+        if self.exceeded:
+            raise OutputCapReached(self.stats())
+        return []
+
+    @property
+    def omitted_bytes(self) -> int:
+        return max(0, self.total_bytes - self.head_bytes - self.tail_bytes) if self.tail_bytes else 0
+
+    def getvalue(self) -> str:
+        head = "".join(self._head)
+        if not self.omitted_bytes:
+            return head + "".join(data for data, _ in self._tail)
+
+        head = head.encode("utf-8", errors="replace")[:self.head_bytes].decode("utf-8", errors="ignore")
+        tail = "".join(data for data, _ in self._tail).encode("utf-8", errors="replace")[-self.tail_bytes:].decode("utf-8", errors="ignore")
+        return f"{head}\n[... {self.omitted_bytes} bytes omitted ...]\n{tail}"
+
+    def stats(self) -> Optional[str]:
+        """A short description of what was cut off, or None if the output is complete."""
+        if not self.exceeded and not self.omitted_bytes:
+            return None
+        stats = f"{self.total_bytes} bytes / {self.total_lines} lines of output"
+        if self.omitted_bytes:
+            stats += f", {self.omitted_bytes} bytes omitted"
+        if self.exceeded:
+            stats += ", command was stopped after reaching the output limit"
+        return stats
@@ -0,0 +1,176 @@
+import hashlib
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Optional
+
+import paramiko
+from fabric import Connection
+
+
+class SSHConnectionError(Exception):
+    """Raised if no SSH connection could be established, after all connection attempts were used up."""
+
+    def __init__(self, host: str, port: int, username: str, reason: str, attempts: int = 1):
+        super().__init__(f"could not connect to {username}@{host}:{port} after {attempts} attempt(s): {reason}")
+        self.host = host
+        self.port = port
+        self.username = username
+        self.reason = reason
+        self.attempts = attempts
+
+
+class SSHAuthenticationError(SSHConnectionError):
+    """Raised if the server rejected the credentials, this is never retried."""
+
+
+@dataclass(frozen=True)
+class SSHConnectionKey:
+    host: str
+    port: int
+    username: str
+    auth: str  # digest of password and key file, so that the credentials themselves are not kept in the key
+
+    @classmethod
+    def of(cls, host: str, port: int, username: str, password: Optional[str], keyfilename: Optional[str]) -> "SSHConnectionKey":
+        auth = hashlib.sha256(f"{password or ''}\0{keyfilename or ''}".encode()).hexdigest()
+        return cls(host, port, username, auth)
+
+
+@dataclass
+class _PoolEntry:
+    connection: Connection
+    last_used: float
+    pinned: bool = False  # pinned connections have long-lived channels (like a shell session) and are never reaped
+    in_use: int = 0  # number of acquires that were not released yet, connections in use are never reaped
+
+
+@dataclass
+class _ConnectLock:
+    lock: threading.Lock = field(default_factory=threading.Lock)
+    # number of acquires that are connecting or waiting for the connect, the lock is dropped once there are none
+    waiters: int = 0
+
+
+def open_connection(host: str, port: int, username: str, password: Optional[str], keyfilename: Optional[str]) -> Connection:
+    connect_kwargs = {"password": password, "look_for_keys": False, "allow_agent": False}
+    if keyfilename:
+        connect_kwargs["key_filename"] = keyfilename
+    conn = Connection(f"{username}@{host}:{port}", connect_kwargs=connect_kwargs)
+    conn.open()
+    return conn
+
+
+class SSHConnectionPool:
+    """
+    Keeps one open SSH connection per (host, port, user, credentials). Every command that is run over a pooled
+    connection opens a new channel on the already authenticated transport, so only the first use pays for the TCP
+    connect, key exchange and authentication.
+
+    Every acquire has to be followed by a release once the connection is not used anymore. Connections that were not
+    used for idle_timeout seconds are closed whenever a connection is acquired or released. A dropped connection is
+    transparently reopened on the next acquire.
+    """
+
+    def __init__(self, idle_timeout: float = 300, connect_attempts: int = 10, connect: Callable[..., Connection] = open_connection):
+        self.idle_timeout = idle_timeout
+        self.connect_attempts = connect_attempts
+        self.connect = connect
+
+        self._lock = threading.Lock()
+        self._entries: dict[SSHConnectionKey, _PoolEntry] = {}
+        # connecting can take a while, so it happens outside of the pool lock, but only once per key at a time (there
+        # is only a lock for the keys that are being connected right now, as many credentials might be tried)
+        self._connect_locks: dict[SSHConnectionKey, _ConnectLock] = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+    def acquire(self, host: str, port: int, username: str, password: Optional[str], keyfilename: Optional[str], pin: bool = False) -> Connection:
+        key = SSHConnectionKey.of(host, port, username, password, keyfilename)
+        with self._lock:
+            self._reap_locked(time.monotonic())
+            connection = self._get_locked(key, pin)
+            if connection is not None:
+                return connection
+            connect_lock = self._connect_locks.get(key)
+            if connect_lock is None:
+                connect_lock = self._connect_locks[key] = _ConnectLock()
+            connect_lock.waiters += 1
+
+        try:
+            with connect_lock.lock:
+                # someone else might have connected while we were waiting for the lock
+                with self._lock:
+                    connection = self._get_locked(key, pin)
+                    if connection is not None:
+                        return connection
+
+                connection = self._connect(host, port, username, password, keyfilename)
+                with self._lock:
+                    self._entries[key] = _PoolEntry(connection, time.monotonic(), pin, in_use=1)
+                return connection
+        finally:
+            with self._lock:
+                connect_lock.waiters -= 1
+                if connect_lock.waiters == 0:
+                    del self._connect_locks[key]
+
+    def release(self, connection: Connection):
+        """Ends a use of a connection that was acquired, and closes the connections that are idle by now."""
+        with self._lock:
+            now = time.monotonic()
+            # a connection that was dropped (and maybe reopened) in the meantime is not in the pool anymore
+            entry = next((entry for entry in self._entries.values() if entry.connection is connection), None)
+            if entry is not None:
+                entry.in_use = max(0, entry.in_use - 1)
+                entry.last_used = now
+            self._reap_locked(now)
+
+    def _get_locked(self, key: SSHConnectionKey, pin: bool) -> Optional[Connection]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not entry.connection.is_connected:
+            del self._entries[key]
+            entry.connection.close()
+            return None
+        entry.last_used = time.monotonic()
+        entry.pinned = entry.pinned or pin
+        entry.in_use += 1
+        return entry.connection
+
+    def _connect(self, host: str, port: int, username: str, password: Optional[str], keyfilename: Optional[str]) -> Connection:
+        for attempt in range(1, self.connect_attempts + 1):
+            try:
+                return self.connect(host, port, username, password, keyfilename)
+            except paramiko.AuthenticationException as e:
+                raise SSHAuthenticationError(host, port, username, str(e) or "authentication failed", attempt) from e
+            except (paramiko.SSHException, OSError) as e:
+                if attempt == self.connect_attempts:
+                    raise SSHConnectionError(host, port, username, str(e) or type(e).__name__, attempt) from e
+
+    def reap(self) -> int:
+        """Closes all connections that were idle for longer than idle_timeout and returns how many were closed."""
+        with self._lock:
+            return self._reap_locked(time.monotonic())
+
+    def _reap_locked(self, now: float) -> int:
+        idle = [
+            key for key, entry in self._entries.items()
+            if not entry.pinned and not entry.in_use and now - entry.last_used > self.idle_timeout
+        ]
+        for key in idle:
+            self._entries.pop(key).connection.close()
+        return len(idle)
+
+    def close_all(self):
+        with self._lock:
+            entries, self._entries = self._entries, {}
+        for entry in entries.values():
+            entry.connection.close()
+
+
+# shared by all SSHConnections that do not bring their own pool
+DEFAULT_POOL = SSHConnectionPool()
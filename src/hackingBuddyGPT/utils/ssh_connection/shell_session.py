@@ -0,0 +1,113 @@
+import codecs
+import re
+import shlex
+import socket
+import time
+import uuid
+from typing import Optional, Tuple
+
+import paramiko
+
+from .capped_output import CappedOutput
+
+SENTINEL_PREFIX = "__HBG_DONE_"
+
+# number of characters at the end of the received output that are held back, as they could be the beginning of the
+# sentinel line or the sudo password prompt
+HOLD_BACK = 128
+
+
+class SSHShellSession:
+    """
+    A long-lived interactive shell on a PTY, so that state like the working directory, environment variables or an
+    `su` session survives between commands.
+
+    Every command is followed by a printf of a unique sentinel marker (and the exit code of the command) on the same
+    line, so the end of the output is known after a single round trip. If the marker does not show up before the
+    timeout, the command either still runs or started something interactive (like a new shell), in which case the
+    output ends with the live prompt of whatever is reading from the PTY now.
+    """
+
+    def __init__(self, channel: paramiko.Channel, username: str, password: Optional[str]):
+        self.channel = channel
+        self.sudo_prompt = f"[sudo] password for {username}:"
+        self.password = password
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+
+    @classmethod
+    def open(cls, client: paramiko.SSHClient, username: str, password: Optional[str], setup_timeout: float = 10) -> "SSHShellSession":
+        channel = client.get_transport().open_session()
+        channel.get_pty(term="dumb")
+        channel.invoke_shell()
+
+        session = cls(channel, username, password)
+        # no echo of the sent commands and no terminal control codes in the output
+        output, exit_code = session.run("stty -echo; export TERM=dumb", setup_timeout)
+        if exit_code is None:
+            session.close()
+            raise TimeoutError(f"shell did not get ready within {setup_timeout} seconds: {output!r}")
+        return session
+
+    def run(self, command: str, timeout: float, output: Optional[CappedOutput] = None) -> Tuple[str, Optional[int]]:
+        """
+        Runs the command in the shell and returns its output and exit code. The exit code is None if the command did not
+        finish within timeout seconds or exceeded the limits of output, in which case the foreground process is
+        interrupted.
+        """
+        if output is None:
+            output = CappedOutput()
+        self._drain()
+
+        token = uuid.uuid4().hex
+        # the marker is split in the printf arguments, so that an echo of the command line can not match it
+        self.channel.sendall(f"eval {shlex.quote(command)}; printf '\\n%s%s %s\\n' '{SENTINEL_PREFIX}' '{token}' \"$?\"\n".encode())
+        marker = re.compile(r"\r?\n?" + re.escape(SENTINEL_PREFIX + token) + r" (\d+)\r?\n")
+
+        exit_code = self._read_until(marker, timeout, output)
+        if exit_code is None:
+            self.channel.sendall(b"\x03")
+        return output.getvalue(), exit_code
+
+    def _read_until(self, marker: re.Pattern, timeout: float, output: CappedOutput) -> Optional[int]:
+        deadline = time.monotonic() + timeout
+        pending = ""
+        while True:
+            match = marker.search(pending)
+            if match is not None:
+                output.write(pending[:match.start()])
+                return int(match.group(1))
+
+            if len(pending) > HOLD_BACK:
+                output.write(pending[:-HOLD_BACK])
+                pending = pending[-HOLD_BACK:]
+            if output.exceeded:
+                return None
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+
+            self.channel.settimeout(remaining)
+            try:
+                data = self.channel.recv(4096)
+            except socket.timeout:
+                break
+            if not data:  # the shell exited
+                break
+
+            pending += self._decoder.decode(data)
+            if pending.rstrip().endswith(self.sudo_prompt) and self.password is not None:
+                self.channel.sendall((self.password + "\n").encode())
+                pending = pending[:pending.rindex(self.sudo_prompt)]
+
+        # the held back part is the live prompt, if something interactive was started
+        output.write(pending)
+        return None
+
+    def _drain(self):
+        """Drops everything that is still buffered, like the prompt after the last command or output of a timed out one."""
+        while self.channel.recv_ready():
+            self.channel.recv(4096)
+
+    def close(self):
+        self.channel.close()
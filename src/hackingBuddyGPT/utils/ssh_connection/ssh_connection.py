@@ -6,6 +6,9 @@ from fabric import Connection
 
 from hackingBuddyGPT.utils.configurable import configurable
 
+from .pool import DEFAULT_POOL, SSHConnectionPool
+from .shell_session import SSHShellSession
+
 
 @configurable("ssh", "connects to a remote host via SSH")
 @dataclass
@@ -16,23 +19,30 @@ class SSHConnection:
     password: str
     keyfilename: str
     port: int = 22
+    use_shell_session: bool = False  # run commands in one long-lived shell instead of a new one per command
 
     _conn: Connection = None
+    _shell: SSHShellSession = None
+    _pool: SSHConnectionPool = None
 
     def init(self):
-        # create the SSH Connection
-        if self.keyfilename == '' or self.keyfilename == None:
-            conn = Connection(
-                f"{self.username}@{self.host}:{self.port}",
-                connect_kwargs={"password": self.password, "look_for_keys": False, "allow_agent": False},
-            )
-        else: 
-            conn = Connection(
-                f"{self.username}@{self.host}:{self.port}",
-                connect_kwargs={"password": self.password, "key_filename": self.keyfilename, "look_for_keys": False, "allow_agent": False},
-            )
-        self._conn = conn
-        self._conn.open()
+        # connect right away, so that wrong connection parameters are noticed before the run starts
+        self._release(self._connection())
+
+    @property
+    def pool(self) -> SSHConnectionPool:
+        return self._pool if self._pool is not None else DEFAULT_POOL
+
+    def _connection(self, pin: bool = False) -> Connection:
+        """
+        The pooled connection for this host and these credentials, which is reopened if it was closed in the meantime.
+        It has to be released once it is not used anymore (apart from pinned connections, which are kept open).
+        """
+        self._conn = self.pool.acquire(self.host, self.port, self.username, self.password, self.keyfilename, pin=pin)
+        return self._conn
+
+    def _release(self, connection: Connection):
+        self.pool.release(connection)
 
     def new_with(self, *, host=None, hostname=None, username=None, password=None, keyfilename=None, port=None) -> "SSHConnection":
         return SSHConnection(
@@ -42,8 +52,21 @@ class SSHConnection:
             password=password or self.password,
             keyfilename=keyfilename or self.keyfilename,
             port=port or self.port,
+            use_shell_session=self.use_shell_session,
+            _pool=self._pool,
         )
 
+    def shell(self) -> SSHShellSession:
+        """Returns the long-lived shell of this connection, which is opened on first use (or if it was closed)."""
+        if self._shell is None or self._shell.channel.closed:
+            # the shell lives on the pooled transport, which therefore must not be reaped while idle
+            self._shell = SSHShellSession.open(self._connection(pin=True).client, self.username, self.password)
+        return self._shell
+
     def run(self, cmd, *args, **kwargs) -> Tuple[str, str, int]:
-        res: Optional[invoke.Result] = self._conn.run(cmd, *args, **kwargs)
+        connection = self._connection()
+        try:
+            res: Optional[invoke.Result] = connection.run(cmd, *args, **kwargs)
+        finally:
+            self._release(connection)
         return res.stdout, res.stderr, res.return_code
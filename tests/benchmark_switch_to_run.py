@@ -0,0 +1,104 @@
+"""
+Benchmark for switching the viewer to a run in a log database with many runs.
+
+Populates a fresh database with 10k runs (each with messages, tool calls and sections, like a privesc run would log
+them) and measures the latency of opening a run with Client.switch_to_run, i.e. reading everything of a run from the
+database page by page and sending it to a websocket.
+
+    python tests/benchmark_switch_to_run.py [--runs 10000] [--messages 20] [--switches 200] [--db /tmp/bench.sqlite3]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from hackingBuddyGPT.usecases.viewer import Client
+from hackingBuddyGPT.utils.db_storage.db_storage import RawDbStorage, ReadOnlyDbPool
+
+
+class NullWebSocket:
+    def __init__(self):
+        self.sent = 0
+        self.last = ""
+
+    async def send_text(self, text: str):
+        self.sent += 1
+        self.last = text
+
+
+def populate(db: RawDbStorage, runs: int, messages: int):
+    second = datetime.timedelta(seconds=1)
+    for _ in range(runs):
+        run_id = db.create_run("gpt-4o-mini", "benchmark", datetime.datetime.now(), "{}")
+        for message_id in range(messages):
+            db.add_message(run_id, message_id, "main", "assistant", "exec_command id\n" * 20, 100, 10, second)
+            db.handle_message_update(run_id, message_id, "append", "uid=0(root)")
+            if message_id % 2 == 0:
+                db.add_tool_call(run_id, message_id, f"call_{message_id}", "exec_command", '{"cmd": "id"}', "uid=0(root)", second)
+            if message_id % 4 == 0:
+                db.add_section(run_id, message_id // 4, "round", message_id, message_id + 3, second)
+        db.run_was_failure(run_id, "maximum turn number reached")
+
+
+async def switch(db: RawDbStorage, run_ids: list[int]) -> list[float]:
+    websocket = NullWebSocket()
+    pool = ReadOnlyDbPool(db)
+    client = Client(websocket, pool)
+    timings = []
+    try:
+        for run_id in run_ids:
+            tic = time.perf_counter()
+            # follow the cursor through all pages, like the web client does
+            from_message = 0
+            while from_message is not None:
+                await client.switch_to_run(run_id, from_message)
+                from_message = json.loads(websocket.last)["data"]["next_message"]
+            timings.append(time.perf_counter() - tic)
+    finally:
+        pool.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10_000)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--switches", type=int, default=200)
+    parser.add_argument("--db", help="database file to use (and reuse if it already exists), a temporary one by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        path = args.db or os.path.join(tmpdir, "benchmark.sqlite3")
+        exists = os.path.exists(path)
+
+        db = RawDbStorage(path)
+        db.init()
+
+        if not exists:
+            tic = time.perf_counter()
+            populate(db, args.runs, args.messages)
+            print(f"populated {args.runs} runs in {time.perf_counter() - tic:.1f}s")
+
+        tic = time.perf_counter()
+        runs = db.get_runs()
+        print(f"get_runs: {len(runs)} runs in {(time.perf_counter() - tic) * 1000:.1f}ms")
+
+        run_ids = random.Random(0).choices([run.id for run in runs], k=args.switches)
+        timings = sorted(asyncio.run(switch(db, run_ids)))
+        print(
+            f"switch_to_run over {len(timings)} switches: "
+            f"p50 {statistics.median(timings) * 1000:.2f}ms, "
+            f"p95 {timings[int(len(timings) * 0.95)] * 1000:.2f}ms, "
+            f"max {timings[-1] * 1000:.2f}ms"
+        )
+        db.close()
+        db.db.close()
+
+
+if __name__ == "__main__":
+    main()
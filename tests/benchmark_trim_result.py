@@ -0,0 +1,114 @@
+"""
+Micro-benchmark for trimming command outputs down to a token budget.
+
+Compares the token-boundary based trim_result_front / trim_result_back / trim_result_middle against the step-wise
+character cutting that was used before (and that is still used for LLMs without a decoder), for outputs from 1 KB
+up to 10 MB.
+
+    python tests/benchmark_trim_result.py [--model gpt-3.5-turbo] [--target 4096] [--repeat 3]
+
+The tiktoken encoding of the given model is used, pass `--model words` to use a simple offline whitespace tokenizer.
+"""
+import argparse
+import contextlib
+import io
+import random
+import re
+import time
+
+from hackingBuddyGPT.utils.llm_util import (
+    LLM,
+    LLMResult,
+    _trim_result_by_steps,
+    decode_tokens,
+    encoding_for_model,
+    trim_result_back,
+    trim_result_front,
+    trim_result_middle,
+)
+
+SIZES = [1024, 10 * 1024, 100 * 1024, 1024 * 1024, 10 * 1024 * 1024]
+
+
+class TiktokenLLM(LLM):
+    def __init__(self, model: str):
+        self.encoding = encoding_for_model(model)
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
+        raise NotImplementedError()
+
+    def encode(self, query) -> list[int]:
+        return self.encoding.encode(query)
+
+    def decode(self, tokens: list[int]) -> str:
+        return decode_tokens(self.encoding, tokens)
+
+
+class WordsLLM(LLM):
+    def __init__(self):
+        self.vocabulary = []
+        self.ids = {}
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
+        raise NotImplementedError()
+
+    def encode(self, query) -> list[int]:
+        tokens = []
+        for part in re.findall(r"\S+|\s+", query):
+            if part not in self.ids:
+                self.ids[part] = len(self.vocabulary)
+                self.vocabulary.append(part)
+            tokens.append(self.ids[part])
+        return tokens
+
+    def decode(self, tokens: list[int]) -> str:
+        return "".join(self.vocabulary[t] for t in tokens)
+
+
+def find_output(size: int) -> str:
+    """something that looks like the output of `find /`"""
+    rng = random.Random(size)
+    dirs = ["usr", "bin", "lib", "share", "etc", "var", "log", "python3", "site-packages", "doc", "man", "local"]
+    lines = []
+    length = 0
+    while length < size:
+        line = "/" + "/".join(rng.choice(dirs) for _ in range(rng.randint(2, 7))) + f"/file{rng.randint(0, 99999)}"
+        lines.append(line)
+        length += len(line) + 1
+    return "\n".join(lines)[:size]
+
+
+def measure(llm: LLM, func, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        llm._token_count_cache = None  # otherwise the repetitions would only measure the token count memo
+        with contextlib.redirect_stdout(io.StringIO()):
+            tic = time.perf_counter()
+            func()
+            best = min(best, time.perf_counter() - tic)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="gpt-3.5-turbo")
+    parser.add_argument("--target", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    llm = WordsLLM() if args.model == "words" else TiktokenLLM(args.model)
+
+    print(f"{'size':>10} {'step-wise':>12} {'front':>12} {'back':>12} {'middle':>12}")
+    for size in SIZES:
+        output = find_output(size)
+        timings = [
+            measure(llm, lambda output=output: _trim_result_by_steps(llm, args.target, output), args.repeat),
+            measure(llm, lambda output=output: trim_result_front(llm, args.target, output), args.repeat),
+            measure(llm, lambda output=output: trim_result_back(llm, args.target, output), args.repeat),
+            measure(llm, lambda output=output: trim_result_middle(llm, args.target, output), args.repeat),
+        ]
+        print(f"{size:>10} " + " ".join(f"{t * 1000:>10.1f}ms" for t in timings))
+
+
+if __name__ == "__main__":
+    main()
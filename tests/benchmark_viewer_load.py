@@ -0,0 +1,247 @@
+"""
+Load test for the Viewer with many simulated websocket clients.
+
+Starts the Viewer on a local port with a fresh database that contains finished runs, and then at the same time
+- streams messages of new runs through several ingress connections,
+- lets "followers" follow these live runs and measures how long each message takes from the ingress to them,
+- lets "viewers" switch between the finished runs over and over, which reads the whole run from the database and
+  receives it page by page (like the web client), and
+- keeps "stalled" clients connected that follow a live run but never read, whose queues on the server are bounded.
+
+While database access blocked the event loop, every run switch of a viewer delayed the messages of all followers and
+ingress connections. The database is now read off the event loop and the runs are sent in batches, so what remains of
+the follower latency under many viewers is the time it takes to encode the pages of the run switches.
+
+    python tests/benchmark_viewer_load.py [--viewers 50] [--followers 10] [--ingress 4] [--messages 200] [--history 200] [--stalled 2]
+"""
+import argparse
+import asyncio
+import dataclasses
+import datetime
+import json
+import multiprocessing
+import os
+import socket
+import statistics
+import tempfile
+import time
+import urllib.request
+
+import uvicorn
+import websockets
+
+from hackingBuddyGPT.usecases.viewer import MessageType, Viewer
+from hackingBuddyGPT.utils.db_storage.db_storage import Message, RawDbStorage, Run
+
+# the page size the web client requests runs with
+PAGE_SIZE = 500
+
+
+@dataclasses.dataclass
+class LoadResults:
+    messages_sent: int = 0
+    messages_received: int = 0
+    switches: int = 0
+    latencies: list[float] = dataclasses.field(default_factory=list)
+    switch_durations: list[float] = dataclasses.field(default_factory=list)
+    ingress_duration: float = 0
+    # queue metrics of the Viewer at the end of the ingress, see Broadcaster.metrics
+    metrics: dict = dataclasses.field(default_factory=dict)
+
+    @staticmethod
+    def _percentiles(values: list[float]) -> str:
+        if not values:
+            return "-"
+        values = sorted(values)
+        return (
+            f"p50 {statistics.median(values) * 1000:.1f}ms, "
+            f"p95 {values[int(len(values) * 0.95)] * 1000:.1f}ms, "
+            f"max {values[-1] * 1000:.1f}ms"
+        )
+
+    def summary(self) -> str:
+        return "\n".join([
+            f"ingress: {self.messages_sent} messages in {self.ingress_duration:.2f}s",
+            f"followers: {self.messages_received} messages received, latency {self._percentiles(self.latencies)}",
+            f"viewers: {self.switches} run switches, {self._percentiles(self.switch_durations)}",
+            f"server: {self.metrics.get('clients')} clients, queue depth max {self.metrics.get('queue_depth_max')}, "
+            f"{self.metrics.get('dropped')} messages dropped, {self.metrics.get('resyncs')} resyncs",
+        ])
+
+
+def populate(db: RawDbStorage, runs: int, messages: int) -> list[int]:
+    run_ids = []
+    for _ in range(runs):
+        run_id = db.create_run("gpt-4o-mini", "history", datetime.datetime.now(), "{}")
+        for message_id in range(messages):
+            db.add_message(run_id, message_id, "main", "assistant", "exec_command id\n" * 20, 100, 10, datetime.timedelta(seconds=1))
+        db.run_was_failure(run_id, "maximum turn number reached")
+        run_ids.append(run_id)
+    return run_ids
+
+
+def serve(db_path: str, port: int):
+    db = RawDbStorage(db_path)
+    db.init()
+    viewer = Viewer(log=None, log_db=db, log_server_address=f"127.0.0.1:{port}")
+    uvicorn.run(viewer.create_app(), host="127.0.0.1", port=port, log_level="warning")
+
+
+def start_viewer(db_path: str) -> tuple[multiprocessing.Process, str]:
+    """Runs the Viewer in its own process, so that the simulated clients do not compete with it for the GIL."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    process = multiprocessing.get_context("spawn").Process(target=serve, args=(db_path, port), daemon=True)
+    process.start()
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    return process, f"ws://127.0.0.1:{port}"
+
+
+async def create_run(url: str) -> tuple[websockets.WebSocketClientProtocol, int]:
+    ingress = await websockets.connect(f"{url}/ingress", max_size=None)
+    run = Run(None, "gpt-4o-mini", "in progress", "load", datetime.datetime.now(), None, "{}")
+    await ingress.send(json.dumps({"type": MessageType.RUN.value, "data": run.to_dict()}))
+    run_id = json.loads(await ingress.recv())["id"]
+    # the followers know that they are following the run, once they got this first message as part of its history
+    await send_message(ingress, Message(run_id, 0, 0, "main", "system", "started", datetime.timedelta(0), 0, 0))
+    return ingress, run_id
+
+
+async def send_message(ingress, message: Message):
+    await ingress.send(json.dumps({"type": MessageType.MESSAGE.value, "data": message.to_dict()}))
+
+
+async def stream_messages(ingress, run_id: int, messages: int, interval: float, results: LoadResults):
+    for message_id in range(1, messages + 1):
+        # the send time is part of the content, so that the followers can measure the latency
+        await send_message(ingress, Message(run_id, message_id, 0, "main", "assistant", f"{time.time()}", datetime.timedelta(seconds=1), 10, 1))
+        results.messages_sent += 1
+        await asyncio.sleep(interval)
+
+
+async def request_page(client, run_id: int, from_message: int = 0):
+    await client.send(json.dumps({"type": MessageType.MESSAGE_REQUEST.value, "data": {"follow_run": run_id, "from_message": from_message, "limit": PAGE_SIZE}}))
+
+
+async def receive_messages(client, run_id: int) -> list[dict]:
+    """Waits for the next messages of the run, either live or as part of a batch (requesting the next page of it)."""
+    while True:
+        data = json.loads(await client.recv())
+        if data["type"] == MessageType.BATCH.value and data["data"]["run_id"] == run_id:
+            batch = data["data"]
+            if batch["next_message"] is not None:
+                await request_page(client, run_id, batch["next_message"])
+            return [record["data"] for record in batch["records"] if record["type"] == MessageType.MESSAGE.value]
+        if data["type"] == MessageType.MESSAGE.value and data["data"]["run_id"] == run_id:
+            return [data["data"]]
+
+
+async def follow(url: str, run_id: int, messages: int, results: LoadResults, ready: asyncio.Event):
+    async with websockets.connect(f"{url}/client", max_size=None) as client:
+        await request_page(client, run_id)
+        received = 0
+        while received < messages:
+            for message in await receive_messages(client, run_id):
+                if message["id"] == 0:
+                    ready.set()
+                else:
+                    results.latencies.append(time.time() - float(message["content"]))
+                    results.messages_received += 1
+                    received += 1
+
+
+async def view(url: str, run_ids: list[int], history: int, stop: asyncio.Event, results: LoadResults, offset: int):
+    async with websockets.connect(f"{url}/client", max_size=None) as client:
+        switch = offset
+        while not stop.is_set():
+            run_id = run_ids[switch % len(run_ids)]
+            switch += 1
+            tic = time.perf_counter()
+            await request_page(client, run_id)
+            received = 0
+            while received < history:
+                received += len(await receive_messages(client, run_id))
+            results.switch_durations.append(time.perf_counter() - tic)
+            results.switches += 1
+
+
+async def stall(url: str, run_id: int):
+    """A client (like a frozen browser tab) that follows a live run, but never reads what it is sent."""
+    client = await websockets.connect(f"{url}/client", max_size=None, max_queue=1)
+    await request_page(client, run_id)
+    return client
+
+
+def get_metrics(url: str) -> dict:
+    with urllib.request.urlopen(f"http{url[len('ws'):]}/metrics") as response:
+        return json.load(response)
+
+
+async def run_load(url: str, history_runs: list[int], viewers: int, followers: int, ingress: int, messages: int, history: int, interval: float, stalled: int = 0) -> LoadResults:
+    results = LoadResults()
+
+    live = [await create_run(url) for _ in range(ingress)]
+    stalled_clients = [await stall(url, live[i % ingress][1]) for i in range(stalled)]
+    ready = [asyncio.Event() for _ in range(followers)]
+    follower_tasks = [
+        asyncio.create_task(follow(url, live[i % ingress][1], messages, results, ready[i]))
+        for i in range(followers)
+    ]
+    await asyncio.gather(*(event.wait() for event in ready))
+
+    stop = asyncio.Event()
+    viewer_tasks = [asyncio.create_task(view(url, history_runs, history, stop, results, i)) for i in range(viewers)]
+
+    tic = time.perf_counter()
+    await asyncio.gather(*(stream_messages(connection, run_id, messages, interval, results) for connection, run_id in live))
+    results.ingress_duration = time.perf_counter() - tic
+
+    await asyncio.gather(*follower_tasks)
+    results.metrics = await asyncio.get_running_loop().run_in_executor(None, get_metrics, url)
+    stop.set()
+    await asyncio.gather(*viewer_tasks)
+    for connection, _run_id in live:
+        await connection.close()
+    for client in stalled_clients:
+        await client.close()
+    return results
+
+
+def load_test(db_path: str, viewers: int, followers: int, ingress: int, messages: int, history: int, history_runs: int = 20, interval: float = 0.005, stalled: int = 0) -> LoadResults:
+    setup = RawDbStorage(db_path, write_behind=False)
+    setup.init()
+    run_ids = populate(setup, history_runs, history)
+    setup.db.close()
+
+    process, url = start_viewer(db_path)
+    try:
+        return asyncio.run(run_load(url, run_ids, viewers, followers, ingress, messages, history, interval, stalled))
+    finally:
+        process.terminate()
+        process.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=50)
+    parser.add_argument("--followers", type=int, default=10)
+    parser.add_argument("--ingress", type=int, default=4)
+    parser.add_argument("--messages", type=int, default=200, help="messages per ingress connection")
+    parser.add_argument("--history", type=int, default=200, help="messages per finished run that the viewers switch to")
+    parser.add_argument("--stalled", type=int, default=2, help="clients that follow a live run but never read")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        results = load_test(os.path.join(tmpdir, "viewer.sqlite3"), args.viewers, args.followers, args.ingress, args.messages, args.history, stalled=args.stalled)
+        print(results.summary())
+
+
+if __name__ == "__main__":
+    main()
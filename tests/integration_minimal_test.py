@@ -19,6 +19,8 @@ class FakeSSHConnection:
     username: str = "lowpriv"
     password: str = "toomanysecrets"
     hostname: str = "theoneandonly"
+    host: str = "192.168.122.151"
+    use_shell_session: bool = False
 
     results = {
         "id": "uid=1001(lowpriv) gid=1001(lowpriv) groups=1001(lowpriv)",
@@ -0,0 +1,91 @@
+import threading
+import time
+import unittest
+from dataclasses import dataclass
+from typing import Tuple
+
+from hackingBuddyGPT.capabilities import BatchTestCredential, Capability
+
+
+@dataclass
+class FakeConnection:
+    host: str
+
+
+class FakeTestCredential(Capability):
+    def __init__(self, host: str, delay: float = 0.05):
+        self.conn = FakeConnection(host)
+        self.delay = delay
+        self.tested = []
+        self.active = 0
+        self.max_active = 0
+        self.lock = threading.Lock()
+
+    def describe(self) -> str:
+        return "give credentials to be tested."
+
+    def __call__(self, username: str, password: str) -> Tuple[str, bool]:
+        with self.lock:
+            self.tested.append(username)
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        time.sleep(self.delay)
+        with self.lock:
+            self.active -= 1
+        if password == "broken":
+            raise ConnectionError("connection reset")
+        if username == "root" and password == "toor":
+            return "Login as root was successful\n", True
+        if password == "secret":
+            return "Authentication successful, but user is not root\n", False
+        return "Authentication error, credentials are wrong\n", False
+
+
+class TestBatchTestCredential(unittest.TestCase):
+    def test_result_table(self):
+        batch = BatchTestCredential(FakeTestCredential("host-a"), attempts_per_second=0)
+        result, got_root = batch("bob:wrong lowpriv:secret alice:broken")
+
+        self.assertFalse(got_root)
+        self.assertEqual(result, (
+            "bob:wrong       Authentication error, credentials are wrong\n"
+            "lowpriv:secret  Authentication successful, but user is not root\n"
+            "alice:broken    Error while testing: connection reset\n"
+        ))
+
+    def test_workers_are_bounded(self):
+        tester = FakeTestCredential("host-b")
+        batch = BatchTestCredential(tester, max_workers=2, attempts_per_second=0)
+        batch(" ".join(f"user{i}:wrong" for i in range(8)))
+
+        self.assertEqual(len(tester.tested), 8)
+        self.assertEqual(tester.max_active, 2)
+
+    def test_stops_at_root(self):
+        tester = FakeTestCredential("host-c", delay=0.01)
+        batch = BatchTestCredential(tester, max_workers=1, attempts_per_second=0)
+        result, got_root = batch("root:toor " + " ".join(f"user{i}:wrong" for i in range(20)))
+
+        self.assertTrue(got_root)
+        self.assertLess(len(tester.tested), 21)
+        lines = result.splitlines()
+        self.assertEqual(len(lines), 21)
+        self.assertEqual(lines[0].split(None, 1), ["root:toor", "Login as root was successful"])
+        self.assertTrue(lines[-1].endswith("not tested, root login already found"))
+
+    def test_rate_limit_per_host(self):
+        tester = FakeTestCredential("host-d", delay=0)
+        batch = BatchTestCredential(tester, max_workers=4, attempts_per_second=20)
+
+        tic = time.monotonic()
+        batch(" ".join(f"user{i}:wrong" for i in range(5)))
+        self.assertGreaterEqual(time.monotonic() - tic, 0.19)
+
+    def test_invalid_credentials(self):
+        batch = BatchTestCredential(FakeTestCredential("host-e"))
+        self.assertEqual(batch("root"), ("Invalid credentials 'root', expected username:password\n", False))
+        self.assertEqual(batch(""), ("No credentials given\n", False))
+
+
+if __name__ == "__main__":
+    unittest.main()
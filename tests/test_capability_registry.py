@@ -0,0 +1,81 @@
+import unittest
+from unittest.mock import patch
+
+from hackingBuddyGPT.capabilities import capability
+from hackingBuddyGPT.capabilities.capability import (
+    Capability,
+    CapabilityRegistry,
+    capabilities_to_action_model,
+    capabilities_to_tools,
+)
+
+
+class Echo(Capability):
+    def describe(self) -> str:
+        return "echoes the given text"
+
+    def __call__(self, text: str) -> str:
+        return text
+
+
+class Add(Capability):
+    def describe(self) -> str:
+        return "adds two numbers"
+
+    def __call__(self, a: int, b: int) -> str:
+        return str(a + b)
+
+
+class TestCapabilityRegistry(unittest.TestCase):
+    def setUp(self):
+        self.registry = CapabilityRegistry()
+        self.registry["echo"] = Echo()
+
+    def test_simple_text_handler_is_compiled_once(self):
+        with patch.object(capability, "capabilities_to_simple_text_handler", wraps=capability.capabilities_to_simple_text_handler) as compile_handler:
+            first = self.registry.simple_text_handler()
+            second = self.registry.simple_text_handler()
+            self.assertIs(first, second)
+            self.assertEqual(compile_handler.call_count, 1)
+
+            # a different default capability or description setting is compiled separately
+            self.registry.simple_text_handler(default_capability=self.registry["echo"])
+            self.registry.simple_text_handler(include_description=False)
+            self.assertEqual(compile_handler.call_count, 3)
+
+        descriptions, parser = first
+        self.assertEqual(descriptions, {"echo": "`echo text`: echoes the given text"})
+        self.assertEqual(parser("echo hello world"), (True, ("echo", "hello world", "hello world")))
+
+    def test_adding_a_capability_invalidates(self):
+        descriptions, _parser = self.registry.simple_text_handler()
+        tools = self.registry.tools()
+        model = self.registry.model(self.registry["echo"])
+
+        self.registry["add"] = Add()
+
+        new_descriptions, parser = self.registry.simple_text_handler()
+        self.assertIn("add", new_descriptions)
+        self.assertNotIn("add", descriptions)
+        self.assertEqual(parser("add 1 2"), (True, ("add", "1 2", "3")))
+        self.assertEqual([tool["function"]["name"] for tool in self.registry.tools()], ["echo", "add"])
+        self.assertEqual(len(tools), 1)
+        self.assertIsNot(self.registry.model(self.registry["echo"]), model)
+
+    def test_models_and_tools_are_cached(self):
+        echo = self.registry["echo"]
+        self.assertIs(self.registry.model(echo), self.registry.model(echo))
+        self.assertIs(capabilities_to_tools(self.registry), capabilities_to_tools(self.registry))
+        self.assertIs(capabilities_to_action_model(self.registry), capabilities_to_action_model(self.registry))
+
+        result = self.registry.model(echo).model_validate_json('{"text": "hi"}').execute()
+        self.assertEqual(result, "hi")
+
+    def test_plain_dicts_are_not_cached(self):
+        capabilities = {"echo": Echo()}
+        self.assertIsNot(capabilities_to_tools(capabilities), capabilities_to_tools(capabilities))
+        self.assertEqual(capabilities_to_tools(capabilities), capabilities_to_tools(self.registry))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import datetime
+import unittest
+
+from invoke.exceptions import Failure, WatcherError
+
+from hackingBuddyGPT.capabilities import SSHRunCommand
+from hackingBuddyGPT.utils.ssh_connection.capped_output import CappedOutput
+
+
+class TestCappedOutput(unittest.TestCase):
+    def test_short_output_is_kept(self):
+        out = CappedOutput(max_bytes=100, max_lines=10, keep_bytes=50)
+        out.write("uid=0(root)\n")
+
+        self.assertEqual(out.getvalue(), "uid=0(root)\n")
+        self.assertFalse(out.exceeded)
+        self.assertIsNone(out.stats())
+
+    def test_head_and_tail_are_kept(self):
+        out = CappedOutput(keep_bytes=32)
+        for i in range(100):
+            out.write(f"line{i:03}\n")
+
+        self.assertEqual(out.getvalue(), "line000\nline001\n\n[... 768 bytes omitted ...]\nline098\nline099\n")
+        self.assertFalse(out.exceeded)
+        self.assertEqual(out.stats(), "800 bytes / 100 lines of output, 768 bytes omitted")
+
+    def test_limits(self):
+        out = CappedOutput(max_lines=2)
+        out.write("a\nb\n")
+        self.assertEqual(out.submit(""), [])
+        out.write("c\n")
+        self.assertTrue(out.exceeded)
+        with self.assertRaises(WatcherError):
+            out.submit("")
+
+        out = CappedOutput(max_bytes=2)
+        out.write("ä")
+        self.assertFalse(out.exceeded)
+        out.write("b")
+        self.assertTrue(out.exceeded)
+
+
+class StreamingConnection:
+    """Streams its output like invoke does: every chunk goes to the out_stream and then to the watchers."""
+
+    username = "lowpriv"
+    password = "secret"
+    hostname = "victim"
+    use_shell_session = False
+
+    def __init__(self, chunks: int):
+        self.chunks = chunks
+        self.sent = 0
+
+    def run(self, cmd, *args, out_stream=None, watchers=(), **kwargs):
+        for _ in range(self.chunks):
+            out_stream.write("/usr/bin/find\n" * 100)
+            self.sent += 1
+            try:
+                for watcher in watchers:
+                    watcher.submit("")
+            except WatcherError as e:
+                raise Failure(None, reason=e) from e
+        return "", "", 0
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.messages = []
+
+    def status_message(self, message: str):
+        self.messages.append(message)
+
+
+class TestSSHRunCommandOutputCap(unittest.TestCase):
+    def test_command_is_stopped_at_output_limit(self):
+        conn = StreamingConnection(chunks=1000)
+        log = RecordingLogger()
+        run_command = SSHRunCommand(conn=conn, log=log, max_output_bytes=10_000, keep_output_bytes=2_000)
+
+        output, got_root = run_command("find /")
+
+        self.assertEqual(conn.sent, 8)
+        self.assertFalse(got_root)
+        self.assertIn("bytes omitted", output)
+        self.assertTrue(output.endswith("/usr/bin/find\n"))
+        self.assertEqual(len(log.messages), 1)
+        self.assertIn("stopped after reaching the output limit", log.messages[0])
+
+    def test_output_within_limits_is_not_reported(self):
+        log = RecordingLogger()
+        output, _ = SSHRunCommand(conn=StreamingConnection(chunks=1), log=log)("find /")
+
+        self.assertEqual(output, "/usr/bin/find\n" * 100)
+        self.assertEqual(log.messages, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
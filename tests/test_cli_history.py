@@ -0,0 +1,73 @@
+import unittest
+
+from hackingBuddyGPT.utils.cli_history import SlidingCliHistory
+
+from .test_llm_util import WordLLM
+
+
+class CountingWordLLM(WordLLM):
+    def __init__(self, context_size: int):
+        super().__init__()
+        self.context_size = context_size
+        self.encoded = []
+
+    def encode(self, query) -> list[int]:
+        self.encoded.append(query)
+        return super().encode(query)
+
+
+class TestSlidingCliHistory(unittest.TestCase):
+    def test_history_is_kept_in_order(self):
+        history = SlidingCliHistory(CountingWordLLM(1000))
+        history.add_command("id", "uid=0")
+        history.add_command("whoami", "root")
+
+        self.assertEqual(history.get_history(1000), "$ id\nuid=0\n$ whoami\nroot\n")
+        self.assertEqual(history.total_tokens, 12)
+
+    def test_oldest_entries_are_evicted(self):
+        history = SlidingCliHistory(CountingWordLLM(12))
+        for i in range(5):
+            history.add_command(f"cmd{i}", f"out{i}")
+
+        self.assertEqual([entry.cmd for entry in history.entries], ["cmd3", "cmd4"])
+        self.assertEqual(history.total_tokens, 12)
+
+    def test_entries_are_tokenized_once(self):
+        llm = CountingWordLLM(10_000)
+        history = SlidingCliHistory(llm)
+        for i in range(50):
+            history.add_command(f"cmd{i}", f"out{i}")
+            history.get_history(18)
+
+        self.assertEqual(len(llm.encoded), 50)
+
+    def test_budgeted_history_keeps_newest_entries(self):
+        history = SlidingCliHistory(CountingWordLLM(1000))
+        history.add_command("id", "uid=0")
+        history.add_command("whoami", "root")
+
+        self.assertEqual(history.get_history(6), "$ whoami\nroot\n")
+        self.assertEqual(history.get_history(8), "uid=0\n$ whoami\nroot\n")
+
+    def test_commands_and_last_output(self):
+        history = SlidingCliHistory(CountingWordLLM(1000))
+        history.add_command_only("id", "uid=0")
+        history.add_command_only("ls", "a b c")
+
+        self.assertEqual(history.get_commands_and_last_output(1000), "$ id\n$ ls\na b c")
+        self.assertEqual(history.get_commands_and_last_output(11), "$ id\n$ ls\na b")
+
+    def test_last_output_reserves_budget(self):
+        history = SlidingCliHistory(CountingWordLLM(10))
+        history.add_command_only("id", "x")
+        history.add_command_only("ls", "a b c")
+
+        self.assertEqual(history.get_commands_and_last_output(10), "$ ls\na b c")
+
+        history.add_command_only("cat", " ".join(["x"] * 20))
+        self.assertEqual(history.last_output, "")
+
+
+if __name__ == "__main__":
+    unittest.main()
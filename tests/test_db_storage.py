@@ -0,0 +1,134 @@
+import datetime
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from hackingBuddyGPT.utils.db_storage.db_storage import MIGRATIONS, RawDbStorage, record_to_dict
+
+
+class TestDbStorage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "wintermute.sqlite3")
+        # a long flush interval, so that nothing is written before an explicit flush
+        self.db = RawDbStorage(self.path, flush_interval=60)
+        self.db.init()
+        self.run_id = self.db.create_run("model", "tag", datetime.datetime.now(), "{}")
+
+    def tearDown(self):
+        self.db.close()
+        self.db.db.close()
+        self.tmpdir.cleanup()
+
+    def count_persisted_messages(self) -> int:
+        with sqlite3.connect(self.path) as other:
+            return other.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def add_message(self, message_id: int, content: str = "hello"):
+        self.db.add_message(self.run_id, message_id, None, "user", content, 1, 2, datetime.timedelta(seconds=1))
+
+    def test_wal_mode(self):
+        self.assertEqual(self.db.db.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+    def test_writes_are_batched_until_run_is_finished(self):
+        for i in range(10):
+            self.add_message(i)
+        self.assertEqual(self.count_persisted_messages(), 0)
+
+        self.db.run_was_success(self.run_id)
+        self.assertEqual(self.count_persisted_messages(), 10)
+        self.assertEqual(self.db.get_runs()[0].state, "got root")
+
+    def test_reads_see_queued_writes(self):
+        self.add_message(0, "hel")
+        self.db.handle_message_update(self.run_id, 0, "append", "lo")
+        self.db.add_or_update_message(self.run_id, 1, None, "assistant", "x", 0, 0, datetime.timedelta(0))
+        self.db.add_or_update_message(self.run_id, 1, None, "assistant", "", 3, 4, datetime.timedelta(0))
+
+        messages = self.db.get_messages_by_run(self.run_id)
+        self.assertEqual([(m.content, m.version) for m in messages], [("hello", 1), ("x", 0)])
+        self.assertEqual((messages[1].tokens_query, messages[1].tokens_response), (3, 4))
+
+    def test_paginated_reads(self):
+        for i in range(10):
+            self.add_message(i)
+            self.db.add_tool_call(self.run_id, i, "call", "exec_command", "{}", "", datetime.timedelta(0))
+            self.db.add_section(self.run_id, i, "round", i, i + 1, datetime.timedelta(0))
+
+        self.assertEqual([m.id for m in self.db.get_messages_by_run(self.run_id, 3, 4)], [3, 4, 5, 6])
+        self.assertEqual([m.id for m in self.db.get_messages_by_run(self.run_id, 8)], [8, 9])
+        self.assertEqual([t.message_id for t in self.db.get_tool_calls_by_run(self.run_id, 3, 5)], [3, 4, 5])
+        self.assertEqual([s.from_message for s in self.db.get_sections_by_run(self.run_id, 7)], [7, 8, 9])
+
+    def test_record_to_dict(self):
+        self.add_message(0)
+        self.db.add_tool_call(self.run_id, 0, "call", "exec_command", "{}", "", datetime.timedelta(seconds=2))
+        self.db.add_section(self.run_id, 0, "round", 0, None, datetime.timedelta(seconds=3))
+        self.db.run_was_success(self.run_id)
+
+        records = self.db.get_runs() + self.db.get_messages_by_run(self.run_id) + self.db.get_tool_calls_by_run(self.run_id) + self.db.get_sections_by_run(self.run_id)
+        for record in records:
+            self.assertEqual(record_to_dict(record), record.to_dict())
+
+    def test_failing_write_is_raised_on_flush(self):
+        self.add_message(0)
+        self.add_message(0)
+        self.add_message(1)
+
+        with self.assertRaises(sqlite3.IntegrityError):
+            self.db.flush()
+        self.assertEqual(self.count_persisted_messages(), 2)
+        self.db.flush()
+
+    def test_synchronous_mode(self):
+        db = RawDbStorage(":memory:", write_behind=False)
+        db.init()
+        run_id = db.create_run("model", "tag", datetime.datetime.now(), "{}")
+        db.add_message(run_id, 0, None, "user", "hi", 0, 0, datetime.timedelta(0))
+        self.assertEqual(len(db.get_messages_by_run(run_id)), 1)
+
+
+class TestDbStorageMigrations(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, "wintermute.sqlite3")
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def open(self) -> RawDbStorage:
+        db = RawDbStorage(self.path, write_behind=False)
+        db.init()
+        self.addCleanup(db.db.close)
+        return db
+
+    def test_new_database_is_fully_migrated(self):
+        db = self.open()
+        self.assertEqual(db.db.execute("PRAGMA user_version").fetchone()[0], len(MIGRATIONS))
+        plan = db.db.execute("EXPLAIN QUERY PLAN SELECT * FROM sections WHERE run_id = 1 ORDER BY from_message, id").fetchall()
+        self.assertIn("sections_by_from_message", plan[0]["detail"])
+
+    def test_existing_database_is_migrated(self):
+        # a database from before the migrations existed has all tables, but no user_version
+        with sqlite3.connect(self.path) as legacy:
+            legacy.executescript(MIGRATIONS[0])
+            legacy.execute("INSERT INTO runs (model, state, started_at) VALUES ('model', 'got root', '2024-01-01T00:00:00')")
+
+        db = self.open()
+        self.assertEqual(db.db.execute("PRAGMA user_version").fetchone()[0], len(MIGRATIONS))
+        self.assertEqual(len(db.get_runs()), 1)
+
+        # opening it again does not change anything
+        self.assertEqual(len(self.open().get_runs()), 1)
+
+    def test_newer_database_is_rejected(self):
+        with sqlite3.connect(self.path) as newer:
+            newer.execute(f"PRAGMA user_version = {len(MIGRATIONS) + 1}")
+
+        with self.assertRaises(RuntimeError):
+            self.open()
+
+
+if __name__ == "__main__":
+    unittest.main()
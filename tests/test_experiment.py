@@ -0,0 +1,184 @@
+import datetime
+import io
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+import unittest
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+from rich.console import Console
+
+from hackingBuddyGPT.usecases.experiment import (
+    Experiment,
+    ExperimentRun,
+    expand_matrix,
+    flatten_parameters,
+    schedule_runs,
+)
+from hackingBuddyGPT.utils.db_storage.db_storage import RawDbStorage
+
+MATRIX = {
+    "use_case": "LinuxPrivesc",
+    "repetitions": 2,
+    "parameters": {"conn": {"username": "lowpriv"}, "max_turns": 20},
+    "scenarios": {"a": {"conn.host": "10.0.0.1"}, "b": {"conn.host": "10.0.0.2"}},
+    "models": {"small": {"llm.model": "small", "llm.api_url": "http://small"}},
+    "hints": {"unguided": {}, "hint": {"hint": "check sudo", "enable_explanation": False}},
+}
+
+
+class TestExpandMatrix(unittest.TestCase):
+    def test_flatten_parameters(self):
+        self.assertEqual(
+            flatten_parameters({"conn": {"host": "h", "port": 22}, "max_turns": 3}),
+            {"conn.host": "h", "conn.port": 22, "max_turns": 3},
+        )
+
+    def test_all_combinations_with_repetitions_outermost(self):
+        runs = expand_matrix("exp", MATRIX)
+
+        self.assertEqual(len(runs), 2 * 2 * 1 * 2)
+        self.assertEqual([run.repetition for run in runs], [1, 1, 1, 1, 2, 2, 2, 2])
+        self.assertEqual(runs[1].tag, "exp/a/small/hint/1")
+        self.assertEqual(
+            runs[1].parameters,
+            {
+                "conn.username": "lowpriv",
+                "max_turns": 20,
+                "conn.host": "10.0.0.1",
+                "llm.model": "small",
+                "llm.api_url": "http://small",
+                "hint": "check sudo",
+                "enable_explanation": False,
+            },
+        )
+        self.assertEqual(runs[1].endpoint, "http://small")
+        self.assertEqual(runs[1].host, "10.0.0.1")
+
+    def test_missing_axes_have_a_single_entry(self):
+        runs = expand_matrix("exp", {"use_case": "LinuxPrivesc", "parameters": {"max_turns": 1}})
+        self.assertEqual([run.tag for run in runs], ["exp/default/default/default/1"])
+
+    def test_arguments(self):
+        run = ExperimentRun("exp", "a", "small", "hint", 1, {"conn.host": "h", "max_turns": 3, "flag": True, "other": False})
+        self.assertEqual(run.arguments(), ["--conn.host=h", "--max_turns=3", "--flag=True", "--other="])
+
+
+class TestScheduleRuns(unittest.TestCase):
+    def schedule(self, runs, **limits):
+        lock = threading.Lock()
+        running = Counter()
+        maximum = Counter()
+        finished = []
+
+        def execute(run: ExperimentRun):
+            with lock:
+                for key in ("total", f"endpoint:{run.endpoint}", f"host:{run.host}"):
+                    running[key] += 1
+                    maximum[key] = max(maximum[key], running[key])
+            time.sleep(0.01)
+            with lock:
+                for key in ("total", f"endpoint:{run.endpoint}", f"host:{run.host}"):
+                    running[key] -= 1
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            schedule_runs(
+                runs,
+                lambda run: executor.submit(execute, run),
+                lambda run, future: finished.append(run.tag),
+                **limits,
+            )
+        return maximum, finished
+
+    def runs(self, count: int) -> list[ExperimentRun]:
+        return [
+            ExperimentRun("exp", f"s{i}", "m", "h", 1, {"conn.host": f"host{i % 3}", "llm.api_url": f"api{i % 2}"})
+            for i in range(count)
+        ]
+
+    def test_limits(self):
+        runs = self.runs(12)
+        maximum, finished = self.schedule(runs, max_concurrent_runs=4, max_runs_per_endpoint=2, max_runs_per_host=1)
+
+        self.assertEqual(sorted(finished), sorted(run.tag for run in runs))
+        self.assertLessEqual(maximum["total"], 4)
+        for i in range(2):
+            self.assertLessEqual(maximum[f"endpoint:api{i}"], 2)
+        for i in range(3):
+            self.assertEqual(maximum[f"host:host{i}"], 1)
+
+    def test_no_limits(self):
+        maximum, finished = self.schedule(self.runs(6), max_concurrent_runs=6)
+        self.assertEqual(len(finished), 6)
+        self.assertLessEqual(maximum["total"], 6)
+
+
+class TestExperimentResume(unittest.TestCase):
+    def test_finished_tags(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            db = RawDbStorage(os.path.join(tmpdir, "experiment.sqlite3"), write_behind=False)
+            db.init()
+            now = datetime.datetime.now()
+            done = db.create_run("m", "exp/a/m/h/1", now, "{}")
+            db.run_was_success(done)
+            failed = db.create_run("m", "exp/b/m/h/1", now, "{}")
+            db.run_was_failure(failed, "maximum turn number reached")
+            db.create_run("m", "exp/c/m/h/1", now, "{}")  # interrupted
+            other = db.create_run("m", "other/a/m/h/1", now, "{}")
+            db.run_was_success(other)
+
+            experiment = Experiment(log=None, log_db=db, name="exp")
+            self.assertEqual(experiment.finished_tags(), {"exp/a/m/h/1", "exp/b/m/h/1"})
+            db.db.close()
+
+
+class TestExperimentFailures(unittest.TestCase):
+    def test_failing_runs_do_not_stop_the_experiment(self):
+        # a port that nothing listens on
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            port = s.getsockname()[1]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # neither the missing parameter nor the connection error can be unpickled in the parent process
+            matrix = {
+                "use_case": "LinuxPrivesc",
+                "parameters": {
+                    "conn": {"host": "127.0.0.1", "port": port, "hostname": "target", "username": "lowpriv", "password": "x", "keyfilename": ""},
+                    "llm": {"api_key": "key", "model": "model"},
+                    "max_turns": 1,
+                },
+                "scenarios": {"missing_parameter": {}, "unreachable": {"llm.context_size": 1000}},
+            }
+            experiment_file = os.path.join(tmpdir, "exp.json")
+            with open(experiment_file, "w") as f:
+                json.dump(matrix, f)
+            db = RawDbStorage(os.path.join(tmpdir, "experiment.sqlite3"), write_behind=False)
+            db.init()
+            console = Console(file=io.StringIO())
+
+            experiment = Experiment(
+                log=SimpleNamespace(console=console),
+                log_db=db,
+                experiment_file=experiment_file,
+                max_concurrent_runs=1,
+                output_dir=os.path.join(tmpdir, "logs"),
+            )
+            results = experiment.run({})
+
+            self.assertEqual(results, {"failed": 2})
+            output = console.file.getvalue()
+            self.assertIn("exp/missing_parameter/default/default/1 failed: InvalidCommand", output)
+            self.assertIn("exp/unreachable/default/default/1 failed: SSHConnectionError", output)
+            with open(os.path.join(tmpdir, "logs", "exp_unreachable_default_default_1.log")) as f:
+                self.assertIn("Traceback", f.read())
+            db.db.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import datetime
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hackingBuddyGPT.utils.http_pool import create_session
+from hackingBuddyGPT.utils.openai.openai_llm import OpenAIConnection
+
+
+class ChatCompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections = set()
+
+    def do_POST(self):
+        ChatCompletionHandler.connections.add(self.client_address)
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({
+            "choices": [{"message": {"content": "exec_command id"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestHTTPPool(unittest.TestCase):
+    def setUp(self):
+        ChatCompletionHandler.connections = set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_connection_is_reused(self):
+        session = create_session(pool_size=1)
+        first = session.post(self.url, json={})
+        second = session.post(self.url, json={})
+
+        self.assertGreater(first.connect_duration, datetime.timedelta(0))
+        self.assertEqual(second.connect_duration, datetime.timedelta(0))
+        self.assertEqual(len(ChatCompletionHandler.connections), 1)
+
+    def test_no_keep_alive(self):
+        session = create_session(pool_size=1, keep_alive=False)
+        session.post(self.url, json={})
+        second = session.post(self.url, json={})
+
+        self.assertGreater(second.connect_duration, datetime.timedelta(0))
+        self.assertEqual(len(ChatCompletionHandler.connections), 2)
+
+    def test_openai_connection_records_latencies(self):
+        llm = OpenAIConnection(api_key="", model="gpt-3.5-turbo", context_size=4096, api_url=self.url)
+        first = llm.get_response("hello")
+        second = llm.get_response("hello")
+
+        self.assertEqual(first.result, "exec_command id")
+        self.assertEqual((first.tokens_query, first.tokens_response), (3, 2))
+        self.assertGreater(first.duration_connect, datetime.timedelta(0))
+        self.assertEqual(second.duration_connect, datetime.timedelta(0))
+        self.assertLessEqual(second.duration_first_byte, second.duration)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hackingBuddyGPT.capabilities.http_request import HTTPRequest
+
+
+class TargetHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    requests = []
+
+    def do_GET(self):
+        TargetHandler.requests.append((self.command, self.path, self.headers.get("Cookie")))
+        if self.path == "/slow":
+            time.sleep(0.5)
+        body = b"x" * 100_000 if self.path == "/large" else b"hello"
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        if self.path == "/login":
+            self.send_header("Set-Cookie", "session=secret")
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TargetServer(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        pass  # clients that time out or stop reading early close the connection on purpose
+
+
+class TestHTTPRequest(unittest.TestCase):
+    def setUp(self):
+        TargetHandler.requests = []
+        self.server = TargetServer(("127.0.0.1", 0), TargetHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.host = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_request_is_sent_once(self):
+        result = HTTPRequest(self.host)("POST", "items", body="a=1")
+
+        self.assertTrue(result.startswith("HTTP/1.1 200 OK\r\n"))
+        self.assertTrue(result.endswith("\r\n\r\nhello"))
+        self.assertEqual([(method, path) for method, path, _ in TargetHandler.requests], [("POST", "/items")])
+
+    def test_large_body_is_truncated(self):
+        result = HTTPRequest(self.host, max_response_size=1000)("GET", "large")
+
+        body = result.split("\r\n\r\n", 1)[1]
+        self.assertEqual(body, "x" * 1000 + "\n[response body truncated after 1000 bytes]")
+
+    def test_read_timeout(self):
+        result = HTTPRequest(self.host, read_timeout=0.1)("GET", "slow")
+        self.assertTrue(result.startswith(f"Could not request '{self.host}/slow'"))
+
+    def test_cookie_jar_is_per_instance(self):
+        with_jar = HTTPRequest(self.host)
+        with_jar("GET", "login")
+        with_jar("GET", "page")
+
+        without_jar = HTTPRequest(self.host, use_cookie_jar=False)
+        without_jar("GET", "login")
+        without_jar("GET", "page")
+
+        cookies = [cookie for _, _, cookie in TargetHandler.requests]
+        self.assertEqual(cookies, [None, "session=secret", None, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import threading
+import time
+import unittest
+
+from hackingBuddyGPT.usecases.privesc.common import template_state
+from hackingBuddyGPT.usecases.privesc.linux import LinuxPrivesc, LinuxPrivescUseCase
+from hackingBuddyGPT.utils.console.console import Console
+from hackingBuddyGPT.utils.db_storage.db_storage import DbStorage
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+from hackingBuddyGPT.utils.logging import LocalLogger
+from tests.integration_minimal_test import FakeSSHConnection
+
+
+class SlowLLM(LLM):
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.threads = set()
+
+    def get_response(self, prompt, *, capabilities=None, **kwargs) -> LLMResult:
+        self.threads.add(threading.get_ident())
+        time.sleep(self.delay)
+        return LLMResult(result=prompt.format(**kwargs), prompt=prompt, answer=prompt.format(**kwargs))
+
+    def encode(self, query) -> list[int]:
+        return [0] * len(query)
+
+
+class TestAsyncLLM(unittest.TestCase):
+    def test_aget_response_renders_kwargs(self):
+        llm = SlowLLM(0)
+        result = asyncio.run(llm.aget_response("hello {name}", name="world"))
+        self.assertEqual(result.result, "hello world")
+
+    def test_aget_response_runs_concurrently(self):
+        llm = SlowLLM(0.2)
+
+        async def query_both():
+            return await asyncio.gather(llm.aget_response("a"), llm.aget_response("b"))
+
+        tic = time.monotonic()
+        results = asyncio.run(query_both())
+        duration = time.monotonic() - tic
+
+        self.assertEqual([r.result for r in results], ["a", "b"])
+        self.assertLess(duration, 0.35)
+        self.assertNotIn(threading.get_ident(), llm.threads)
+
+    def test_astream_response_yields_final_result(self):
+        llm = SlowLLM(0)
+
+        async def collect():
+            return [part async for part in llm.astream_response("x")]
+
+        parts = asyncio.run(collect())
+        self.assertEqual(len(parts), 1)
+        self.assertIsInstance(parts[0], LLMResult)
+
+
+class AsyncLLM(LLM):
+    """Answers the state template with new facts and everything else with an analysis, natively async."""
+
+    model = "fake_model"
+    context_size = 4096
+
+    def __init__(self):
+        self.prompts = []
+        self.running = 0
+        self.max_running = 0
+
+    def answer(self, prompt) -> LLMResult:
+        self.prompts.append(prompt)
+        answer = "- lowpriv can not run sudo" if prompt is template_state else "sudo is not allowed"
+        return LLMResult(result=answer, prompt="", answer=answer)
+
+    def get_response(self, prompt, **kwargs) -> LLMResult:
+        return self.answer(prompt)
+
+    async def aget_response(self, prompt, **kwargs) -> LLMResult:
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.05)
+        self.running -= 1
+        return self.answer(prompt)
+
+    def encode(self, query) -> list[int]:
+        return [0] * len(query)
+
+
+class TestConcurrentAgentQueries(unittest.TestCase):
+    def agent(self) -> tuple[LinuxPrivesc, AsyncLLM, DbStorage]:
+        llm = AsyncLLM()
+        log_db = DbStorage(":memory:", write_behind=False)
+        log_db.init()
+        log = LocalLogger(log_db=log_db, console=Console())
+        agent = LinuxPrivesc(conn=FakeSSHConnection(), enable_explanation=True, enable_update_state=True, disable_history=False, hint="", llm=llm, log=log)
+        LinuxPrivescUseCase(agent=agent, log=log, max_turns=1).init()
+        log.start_run("test", "{}")
+        return agent, llm, log_db
+
+    def assert_results_applied(self, agent: LinuxPrivesc, llm: AsyncLLM, log_db: DbStorage):
+        self.assertEqual(len(llm.prompts), 2)
+        self.assertEqual(agent._state, "- lowpriv can not run sudo")
+        messages = log_db.get_messages_by_run(agent.log.run.id)
+        self.assertEqual([m.content for m in messages if m.role == "assistant"], ["sudo is not allowed", "- lowpriv can not run sudo"])
+
+    def test_analysis_and_state_are_queried_concurrently(self):
+        agent, llm, log_db = self.agent()
+        agent.analyze_result_and_update_state("sudo -l", "Sorry, user lowpriv may not run sudo")
+
+        self.assertEqual(llm.max_running, 2)
+        self.assert_results_applied(agent, llm, log_db)
+
+    def test_queries_are_sequential_inside_a_running_event_loop(self):
+        agent, llm, log_db = self.agent()
+
+        async def step():
+            agent.analyze_result_and_update_state("sudo -l", "Sorry, user lowpriv may not run sudo")
+
+        asyncio.run(step())
+        self.assertEqual(llm.max_running, 0)
+        self.assert_results_applied(agent, llm, log_db)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,133 @@
+import os
+import tempfile
+import unittest
+
+from mako.template import Template
+
+from hackingBuddyGPT.usecases.privesc.linux import LinuxPrivesc, LinuxPrivescUseCase
+from hackingBuddyGPT.utils.console.console import Console
+from hackingBuddyGPT.utils.db_storage.db_storage import DbStorage
+from hackingBuddyGPT.utils.llm_cache import CachedLLM, CacheMissError, LLMCache
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+from hackingBuddyGPT.utils.logging import LocalLogger
+from tests.integration_minimal_test import FakeLLM, FakeSSHConnection
+
+
+class CountingLLM(LLM):
+    model: str = "fake_model"
+    context_size: int = 4096
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_response(self, prompt, *, capabilities=None, **kwargs) -> LLMResult:
+        self.calls += 1
+        return LLMResult(result=f"answer {self.calls}", prompt=prompt, answer=f"answer {self.calls}")
+
+    def encode(self, query) -> list[int]:
+        return [0] * len(query)
+
+
+class TestLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmp.name, "cache.sqlite3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def cache(self, **kwargs) -> LLMCache:
+        cache = LLMCache(cache_file=self.cache_file, **kwargs)
+        cache.init()
+        return cache
+
+    def test_identical_prompts_are_answered_from_cache(self):
+        llm = CountingLLM()
+        cached = CachedLLM(llm, self.cache())
+
+        first = cached.get_response(Template("hello ${name}"), name="world")
+        second = cached.get_response("hello world")
+        third = cached.get_response("hello there")
+
+        self.assertEqual(first.result, "answer 1")
+        self.assertEqual(second.result, "answer 1")
+        self.assertEqual(third.result, "answer 2")
+        self.assertEqual(llm.calls, 2)
+        self.assertEqual((cached.cache.hits, cached.cache.misses), (1, 2))
+        self.assertEqual(cached.context_size, 4096)
+
+    def test_replay_only(self):
+        CachedLLM(CountingLLM(), self.cache()).get_response("id")
+
+        llm = CountingLLM()
+        replay = CachedLLM(llm, self.cache(replay_only=True))
+        self.assertEqual(replay.get_response("id").result, "answer 1")
+        with self.assertRaises(CacheMissError):
+            replay.get_response("whoami")
+        self.assertEqual(llm.calls, 0)
+
+    def test_least_recently_used_are_evicted(self):
+        cache = self.cache(max_size=0)
+        cached = CachedLLM(CountingLLM(), cache)
+        cached.get_response("a")
+        entry_size = cache.size()
+        cache.max_size = 2 * entry_size
+
+        cached.get_response("b")
+        cached.get_response("a")  # touch a, so that b is the least recently used one
+        cached.get_response("c")
+
+        self.assertLessEqual(cache.size(), cache.max_size)
+        self.assertEqual(cached.get_response("a").result, "answer 1")
+        self.assertEqual(cached.get_response("b").result, "answer 4")
+
+
+class RecordingSSHConnection(FakeSSHConnection):
+    def __init__(self):
+        self.commands = []
+
+    def run(self, cmd, *args, **kwargs):
+        self.commands.append(cmd)
+        return super().run(cmd, *args, **kwargs)
+
+
+class OfflineLLM(FakeLLM):
+    def get_response(self, prompt, *, capabilities=None, **kwargs) -> LLMResult:
+        raise AssertionError("the LLM must not be queried in replay only mode")
+
+
+class TestAgentWithLLMCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_file = os.path.join(self.tmp.name, "trace.sqlite3")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def run_linux_privesc(self, llm: LLM, replay_only: bool) -> list[str]:
+        conn = RecordingSSHConnection()
+        log_db = DbStorage(":memory:")
+        log_db.init()
+        log = LocalLogger(log_db=log_db, console=Console(), tag="llm_cache")
+        cache = LLMCache(cache_file=self.cache_file, replay_only=replay_only)
+        cache.init()
+        use_case = LinuxPrivescUseCase(
+            agent=LinuxPrivesc(conn=conn, enable_explanation=False, disable_history=False, hint="", llm=llm, llm_cache=cache, log=log),
+            log=log,
+            max_turns=len(FakeLLM.responses),
+        )
+        use_case.init()
+        self.assertIsInstance(use_case.agent.llm, CachedLLM)
+        use_case.run({})
+        return conn.commands
+
+    def test_agent_is_replayed_from_the_recorded_trace(self):
+        recorded = self.run_linux_privesc(FakeLLM(), replay_only=False)
+        replayed = self.run_linux_privesc(OfflineLLM(), replay_only=True)
+
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(len(replayed), len(FakeLLM.responses))
+
+
+if __name__ == "__main__":
+    unittest.main()
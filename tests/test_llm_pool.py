@@ -0,0 +1,228 @@
+import json
+import socket
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from hackingBuddyGPT.utils.llm_pool import LLMPool, NoBackendAvailableError
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+from hackingBuddyGPT.utils.openai.openai_llm import OpenAIConnectionPool
+from hackingBuddyGPT.utils.rate_limit import TransientError
+
+
+class FakeLLM(LLM):
+    model = "fake_model"
+    context_size = 4096
+
+    def __init__(self, fail: int = 0, error: Optional[Exception] = None):
+        self.fail = fail
+        self.error = error or TransientError("backend is down")
+        self.calls = 0
+
+    def get_response(self, prompt, *, capabilities=None, **kwargs) -> LLMResult:
+        self.calls += 1
+        if self.fail > 0:
+            self.fail -= 1
+            raise self.error
+        return LLMResult(result="ok", prompt=prompt, answer="ok")
+
+    def encode(self, query) -> list[int]:
+        return [0] * len(query)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TestLLMPool(unittest.TestCase):
+    def test_least_loaded_backend(self):
+        pool = LLMPool({"a": FakeLLM(), "b": FakeLLM(), "c": FakeLLM()})
+        a, b, c = pool.backends
+        a.latency, b.latency = 1.0, 3.0
+
+        # backends without a latency are tried first
+        self.assertIs(pool.acquire(), c)
+        pool.release(c, 2.0)
+        # expected waits: a = 1 * 1.0, b = 1 * 3.0, c = 1 * 2.0
+        self.assertIs(pool.acquire(), a)
+        # a now has one request in flight: a = 2 * 1.0, c = 2.0, so the tie is broken by the in-flight requests
+        self.assertIs(pool.acquire(), c)
+        self.assertIs(pool.acquire(), a)
+        self.assertEqual((a.in_flight, b.in_flight, c.in_flight), (2, 0, 1))
+
+    def test_latency_is_smoothed(self):
+        pool = LLMPool({"a": FakeLLM()}, latency_smoothing=0.5)
+        backend = pool.backends[0]
+        for duration in (1.0, 3.0, 3.0):
+            pool.release(pool.acquire(), duration)
+        self.assertEqual(backend.latency, 2.5)
+        self.assertEqual((backend.requests, backend.in_flight), (3, 0))
+
+    def test_failover_and_backend_is_recorded(self):
+        down, up = FakeLLM(fail=100), FakeLLM()
+        pool = LLMPool({"down": down, "up": up})
+
+        result = pool.get_response("id")
+        self.assertEqual(result.backend, "up")
+        self.assertEqual(pool.backends[0].failures + pool.backends[1].failures, down.calls)
+
+    def test_circuit_breaker(self):
+        clock = FakeClock()
+        flaky = FakeLLM(fail=4)
+        pool = LLMPool({"flaky": flaky, "ok": FakeLLM()}, failure_threshold=3, recovery_time=10, clock=clock)
+        flaky_backend = pool.backends[0]
+
+        for _ in range(3):
+            backend = pool.acquire(exclude={"ok"})
+            pool.release(backend, None)
+        self.assertIsNotNone(flaky_backend.opened_at)
+        self.assertIsNone(pool.acquire(exclude={"ok"}))
+        self.assertEqual(pool.get_response("id").backend, "ok")
+        self.assertEqual(flaky.calls, 0)
+
+        # after the recovery time a single probe is let through, which fails and reopens the circuit
+        clock.now = 10
+        probe = pool.acquire(exclude={"ok"})
+        self.assertIs(probe, flaky_backend)
+        self.assertIsNone(pool.acquire(exclude={"ok"}))
+        pool.release(probe, None)
+        self.assertEqual(flaky_backend.opened_at, 10)
+
+        # the next probe succeeds and closes the circuit
+        clock.now = 20
+        flaky.fail = 0
+        probe = pool.acquire(exclude={"ok"})
+        pool.release(probe, 1.0)
+        self.assertIsNone(flaky_backend.opened_at)
+        self.assertEqual(flaky_backend.consecutive_failures, 0)
+
+    def test_all_backends_fail(self):
+        pool = LLMPool({"a": FakeLLM(fail=1), "b": FakeLLM(fail=1)}, failure_threshold=1, recovery_time=60, retries=0)
+        with self.assertRaises(NoBackendAvailableError) as e:
+            pool.get_response("id")
+        self.assertIsInstance(e.exception.__cause__, TransientError)
+
+        with self.assertRaises(NoBackendAvailableError):
+            pool.get_response("id")
+
+    def test_errors_of_the_request_are_not_failed_over(self):
+        clock = FakeClock()
+        error = Exception("Error from OpenAI Gateway (400)")
+        a, b = FakeLLM(fail=1, error=error), FakeLLM(fail=1, error=error)
+        pool = LLMPool({"a": a, "b": b}, failure_threshold=1, clock=clock, sleep=clock.sleep)
+
+        with self.assertRaises(Exception) as e:
+            pool.get_response("id")
+        self.assertIs(e.exception, error)
+        self.assertEqual((a.calls + b.calls, clock.sleeps), (1, []))
+        for backend in pool.backends:
+            self.assertEqual((backend.in_flight, backend.failures, backend.opened_at), (0, 0, None))
+
+    def test_backs_off_once_all_backends_failed(self):
+        clock = FakeClock()
+        a, b = FakeLLM(fail=2), FakeLLM(fail=2)
+        pool = LLMPool({"a": a, "b": b}, backoff_base=1, backoff_max=4, clock=clock, sleep=clock.sleep)
+
+        self.assertEqual(pool.get_response("id").result, "ok")
+        self.assertEqual(a.calls + b.calls, 5)
+        self.assertEqual(len(clock.sleeps), 2)
+        self.assertTrue(0.5 <= clock.sleeps[0] <= 1 and 1 <= clock.sleeps[1] <= 2)
+
+    def test_waits_for_ejected_backends(self):
+        clock = FakeClock()
+        flaky = FakeLLM(fail=1)
+        pool = LLMPool({"flaky": flaky}, failure_threshold=1, recovery_time=10, clock=clock, sleep=clock.sleep)
+
+        self.assertEqual(pool.get_response("id").result, "ok")
+        self.assertEqual(clock.sleeps, [10])
+
+    def test_gives_up_after_retries(self):
+        clock = FakeClock()
+        down = FakeLLM(fail=100)
+        pool = LLMPool({"down": down}, retries=2, clock=clock, sleep=clock.sleep)
+
+        with self.assertRaises(NoBackendAvailableError):
+            pool.get_response("id")
+        self.assertEqual(len(clock.sleeps), 2)
+        # one request per attempt, the circuit only opened with the third failure
+        self.assertEqual(down.calls, 3)
+
+
+class NamedHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.requests += 1
+        if self.server.requests <= self.server.limited:
+            self.send_response(429)
+            self.send_header("Retry-After", "0.05")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps({
+            "choices": [{"message": {"content": "exec_command id"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestOpenAIConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.servers = []
+        for _ in range(2):
+            server = ThreadingHTTPServer(("127.0.0.1", 0), NamedHandler)
+            server.requests = 0
+            server.limited = 0
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.servers.append(server)
+        # a port that nobody listens on
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.down = f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+    def tearDown(self):
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+    def test_requests_are_balanced_and_failing_apis_ejected(self):
+        urls = [f"http://127.0.0.1:{server.server_port}" for server in self.servers] + [self.down]
+        llm = OpenAIConnectionPool(api_key="", model="gpt-3.5-turbo", context_size=4096, api_urls=",".join(urls), failure_threshold=1)
+
+        backends = [llm.get_response("hello").backend for _ in range(20)]
+
+        self.assertEqual(set(backends), set(urls[:2]))
+        self.assertEqual(sum(server.requests for server in self.servers), 20)
+        self.assertTrue(all(server.requests > 0 for server in self.servers))
+        ejected = [backend for backend in llm.pool.backends if backend.opened_at is not None]
+        self.assertEqual([backend.name for backend in ejected], [self.down])
+
+    def test_single_api_is_retried_after_a_429(self):
+        server = self.servers[0]
+        server.limited = 1
+        llm = OpenAIConnectionPool(api_key="", model="gpt-3.5-turbo", context_size=4096, api_urls=f"http://127.0.0.1:{server.server_port}", api_backoff=0)
+
+        self.assertEqual(llm.get_response("hello").result, "exec_command id")
+        self.assertEqual(server.requests, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,5 +1,17 @@
+import re
 import unittest
-from hackingBuddyGPT.utils.llm_util import cmd_output_fixer, remove_nonprintable
+
+from hackingBuddyGPT.utils.llm_util import (
+    LLM,
+    TOKEN_COUNT_CACHE_SIZE,
+    LLMResult,
+    TokenCountCacheInfo,
+    cmd_output_fixer,
+    remove_nonprintable,
+    trim_result_back,
+    trim_result_front,
+    trim_result_middle,
+)
 
 
 class TestCmdOutputFixer(unittest.TestCase):
@@ -257,4 +269,101 @@ EOF
         self.assertEqual(
             remove_nonprintable(raw_with_ansi),
             "root@server:/home/user# exec_command whoami\nroot"
-        )
\ No newline at end of file
+        )
+
+
+class CountingEncodeLLM(LLM):
+    def __init__(self):
+        self.encodes = 0
+
+    def get_response(self, prompt, *, capabilities=None, **kwargs) -> LLMResult:
+        raise NotImplementedError()
+
+    def encode(self, query) -> list[int]:
+        self.encodes += 1
+        return [0] * len(query.split())
+
+
+class TestTokenCounting(unittest.TestCase):
+    def test_count_tokens_is_memoized(self):
+        llm = CountingEncodeLLM()
+        self.assertIsNone(llm.token_count_cache_info())
+
+        for _ in range(3):
+            self.assertEqual(llm.count_tokens("find / -perm -4000"), 4)
+        self.assertEqual(llm.count_tokens("id"), 1)
+
+        self.assertEqual(llm.encodes, 2)
+        self.assertEqual(llm.token_count_cache_info(), TokenCountCacheInfo(hits=2, misses=2, maxsize=TOKEN_COUNT_CACHE_SIZE, currsize=2))
+
+    def test_memo_does_not_keep_the_counted_strings(self):
+        llm = CountingEncodeLLM()
+        output = "/usr/bin/find\n" * 100_000
+        self.assertEqual(llm.count_tokens(output), 100_000)
+        self.assertEqual(llm.count_tokens("/usr/bin/find\n" * 100_000), 100_000)
+
+        self.assertEqual(llm.encodes, 1)
+        self.assertTrue(all(isinstance(key, bytes) and len(key) == 16 for key in llm._token_count_cache._counts))
+
+
+class WordLLM(LLM):
+    """every word and every whitespace run is a token"""
+
+    def __init__(self):
+        self.vocabulary = []
+        self.ids = {}
+
+    def get_response(self, prompt, *, capabilities=None, **kwargs) -> LLMResult:
+        raise NotImplementedError()
+
+    def encode(self, query) -> list[int]:
+        tokens = []
+        for part in re.findall(r"\S+|\s+", query):
+            if part not in self.ids:
+                self.ids[part] = len(self.vocabulary)
+                self.vocabulary.append(part)
+            tokens.append(self.ids[part])
+        return tokens
+
+    def decode(self, tokens: list[int]) -> str:
+        return "".join(self.vocabulary[t] for t in tokens)
+
+
+class TestTrimResult(unittest.TestCase):
+    output = "\n".join(f"/usr/bin/binary{i}" for i in range(1000))
+
+    def test_short_results_are_kept(self):
+        llm = WordLLM()
+        self.assertEqual(trim_result_front(llm, 10, "id"), "id")
+        self.assertEqual(trim_result_back(llm, 10, "id"), "id")
+        self.assertEqual(trim_result_middle(llm, 10, "id"), "id")
+        self.assertEqual(trim_result_front(llm, 0, "id"), "")
+
+    def test_trim_front_cuts_at_token_boundary(self):
+        llm = WordLLM()
+        trimmed = trim_result_front(llm, 5, self.output)
+        self.assertEqual(trimmed, "/usr/bin/binary0\n/usr/bin/binary1\n/usr/bin/binary2")
+        self.assertTrue(self.output.startswith(trimmed))
+
+    def test_trim_back_keeps_the_end(self):
+        llm = WordLLM()
+        trimmed = trim_result_back(llm, 3, self.output)
+        self.assertEqual(trimmed, "/usr/bin/binary998\n/usr/bin/binary999")
+
+    def test_trim_middle_keeps_both_ends(self):
+        llm = WordLLM()
+        trimmed = trim_result_middle(llm, 11, self.output)
+        self.assertTrue(trimmed.startswith("/usr/bin/binary0\n/usr/bin/binary1"))
+        self.assertTrue(trimmed.endswith("/usr/bin/binary998\n/usr/bin/binary999"))
+        self.assertIn("[...]", trimmed)
+        self.assertLessEqual(llm.count_tokens(trimmed), 11)
+
+    def test_fallback_without_decode(self):
+        llm = CountingEncodeLLM()
+        trimmed = trim_result_front(llm, 100, self.output)
+        self.assertLessEqual(llm.count_tokens(trimmed), 100)
+        self.assertTrue(self.output.startswith(trimmed))
+
+        trimmed = trim_result_back(llm, 100, self.output)
+        self.assertLessEqual(llm.count_tokens(trimmed), 100)
+        self.assertTrue(self.output.endswith(trimmed))
@@ -0,0 +1,241 @@
+import datetime
+import json
+import threading
+import time
+import unittest
+from typing import Optional
+
+from websockets.sync.server import serve
+
+from hackingBuddyGPT.utils import Console, DbStorage
+from hackingBuddyGPT.utils.logging import LocalLogger, RemoteLogger
+
+
+class RecordingDbStorage(DbStorage):
+    def __init__(self):
+        super().__init__(":memory:", write_behind=False)
+        self.updates = []
+
+    def handle_message_update(self, run_id, message_id, action, content):
+        self.updates.append(content)
+        super().handle_message_update(run_id, message_id, action, content)
+
+
+class TestMessageStreamLogger(unittest.TestCase):
+    def setUp(self):
+        self.db = RecordingDbStorage()
+        self.db.init()
+        self.log = LocalLogger(log_db=self.db, console=Console(), stream_flush_size=10, stream_flush_interval=60)
+        self.log.start_run("test", "{}")
+
+    def stored_content(self, message_id: int) -> str:
+        return next(m for m in self.db.get_messages_by_run(self.log.run.id) if m.id == message_id).content
+
+    def test_stream_parts_are_coalesced(self):
+        stream = self.log.stream_message("assistant")
+        for token in ["exec", "_command", " find", " /", " -perm", " -4000"]:
+            stream.append(token)
+
+        self.assertEqual(self.db.updates, ["exec_command", " find / -perm"])
+        self.assertEqual(self.stored_content(stream.message_id), "exec_command find / -perm")
+
+        stream.finalize(10, 6, datetime.timedelta(seconds=1))
+        self.assertEqual(self.db.updates, ["exec_command", " find / -perm"])
+        self.assertEqual(self.stored_content(stream.message_id), "exec_command find / -perm -4000")
+
+    def test_stream_parts_are_flushed_after_interval(self):
+        self.log.stream_flush_interval = 0
+        stream = self.log.stream_message("assistant")
+        stream.append("a")
+        stream.append("b")
+        stream.finalize(0, 0, datetime.timedelta(0))
+
+        self.assertEqual(self.db.updates, ["a", "b"])
+
+    def test_finalize_with_overwritten_message(self):
+        stream = self.log.stream_message("assistant")
+        stream.append("exec_command id")
+        message_id = stream.finalize(1, 1, datetime.timedelta(0), overwrite_finished_message="id")
+
+        self.assertEqual(self.stored_content(message_id), "id")
+
+
+class FakeLogServer:
+    """
+    Records the frames it receives and acknowledges them like the Viewer, creating runs with id 42. Frames that are sent
+    again after a reconnect are only acknowledged.
+    """
+
+    def __init__(self, create_delay: float = 0, close_after: int = 0, create_reply: Optional[dict] = None, lose_frame: int = 0, close_before_ack: int = 0):
+        self.frames = []
+        self.frame_ids = set()
+        self.connections = 0
+        self.closed = threading.Event()
+        self.create_delay = create_delay
+        self.close_after = close_after
+        self.create_reply = create_reply
+        self.lose_frame = lose_frame
+        self.close_before_ack = close_before_ack
+        self.server = serve(self.handle, "127.0.0.1", 0)
+        self.address = f"127.0.0.1:{self.server.socket.getsockname()[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self, websocket):
+        websocket.close()
+        self.closed.set()
+
+    def handle(self, websocket):
+        self.connections += 1
+        received = 0
+        for frame in websocket:
+            frame = json.loads(frame)
+            received += 1
+            first_connection = self.connections == 1
+            if first_connection and received == self.lose_frame:
+                # the connection breaks before the frame arrived
+                self.close(websocket)
+                return
+
+            runs = []
+            for record in frame["data"]["records"]:
+                if record["type"] == "Run":
+                    if record["data"]["id"] is None:
+                        time.sleep(self.create_delay)
+                        record["data"]["id"] = 42
+                    runs.append(record["data"])
+            if frame["data"]["frame"] not in self.frame_ids:
+                self.frame_ids.add(frame["data"]["frame"])
+                self.frames.append(frame)
+
+            if first_connection and received == self.close_before_ack:
+                # the frame arrived, but the connection is lost before it is acknowledged
+                self.close(websocket)
+                return
+            if self.create_reply is not None and runs and runs[0]["id"] == 42:
+                websocket.send(json.dumps(self.create_reply))
+            else:
+                websocket.send(json.dumps({"type": "Ack", "data": {"frame": frame["data"]["frame"], "runs": runs}}))
+            if first_connection and received == self.close_after:
+                self.close(websocket)
+                return
+
+    def records(self, count: int = 0) -> list[dict]:
+        """The records received so far, waiting until there are at least count (the logger only waits until they are sent)."""
+        deadline = time.monotonic() + 5
+        while True:
+            records = [record for frame in self.frames for record in frame["data"]["records"]]
+            if len(records) >= count or time.monotonic() > deadline:
+                return records
+            time.sleep(0.01)
+
+    def shutdown(self):
+        self.server.shutdown()
+
+
+class TestRemoteLogger(unittest.TestCase):
+    def logger(self, server: FakeLogServer, **kwargs) -> RemoteLogger:
+        log = RemoteLogger(console=Console(), log_server_address=server.address, **kwargs)
+        self.addCleanup(log.close)
+        self.addCleanup(server.shutdown)
+        return log
+
+    def test_messages_are_batched_and_compressed(self):
+        server = FakeLogServer()
+        log = self.logger(server, batch_interval=0.2)
+        log.start_run("test", "{}")
+        for i in range(50):
+            log.add_message("assistant", f"message {i}", 1, 1, datetime.timedelta(0))
+        log.run_was_success()
+
+        self.assertTrue(log._upstream_websocket.protocol.extensions)
+        self.assertLess(len(server.frames), 5)
+        records = server.records()
+        self.assertEqual(len(records), 53)
+        self.assertEqual(records[-1]["data"]["state"], "success")
+        self.assertTrue(all(record["data"].get("run_id", 42) == 42 for record in records))
+
+    def test_run_is_created_without_blocking(self):
+        server = FakeLogServer(create_delay=0.5)
+        log = self.logger(server)
+
+        tic = time.monotonic()
+        log.start_run("test", "{}")
+        log.add_message("assistant", "id", 1, 1, datetime.timedelta(0))
+        self.assertLess(time.monotonic() - tic, 0.3)
+
+        log.flush()
+        self.assertEqual(log.run.id, 42)
+        self.assertEqual(server.records(2)[1]["data"]["run_id"], 42)
+
+    def test_buffer_survives_reconnect(self):
+        server = FakeLogServer(close_after=1)
+        log = self.logger(server, batch_interval=0)
+        log.start_run("test", "{}")
+        log.flush()
+        # the server closes the connection after the run was created
+        self.assertTrue(server.closed.wait(5))
+        for i in range(5):
+            log.add_message("assistant", f"message {i}", 1, 1, datetime.timedelta(0))
+        log.flush()
+
+        self.assertEqual(server.connections, 2)
+        self.assertEqual([record["data"]["content"] for record in server.records(6)[1:]], [f"message {i}" for i in range(5)])
+
+    def test_gives_up_when_server_stays_unreachable(self):
+        server = FakeLogServer(close_after=1)
+        log = self.logger(server, reconnect_timeout=0.3)
+        log.start_run("test", "{}")
+        log.flush()
+        server.shutdown()
+        self.assertTrue(server.closed.wait(5))
+
+        log.add_message("assistant", "lost", 1, 1, datetime.timedelta(0))
+        with self.assertRaises(ConnectionError):
+            log.flush()
+        with self.assertRaises(ConnectionError):
+            log.add_message("assistant", "lost", 1, 1, datetime.timedelta(0))
+
+
+    def test_unexpected_answer_does_not_stop_the_sender(self):
+        server = FakeLogServer(create_reply={"error": "not allowed"})
+        log = self.logger(server)
+        log.start_run("test", "{}")
+
+        with self.assertRaises(KeyError):
+            log.flush()
+        with self.assertRaises(KeyError):
+            log.add_message("assistant", "lost", 1, 1, datetime.timedelta(0))
+
+        closing = threading.Thread(target=log.close)
+        closing.start()
+        closing.join(timeout=5)
+        self.assertFalse(closing.is_alive())
+
+    def test_lost_frames_are_sent_again_after_reconnect(self):
+        server = FakeLogServer(lose_frame=2)
+        log = self.logger(server, batch_interval=0)
+        log.start_run("test", "{}")
+        log.add_message("assistant", "lost", 1, 1, datetime.timedelta(0))
+        log.add_message("assistant", "after reconnect", 1, 1, datetime.timedelta(0))
+        log.flush()
+
+        records = server.records(3)
+        self.assertEqual(server.connections, 2)
+        self.assertEqual([record["data"].get("content") for record in records], [None, "lost", "after reconnect"])
+
+    def test_stored_frames_are_not_stored_again_after_reconnect(self):
+        server = FakeLogServer(close_before_ack=2)
+        log = self.logger(server, batch_interval=0.2)
+        log.start_run("test", "{}")
+        log.add_tool_call(0, "call", "exec_command", "id", "uid=0(root)", datetime.timedelta(0))
+        log.run_was_success()
+        log.add_message("assistant", "after reconnect", 1, 1, datetime.timedelta(0))
+        log.flush()
+
+        records = server.records(5)
+        self.assertEqual(server.connections, 2)
+        self.assertEqual([record["type"] for record in records], ["Run", "ToolCall", "Message", "Run", "Message"])
+        self.assertEqual(records[-1]["data"]["content"], "after reconnect")
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,131 @@
+import re
+import time
+import unittest
+from unittest.mock import MagicMock, patch
+
+from hackingBuddyGPT.utils.psexec.psexec import PSExecConnection
+from hackingBuddyGPT.utils.psexec.shell_session import PSExecShellSession
+
+SENTINEL = re.compile(r"echo\.& echo (\S+) %errorlevel%")
+
+
+class FakeCmdClient:
+    """Simulates `cmd.exe /q` started over PAExec, by answering the lines that are written to its stdin."""
+
+    def __init__(self):
+        self.started = 0
+        self.cwd = "C:\\Windows\\system32"
+
+    def run_executable(self, executable, arguments=None, stdout=None, stderr=None, stdin=None, **kwargs):
+        self.started += 1
+        with patch("pypsexec.pipe.open_pipe"):
+            out = stdout(MagicMock(), "out")
+            err = stderr(MagicMock(), "err")
+
+        rc = 0
+        for data in stdin():
+            for line in data.decode().split("\r\n"):
+                if not line:
+                    continue
+                match = SENTINEL.fullmatch(line)
+                if match:
+                    out.handle_output(f"\r\n{match.group(1)} {rc}\r\n".encode())
+                    continue
+                rc = 0
+                if line == "exit":
+                    return b"", b"", 0
+                elif line == "crash":
+                    raise RuntimeError("STATUS_PIPE_BROKEN")
+                elif line.startswith("sleep "):
+                    time.sleep(float(line.split()[1]))
+                elif line.startswith("cd "):
+                    self.cwd = line[3:]
+                elif line == "cd":
+                    out.handle_output(f"{self.cwd}\r\n".encode())
+                elif line == "fail":
+                    err.handle_output(b"'fail' is not recognized as an internal or external command\r\n")
+                    rc = 1
+                elif line.startswith("echo "):
+                    out.handle_output(f"{line[5:]}\r\n".encode())
+        return b"", b"", rc
+
+
+class TestPSExecShellSession(unittest.TestCase):
+    def setUp(self):
+        self.client = FakeCmdClient()
+        self.session = PSExecShellSession.open(self.client, "cmd", setup_timeout=1)
+
+    def tearDown(self):
+        self.session.close()
+
+    def test_state_survives_between_commands(self):
+        self.assertEqual(self.session.run("cd C:\\Users", 1), ("", 0))
+        self.assertEqual(self.session.run("cd", 1), ("C:\\Users\r\n", 0))
+        self.assertEqual(self.client.started, 1)
+
+    def test_exit_code_and_stderr(self):
+        output, exit_code = self.session.run("fail", 1)
+        self.assertEqual(exit_code, 1)
+        self.assertIn("is not recognized", output)
+
+    def test_streams_output(self):
+        received = []
+        output, exit_code = self.session.run("echo hello", 1, on_output=received.append)
+        self.assertEqual((output, exit_code), ("hello\r\n", 0))
+        self.assertEqual("".join(received), output)
+
+    def test_timeout_waits_for_previous_command(self):
+        self.assertEqual(self.session.run("sleep 0.5", 0.1), ("", None))
+        output, exit_code = self.session.run("echo next", 0.1)
+        self.assertIsNone(exit_code)
+        self.assertIn("still running", output)
+
+        time.sleep(0.5)
+        self.assertEqual(self.session.run("echo next", 1), ("next\r\n", 0))
+
+    def test_process_ended(self):
+        output, exit_code = self.session.run("crash", 1)
+        self.assertIsNone(exit_code)
+        self.assertIn("the shell is gone: STATUS_PIPE_BROKEN", output)
+        self.assertTrue(self.session.closed)
+
+    def test_close_ends_process(self):
+        self.session.close()
+        self.assertTrue(self.session.closed)
+        self.assertIsNone(self.session.error)
+
+
+@patch("hackingBuddyGPT.utils.psexec.psexec.Client")
+class TestPSExecConnection(unittest.TestCase):
+    def test_service_is_shared_and_removed_by_last_connection(self, client):
+        conn = PSExecConnection(host="10.0.0.1", hostname="win", username="admin", password="secret")
+        conn.init()
+        other = conn.new_with(username="other", password="other")
+        other.init()
+        self.assertEqual(client.return_value.create_service.call_count, 1)
+
+        other.close()
+        client.return_value.remove_service.assert_not_called()
+        conn.close()
+        self.assertEqual(client.return_value.remove_service.call_count, 1)
+        self.assertEqual(client.return_value.disconnect.call_count, 2)
+
+    def test_failed_service_install_disconnects(self, client):
+        client.return_value.create_service.side_effect = RuntimeError("access denied")
+        conn = PSExecConnection(host="10.0.0.2", hostname="win", username="lowpriv", password="secret")
+        with self.assertRaises(RuntimeError):
+            conn.init()
+        client.return_value.disconnect.assert_called_once()
+        conn.close()
+
+    def test_run_uses_configured_timeout(self, client):
+        client.return_value.run_executable.return_value = (b"ok", b"", 0)
+        conn = PSExecConnection(host="10.0.0.3", hostname="win", username="admin", password="secret", timeout=30)
+        conn.init()
+        conn.run("whoami")
+        client.return_value.run_executable.assert_called_once_with("cmd.exe", arguments="/c whoami", timeout_seconds=30)
+        conn.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,324 @@
+import asyncio
+import json
+import threading
+import time
+import unittest
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from hackingBuddyGPT.utils.llm_util import LLM, LLMResult
+from hackingBuddyGPT.utils.openai.openai_lib import OpenAILib
+from hackingBuddyGPT.utils.openai.openai_llm import OpenAIConnection
+from hackingBuddyGPT.utils.rate_limit import (
+    RateLimitedLLM,
+    RateLimiter,
+    RateLimitError,
+    RateLimitHeaders,
+    TransientError,
+    parse_duration,
+)
+
+
+class RateLimitingHandler(BaseHTTPRequestHandler):
+    """Answers the first `limited` requests with a 429, the following ones with a chat completion."""
+
+    protocol_version = "HTTP/1.1"
+    limited = 0
+    requests = 0
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        RateLimitingHandler.requests += 1
+        if RateLimitingHandler.requests <= RateLimitingHandler.limited:
+            self.send_response(429)
+            self.send_header("Retry-After", "0.05")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body = json.dumps({
+            "choices": [{"message": {"content": "exec_command id"}}],
+            "usage": {"prompt_tokens": 3, "completion_tokens": 2},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("x-ratelimit-limit-requests", "500")
+        self.send_header("x-ratelimit-remaining-requests", "499")
+        self.send_header("x-ratelimit-reset-requests", "120ms")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StatusCodeError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = None
+
+
+class FailingLLM(LLM):
+    model = "fake_model"
+
+    def __init__(self, errors: list[Exception]):
+        self.errors = errors
+        self.calls = 0
+
+    def get_response(self, prompt, *, capabilities=None, **kwargs) -> LLMResult:
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return LLMResult(result="ok", prompt=prompt, answer="ok", tokens_query=1, tokens_response=1)
+
+    def encode(self, query) -> list[int]:
+        return [0] * len(query)
+
+
+class TestRateLimitHeaders(unittest.TestCase):
+    def test_parse_duration(self):
+        self.assertEqual(parse_duration("1.5"), 1.5)
+        self.assertEqual(parse_duration("6m0s"), 360)
+        self.assertEqual(parse_duration("20ms"), 0.02)
+        self.assertEqual(parse_duration("1h2m3.5s"), 3723.5)
+        self.assertIsNone(parse_duration("soon"))
+        self.assertIsNone(parse_duration(None))
+
+    def test_openai_headers(self):
+        headers = RateLimitHeaders.parse({
+            "Retry-After": "2",
+            "X-RateLimit-Limit-Requests": "60",
+            "X-RateLimit-Remaining-Requests": "59",
+            "X-RateLimit-Reset-Requests": "1s",
+            "X-RateLimit-Limit-Tokens": "150000",
+            "X-RateLimit-Remaining-Tokens": "149984",
+            "X-RateLimit-Reset-Tokens": "6ms",
+        })
+        self.assertEqual(headers, RateLimitHeaders(2, 60, 59, 1, 150000, 149984, 0.006))
+
+    def test_retry_after(self):
+        self.assertEqual(RateLimitHeaders.parse({"retry-after-ms": "250", "retry-after": "1"}).retry_after, 0.25)
+        retry_after = RateLimitHeaders.parse({"retry-after": formatdate(time.time() + 30, usegmt=True)}).retry_after
+        self.assertAlmostEqual(retry_after, 30, delta=2)
+        self.assertIsNone(RateLimitHeaders.parse({}).retry_after)
+
+
+class TestRateLimiter(unittest.TestCase):
+    def test_requests_per_minute(self):
+        limiter = RateLimiter(requests_per_minute=600)
+        # the endpoint reports that the bucket is empty, it refills at 10 requests per second
+        limiter.update(RateLimitHeaders(remaining_requests=0))
+
+        tic = time.monotonic()
+        limiter.acquire()
+        self.assertGreaterEqual(time.monotonic() - tic, 0.08)
+        limiter.release(succeeded=True)
+
+    def test_tokens_are_learned_from_headers_and_corrected(self):
+        limiter = RateLimiter()
+        self.assertFalse(limiter.limits_tokens)
+        limiter.update(RateLimitHeaders(limit_tokens=6000, remaining_tokens=6000))
+        self.assertTrue(limiter.limits_tokens)
+
+        # 100 tokens were estimated, but 5900 were used, so at 100 tokens per second the next 1000 take ~9s
+        limiter.acquire(100)
+        limiter.release(100, tokens_used=5900, succeeded=True)
+        self.assertAlmostEqual(limiter._tokens.delay(1000, time.monotonic()), 9, delta=0.5)
+
+    def test_aimd_concurrency(self):
+        limiter = RateLimiter(max_concurrency=8)
+        for _ in range(4):
+            limiter.acquire()
+            limiter.release(rate_limited=True)
+        self.assertEqual(limiter.concurrency, 1)
+        self.assertEqual(limiter.rate_limited, 4)
+
+        for _ in range(3):
+            limiter.acquire()
+            limiter.release(succeeded=True)
+        self.assertGreater(limiter.concurrency, 2)
+        self.assertLess(limiter.concurrency, 8)
+
+        for _ in range(100):
+            limiter.acquire()
+            limiter.release(succeeded=True)
+        self.assertEqual(limiter.concurrency, 8)
+
+    def test_max_concurrency(self):
+        limiter = RateLimiter(max_concurrency=2)
+        lock = threading.Lock()
+        running = []
+        maximum = [0]
+
+        def request():
+            with lock:
+                running.append(1)
+                maximum[0] = max(maximum[0], len(running))
+            time.sleep(0.02)
+            with lock:
+                running.pop()
+
+        threads = [threading.Thread(target=limiter.call, args=(request,)) for _ in range(6)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(maximum[0], 2)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_retries_with_backoff(self):
+        delays = []
+        limiter = RateLimiter(retries=3, backoff_base=1, backoff_max=4, sleep=delays.append)
+        errors = [RateLimitError("limited", retry_after=0.1), TransientError("timeout"), TransientError("timeout")]
+
+        def request():
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        self.assertEqual(limiter.call(request), "ok")
+        self.assertEqual(len(delays), 3)
+        self.assertTrue(0.1 <= delays[0] <= 1.1)
+        self.assertTrue(1 <= delays[1] <= 2)
+        self.assertTrue(2 <= delays[2] <= 4)
+
+    def test_retries_are_used_up(self):
+        limiter = RateLimiter(retries=2, sleep=lambda delay: None)
+        calls = []
+
+        def request():
+            calls.append(1)
+            raise RateLimitError("limited")
+
+        with self.assertRaises(RateLimitError):
+            limiter.call(request)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(limiter.in_flight, 0)
+
+        # callers that share the limiter can have their own number of retries
+        with self.assertRaises(RateLimitError):
+            limiter.call(request, retries=0)
+        self.assertEqual(len(calls), 4)
+
+    def test_async_call(self):
+        limiter = RateLimiter(backoff_base=0.01)
+        errors = [RateLimitError("limited"), TransientError("timeout")]
+
+        async def request():
+            if errors:
+                raise errors.pop(0)
+            return "ok"
+
+        self.assertEqual(asyncio.run(limiter.acall(request)), "ok")
+        self.assertEqual((limiter.rate_limited, limiter.in_flight), (1, 0))
+
+    def test_cancelled_async_call_does_not_keep_its_slot(self):
+        limiter = RateLimiter(max_concurrency=1)
+
+        async def request():
+            return "ok"
+
+        async def main():
+            limiter.acquire()
+            waiting = asyncio.create_task(limiter.acall(request))
+            await asyncio.sleep(0.1)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            limiter.release()
+            return await limiter.acall(request)
+
+        self.assertEqual(asyncio.run(main()), "ok")
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_other_errors_are_not_retried(self):
+        limiter = RateLimiter(sleep=lambda delay: None)
+        llm = FailingLLM([ValueError("broken")])
+        with self.assertRaises(ValueError):
+            RateLimitedLLM(llm, limiter).get_response("id")
+        self.assertEqual(llm.calls, 1)
+        self.assertEqual(limiter.in_flight, 0)
+
+    def test_wrapped_llm_status_code_429(self):
+        limiter = RateLimiter(sleep=lambda delay: None)
+        llm = FailingLLM([StatusCodeError(429), StatusCodeError(429)])
+        wrapped = RateLimitedLLM(llm, limiter)
+
+        self.assertEqual(wrapped.get_response("id").result, "ok")
+        self.assertEqual(llm.calls, 3)
+        self.assertEqual(limiter.rate_limited, 2)
+        self.assertEqual(wrapped.model, "fake_model")
+
+
+class TestOpenAIConnectionRateLimits(unittest.TestCase):
+    def setUp(self):
+        RateLimitingHandler.requests = 0
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), RateLimitingHandler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def connection(self, limiter: RateLimiter, **kwargs) -> OpenAIConnection:
+        return OpenAIConnection(api_key="", model="gpt-3.5-turbo", context_size=4096, api_url=self.url, _rate_limiter=limiter, **kwargs)
+
+    def test_retry_after_429(self):
+        RateLimitingHandler.limited = 2
+        delays = []
+        limiter = RateLimiter(backoff_base=0.01, sleep=delays.append)
+
+        result = self.connection(limiter).get_response("hello")
+
+        self.assertEqual(result.result, "exec_command id")
+        self.assertEqual(RateLimitingHandler.requests, 3)
+        self.assertEqual(limiter.rate_limited, 2)
+        self.assertTrue(all(delay >= 0.05 for delay in delays))
+        # the limit that was reported with the successful response was taken over
+        self.assertEqual(limiter._requests.capacity, 500)
+
+    def test_gives_up_after_retries(self):
+        RateLimitingHandler.limited = 10
+        limiter = RateLimiter(sleep=lambda delay: None)
+
+        with self.assertRaises(RateLimitError):
+            self.connection(limiter, api_retries=1).get_response("hello")
+        self.assertEqual(RateLimitingHandler.requests, 2)
+
+        # a connection that shares the limiter keeps its own number of retries
+        with self.assertRaises(RateLimitError):
+            self.connection(limiter, api_retries=0).get_response("hello")
+        self.assertEqual(RateLimitingHandler.requests, 3)
+
+    def openai_lib(self, limiter: RateLimiter) -> OpenAILib:
+        llm = OpenAILib(api_key="-", model="gpt-3.5-turbo", context_size=4096, api_url=f"{self.url}/v1", _rate_limiter=limiter)
+        llm.init()
+        return llm
+
+    def test_openai_lib_goes_through_the_rate_limiter(self):
+        RateLimitingHandler.limited = 2
+        limiter = RateLimiter(backoff_base=0.01)
+
+        result = self.openai_lib(limiter).get_response([{"role": "user", "content": "hello"}])
+
+        self.assertEqual(result.answer, "exec_command id")
+        self.assertEqual(RateLimitingHandler.requests, 3)
+        self.assertEqual(limiter.rate_limited, 2)
+
+    def test_openai_lib_async(self):
+        RateLimitingHandler.limited = 1
+        limiter = RateLimiter(backoff_base=0.01)
+
+        result = asyncio.run(self.openai_lib(limiter).aget_response([{"role": "user", "content": "hello"}]))
+
+        self.assertEqual(result.answer, "exec_command id")
+        self.assertEqual(RateLimitingHandler.requests, 2)
+        self.assertEqual(limiter.rate_limited, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
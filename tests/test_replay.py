@@ -0,0 +1,171 @@
+import datetime
+import os
+import tempfile
+import unittest
+
+from hackingBuddyGPT.usecases.viewer import ControlMessage, MessageType, Replayer, ReplayMessage
+from hackingBuddyGPT.utils.db_storage.db_storage import Message, Run, ToolCall
+from hackingBuddyGPT.utils.replay import IndexEntry, ReplayFile, ReplayWriter, index_path, read_index
+
+START = 1_700_000_000.0
+
+
+def run_record(at: float, stopped: bool = False) -> ControlMessage:
+    stopped_at = datetime.datetime.fromtimestamp(at) if stopped else None
+    return ControlMessage(MessageType.RUN, Run(7, "gpt-4o-mini", "success" if stopped else "in progress", "replay", datetime.datetime.fromtimestamp(START), stopped_at, "{}"))
+
+
+def message_record(id: int, content: str = "exec_command id") -> ControlMessage:
+    return ControlMessage(MessageType.MESSAGE, Message(7, id, 0, "main", "assistant", content, datetime.timedelta(seconds=1), 1, 1))
+
+
+def tool_call_record(message_id: int) -> ControlMessage:
+    return ControlMessage(MessageType.TOOL_CALL, ToolCall(7, message_id, "call", 0, "exec_command", "id", "uid=0(root)", "", datetime.timedelta(seconds=1)))
+
+
+def write(writer: ReplayWriter, at: float, message: ControlMessage):
+    message_id = message.data.id if message.type == MessageType.MESSAGE else None
+    writer.write(7, at, ReplayMessage(datetime.datetime.fromtimestamp(at), message).to_json(), message_id)
+
+
+def record_recording(directory: str, messages: int = 10, **kwargs) -> str:
+    """A run with a message and a tool call per second (the message is updated once while streamed)."""
+    writer = ReplayWriter(directory, **kwargs)
+    write(writer, START, run_record(START))
+    for id in range(messages):
+        write(writer, START + id + 0.1, message_record(id, ""))
+        write(writer, START + id + 0.2, message_record(id))
+        write(writer, START + id + 0.3, tool_call_record(id))
+    write(writer, START + messages, run_record(START + messages, stopped=True))
+    writer.close()
+    return writer.path(7)
+
+
+class TestReplayWriter(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_index_points_to_first_line_of_every_message(self):
+        path = record_recording(self.tmpdir.name, index_interval=60)
+
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        offsets = [sum(len(line) for line in lines[:i]) for i in range(len(lines))]
+        self.assertEqual(read_index(index_path(path)), [IndexEntry(0, START)] + [
+            IndexEntry(offsets[1 + 3 * id], START + id + 0.1, id) for id in range(10)
+        ])
+
+    def test_recordings_are_reopened_and_their_index_continued(self):
+        writer = ReplayWriter(self.tmpdir.name, index_interval=60, max_open_files=1)
+        write(writer, START, run_record(START))
+        write(writer, START + 0.1, message_record(0))
+        # opening the recording of another run closes the first one
+        writer.write(8, START, "{}")
+        self.assertEqual(list(writer._recordings), [8])
+        write(writer, START + 0.2, message_record(0))
+        write(writer, START + 1.1, message_record(1))
+        writer.close()
+
+        replay = ReplayFile(writer.path(7))
+        self.assertEqual([entry.message_id for entry in replay.index], [None, 0, 1])
+        self.assertEqual([record["message"]["data"]["id"] for _offset, record in replay.records(replay.offset_of_message(1))], [1])
+
+    def test_sync(self):
+        writer = ReplayWriter(self.tmpdir.name, fsync_interval=60)
+        write(writer, START, run_record(START))
+        self.assertTrue(writer._recordings[7].dirty)
+        writer.sync()
+        self.assertFalse(writer._recordings[7].dirty)
+        writer.close_run(7)
+        self.assertEqual(writer._recordings, {})
+        writer.close()
+
+
+class TestReplayFile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = record_recording(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_seek(self):
+        replay = ReplayFile(self.path)
+        _offset, record = next(replay.records(replay.offset_of_message(9)))
+        self.assertEqual((record["message"]["data"]["id"], record["message"]["data"]["content"]), (9, ""))
+        self.assertIsNone(replay.offset_of_message(10))
+
+        _offset, record = next(replay.records(replay.offset_at(START + 4.5)))
+        self.assertEqual((record["at"], record["message"]["data"]["id"]), (START + 4.2, 4))
+        self.assertEqual(replay.offset_at(START - 1), 0)
+
+    def test_index_is_built_for_recordings_without_one(self):
+        expected = read_index(index_path(self.path))
+        os.remove(index_path(self.path))
+
+        self.assertEqual(ReplayFile(self.path).index, expected)
+        self.assertEqual(read_index(index_path(self.path)), expected)
+
+    def test_incomplete_last_line_is_ignored(self):
+        with open(self.path, "a") as f:
+            f.write('{"at": ')
+        self.assertEqual(len(list(ReplayFile(self.path).records())), 32)
+
+
+class FakeRemoteLogger:
+    def __init__(self):
+        self.run = None
+        self.sent = []
+
+    def start_run(self, name: str, configuration: str, tag=None, start_time=None):
+        self.run = Run(42, name, "in progress", tag, start_time, None, configuration)
+
+    def send(self, type: MessageType, data):
+        self.sent.append((type, data))
+
+
+class TestReplayer(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = record_recording(self.tmpdir.name)
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def replay(self, **kwargs) -> FakeRemoteLogger:
+        log = FakeRemoteLogger()
+        Replayer(log=log, replay_file=self.path, playback_speed=1000, **kwargs).run()
+        self.assertEqual((log.run.model, log.run.tag, log.run.configuration), ("gpt-4o-mini", "replay", "{}"))
+        self.assertTrue(all((data.id if isinstance(data, Run) else data.run_id) == 42 for _type, data in log.sent))
+        return log
+
+    def test_whole_recording(self):
+        log = self.replay()
+        self.assertEqual(len(log.sent), 32)
+        self.assertEqual(log.sent[-1][1].state, "success")
+
+    def test_start_at_message(self):
+        log = self.replay(start_at_message=8)
+        self.assertEqual([(type.value, data.message_id if type == MessageType.TOOL_CALL else data.id) for type, data in log.sent[:3]], [
+            ("Message", 8), ("Message", 8), ("ToolCall", 8),
+        ])
+        self.assertEqual(len(log.sent), 7)
+
+    def test_start_at_time(self):
+        log = self.replay(start_at=9.15)
+        self.assertEqual([type for type, _data in log.sent], [MessageType.MESSAGE, MessageType.TOOL_CALL, MessageType.RUN])
+
+    def test_fast_forward(self):
+        log = self.replay(start_at_message=8, fast_forward=True)
+        self.assertEqual(len(log.sent), 32)
+
+    def test_unknown_message(self):
+        with self.assertRaises(ValueError):
+            self.replay(start_at_message=100)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,172 @@
+import threading
+import time
+import unittest
+
+import paramiko
+
+from hackingBuddyGPT.capabilities import SSHTestCredential
+from hackingBuddyGPT.utils import SSHConnection
+from hackingBuddyGPT.utils.ssh_connection.pool import SSHAuthenticationError, SSHConnectionError, SSHConnectionPool
+
+
+class FakeConnection:
+    def __init__(self, username: str):
+        self.username = username
+        self.is_connected = True
+        self.commands = []
+
+    def run(self, cmd, *args, **kwargs):
+        self.commands.append(cmd)
+        return FakeResult(self.username + "\n")
+
+    def close(self):
+        self.is_connected = False
+
+
+class FakeResult:
+    def __init__(self, stdout: str):
+        self.stdout = stdout
+        self.stderr = ""
+        self.return_code = 0
+
+
+class FakeServer:
+    def __init__(self, passwords: dict[str, str], failures: int = 0, delay: float = 0):
+        self.passwords = passwords
+        self.failures = failures
+        self.delay = delay
+        self.connects = 0
+
+    def connect(self, host, port, username, password, keyfilename):
+        self.connects += 1
+        time.sleep(self.delay)
+        if self.failures > 0:
+            self.failures -= 1
+            raise paramiko.SSHException("Error reading SSH protocol banner")
+        if self.passwords.get(username) != password:
+            raise paramiko.AuthenticationException("Authentication failed.")
+        return FakeConnection(username)
+
+
+class TestSSHConnectionPool(unittest.TestCase):
+    def test_connections_are_reused_per_credentials(self):
+        server = FakeServer({"lowpriv": "secret", "root": "toor"})
+        pool = SSHConnectionPool(connect=server.connect)
+
+        first = pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None)
+        self.assertIs(pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None), first)
+        self.assertIsNot(pool.acquire("10.0.0.1", 22, "root", "toor", None), first)
+        self.assertEqual((server.connects, len(pool)), (2, 2))
+
+    def test_closed_connections_are_reopened(self):
+        server = FakeServer({"lowpriv": "secret"})
+        pool = SSHConnectionPool(connect=server.connect)
+
+        pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None).close()
+        self.assertTrue(pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None).is_connected)
+        self.assertEqual(server.connects, 2)
+
+    def test_idle_connections_are_reaped(self):
+        server = FakeServer({"lowpriv": "secret", "root": "toor"})
+        pool = SSHConnectionPool(idle_timeout=0.05, connect=server.connect)
+
+        idle = pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None)
+        pool.release(idle)
+        pinned = pool.acquire("10.0.0.1", 22, "root", "toor", None, pin=True)
+        pool.release(pinned)
+        time.sleep(0.1)
+
+        self.assertEqual(pool.reap(), 1)
+        self.assertFalse(idle.is_connected)
+        self.assertTrue(pinned.is_connected)
+
+    def test_connections_are_reaped_on_release_but_not_while_in_use(self):
+        server = FakeServer({"lowpriv": "secret", "root": "toor"})
+        pool = SSHConnectionPool(idle_timeout=0.05, connect=server.connect)
+
+        idle = pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None)
+        pool.release(idle)
+        in_use = pool.acquire("10.0.0.1", 22, "root", "toor", None)
+        time.sleep(0.1)
+
+        self.assertEqual(pool.reap(), 1)
+        self.assertFalse(idle.is_connected)
+        self.assertTrue(in_use.is_connected)
+        pool.release(in_use)
+        self.assertTrue(in_use.is_connected)
+        time.sleep(0.1)
+        # releasing any connection closes the ones that are idle by now
+        other = pool.acquire("10.0.0.2", 22, "lowpriv", "secret", None)
+        pool.release(other)
+        self.assertFalse(in_use.is_connected)
+        self.assertEqual(len(pool), 1)
+
+    def test_connection_errors(self):
+        server = FakeServer({"lowpriv": "secret"}, failures=2)
+        pool = SSHConnectionPool(connect_attempts=3, connect=server.connect)
+        pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None)
+        self.assertEqual(server.connects, 3)
+
+        with self.assertRaises(SSHAuthenticationError) as e:
+            pool.acquire("10.0.0.1", 22, "lowpriv", "wrong", None)
+        self.assertEqual((e.exception.username, e.exception.attempts), ("lowpriv", 1))
+
+        server.failures = 5
+        with self.assertRaises(SSHConnectionError) as e:
+            pool.acquire("10.0.0.1", 22, "root", "toor", None)
+        self.assertEqual(e.exception.attempts, 3)
+        self.assertIn("banner", e.exception.reason)
+
+    def test_concurrent_acquire_connects_once(self):
+        server = FakeServer({"lowpriv": "secret"}, delay=0.05)
+        pool = SSHConnectionPool(connect=server.connect)
+
+        connections = []
+        threads = [threading.Thread(target=lambda: connections.append(pool.acquire("10.0.0.1", 22, "lowpriv", "secret", None))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(server.connects, 1)
+        self.assertEqual(len({id(c) for c in connections}), 1)
+        self.assertEqual(pool._connect_locks, {})
+
+    def test_connect_locks_are_dropped(self):
+        server = FakeServer({"lowpriv": "secret"})
+        pool = SSHConnectionPool(connect=server.connect)
+
+        for password in ["wrong", "guess", "secret"]:
+            try:
+                pool.release(pool.acquire("10.0.0.1", 22, "lowpriv", password, None))
+            except SSHAuthenticationError:
+                pass
+        self.assertEqual(pool._connect_locks, {})
+        self.assertEqual(len(pool), 1)
+
+
+class TestSSHTestCredential(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer({"lowpriv": "secret", "root": "toor"})
+        pool = SSHConnectionPool(connect_attempts=2, connect=self.server.connect)
+        self.conn = SSHConnection("10.0.0.1", "victim", "lowpriv", "secret", "", _pool=pool)
+        self.conn.init()
+        self.test_credential = SSHTestCredential(conn=self.conn)
+
+    def test_results(self):
+        self.assertEqual(self.test_credential("root", "toor"), ("Login as root was successful\n", True))
+        self.assertEqual(self.test_credential("lowpriv", "secret"), ("Authentication successful, but user is not root\n", False))
+        self.assertEqual(self.test_credential("root", "wrong"), ("Authentication error, credentials are wrong\n", False))
+        # the connection of the agent itself was reused for the lowpriv credentials
+        self.assertEqual(self.server.connects, 3)
+
+    def test_connection_failure_is_reported(self):
+        self.server.failures = 2
+        result, got_root = self.test_credential("root", "toor")
+
+        self.assertFalse(got_root)
+        self.assertTrue(result.startswith("Could not test the credentials, could not connect to root@10.0.0.1:22 after 2 attempt(s)"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import re
+import shlex
+import socket
+import unittest
+
+from hackingBuddyGPT.capabilities import SSHRunCommand
+from hackingBuddyGPT.utils.ssh_connection.capped_output import CappedOutput
+from hackingBuddyGPT.utils.ssh_connection.shell_session import SSHShellSession
+
+
+class FakeShellChannel:
+    """Emulates a shell on a PTY: prints the scripted output of a command and, if it finishes, the sentinel line."""
+
+    def __init__(self, script: dict[str, tuple[str, bool]], prompt: str = "lowpriv@victim:~$ "):
+        self.script = script
+        self.prompt = prompt
+        self.pending = b""
+        self.commands = []
+        self.closed = False
+
+    def sendall(self, data: bytes):
+        line = data.decode()
+        if line == "\x03":
+            self.commands.append("^C")
+            return
+        command = shlex.split(line[:line.index("; printf")])[1]
+        token = re.search(r"'__HBG_DONE_' '([0-9a-f]+)'", line).group(1)
+        self.commands.append(command)
+        output, finishes = self.script.get(command, ("", True))
+        self.pending += output.encode()
+        if finishes:
+            self.pending += f"\r\n__HBG_DONE_{token} 0\r\n{self.prompt}".encode()
+
+    def settimeout(self, timeout: float):
+        pass
+
+    def recv_ready(self) -> bool:
+        return len(self.pending) > 0
+
+    def recv(self, size: int) -> bytes:
+        if not self.pending:
+            raise socket.timeout()
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+    def close(self):
+        self.closed = True
+
+
+class FakeConnection:
+    username = "lowpriv"
+    password = "secret"
+    hostname = "victim"
+    use_shell_session = True
+
+    def __init__(self, channel: FakeShellChannel):
+        self.session = SSHShellSession(channel, self.username, self.password)
+
+    def shell(self) -> SSHShellSession:
+        return self.session
+
+
+class TestSSHShellSession(unittest.TestCase):
+    def test_output_ends_at_sentinel(self):
+        channel = FakeShellChannel({"id": ("uid=1001(lowpriv)\r\n", True), "cd /tmp": ("", True)})
+        session = SSHShellSession(channel, "lowpriv", "secret")
+
+        self.assertEqual(session.run("cd /tmp", 1), ("", 0))
+        # the prompt after the first command is dropped before the next one is sent
+        self.assertEqual(session.run("id", 1), ("uid=1001(lowpriv)\r\n", 0))
+        self.assertEqual(channel.commands, ["cd /tmp", "id"])
+
+    def test_timeout_interrupts_command(self):
+        channel = FakeShellChannel({"sleep 100": ("", False)})
+        session = SSHShellSession(channel, "lowpriv", "secret")
+
+        self.assertEqual(session.run("sleep 100", 0.1), ("", None))
+        self.assertEqual(channel.commands, ["sleep 100", "^C"])
+
+    def test_output_limit_interrupts_command(self):
+        channel = FakeShellChannel({"cat /dev/urandom": ("x" * 100_000, False)})
+        session = SSHShellSession(channel, "lowpriv", "secret")
+        out = CappedOutput(max_bytes=10_000, keep_bytes=1_000)
+
+        output, exit_code = session.run("cat /dev/urandom", 1, out)
+
+        self.assertIsNone(exit_code)
+        self.assertTrue(out.exceeded)
+        self.assertLess(out.total_bytes, 20_000)
+        head, tail = output.split(f"\n[... {out.total_bytes - 1_000} bytes omitted ...]\n")
+        self.assertEqual((head, tail), ("x" * 500, "x" * 500))
+        self.assertEqual(channel.commands, ["cat /dev/urandom", "^C"])
+
+    def test_root_is_detected_on_live_prompt(self):
+        channel = FakeShellChannel({"sudo su": ("root@victim:/home/lowpriv# ", False), "id": ("uid=1001(lowpriv)\r\n", True)})
+        run_command = SSHRunCommand(conn=FakeConnection(channel), timeout=0.1)
+
+        self.assertEqual(run_command("exec_command id"), ("uid=1001(lowpriv)\r\n", False))
+        self.assertEqual(run_command("exec_command sudo su"), ("root@victim:/home/lowpriv# ", True))
+
+
+if __name__ == "__main__":
+    unittest.main()
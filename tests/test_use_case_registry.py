@@ -0,0 +1,75 @@
+import subprocess
+import sys
+import textwrap
+import unittest
+
+from hackingBuddyGPT.usecases.manifest import USE_CASES
+from hackingBuddyGPT.usecases.registry import discover_use_cases
+
+# cumulative import time (in seconds) that starting a use case may take, the eager imports of all use cases took ~4s
+IMPORT_TIME_BUDGET = 2.5
+
+# dependencies of single use cases, that must not be imported when starting another one
+HEAVY_MODULES = ["fastapi", "uvicorn", "langchain_core", "chromadb", "nltk", "bs4", "instructor"]
+
+
+def import_times(code: str) -> tuple[float, set[str]]:
+    """Runs code under `python -X importtime` and returns the total import time and the imported top-level modules."""
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    total = 0
+    modules = set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _self, cumulative, name = line[len("import time:"):].split("|")
+        if not name.startswith("  "):  # only the top-level imports, the nested ones are part of their cumulative time
+            total += int(cumulative)
+        modules.add(name.strip().split(".")[0])
+    return total / 1e6, modules
+
+
+class TestUseCaseRegistry(unittest.TestCase):
+    def test_manifest_is_up_to_date(self):
+        self.assertEqual(
+            discover_use_cases(),
+            USE_CASES,
+            "the use case manifest is outdated, regenerate it with `python -m hackingBuddyGPT.usecases.registry`",
+        )
+
+    def test_import_time_of_linux_privesc(self):
+        code = textwrap.dedent("""
+            import sys
+            from hackingBuddyGPT.cli.wintermute import main
+            sys.argv = ["wintermute", "LinuxPrivesc", "--help"]
+            try:
+                main()
+            except SystemExit:
+                pass
+        """)
+        total, modules = import_times(code)
+
+        self.assertEqual([module for module in HEAVY_MODULES if module in modules], [])
+        self.assertLess(total, IMPORT_TIME_BUDGET)
+
+    def test_listing_use_cases_imports_none_of_them(self):
+        code = textwrap.dedent("""
+            import sys
+            from hackingBuddyGPT.cli.wintermute import main
+            sys.argv = ["wintermute"]
+            try:
+                main()
+            except SystemExit:
+                pass
+            assert not any(module.startswith("hackingBuddyGPT.usecases.privesc") for module in sys.modules)
+        """)
+        _total, modules = import_times(code)
+        self.assertEqual([module for module in HEAVY_MODULES if module in modules], [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,334 @@
+import datetime
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from websockets.sync.client import connect as ws_connect
+
+from hackingBuddyGPT.usecases.viewer import (
+    Broadcaster,
+    Client,
+    ControlMessage,
+    DbWriter,
+    MessageRequest,
+    MessageType,
+    interleave,
+)
+from hackingBuddyGPT.utils import Console
+from hackingBuddyGPT.utils.db_storage.db_storage import (
+    Message,
+    MessageStreamPart,
+    RawDbStorage,
+    ReadOnlyDbPool,
+    Run,
+    Section,
+    ToolCall,
+)
+from hackingBuddyGPT.utils.logging import RemoteLogger
+from tests.benchmark_viewer_load import load_test, start_viewer
+
+
+class TestReadOnlyDbPool(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = RawDbStorage(os.path.join(self.tmpdir.name, "viewer.sqlite3"), flush_interval=10)
+        self.db.init()
+
+    def tearDown(self):
+        self.db.flush()
+        self.db.db.close()
+        self.tmpdir.cleanup()
+
+    async def test_reads_see_queued_writes(self):
+        pool = ReadOnlyDbPool(self.db, size=2)
+        try:
+            run_id = self.db.create_run("gpt-4o-mini", "test", datetime.datetime.now(), "{}")
+            self.db.add_message(run_id, 0, "main", "assistant", "exec_command id", 10, 1, datetime.timedelta(seconds=1))
+
+            messages = await pool.get_messages_by_run(run_id)
+            self.assertEqual([message.content for message in messages], ["exec_command id"])
+            self.assertEqual([run.id for run in await pool.get_runs()], [run_id])
+        finally:
+            pool.close()
+
+    async def test_readers_are_read_only(self):
+        pool = ReadOnlyDbPool(self.db, size=2)
+        try:
+            with self.assertRaises(sqlite3.OperationalError):
+                await pool.read("create_run", "gpt-4o-mini", "test", datetime.datetime.now(), "{}")
+        finally:
+            pool.close()
+
+    async def test_in_memory_database_is_shared(self):
+        db = RawDbStorage(":memory:")
+        db.init()
+        pool = ReadOnlyDbPool(db)
+        try:
+            run_id = db.create_run("gpt-4o-mini", "test", datetime.datetime.now(), "{}")
+            self.assertEqual([run.id for run in await pool.get_runs()], [run_id])
+        finally:
+            pool.close()
+
+
+class TestDbWriter(unittest.IsolatedAsyncioTestCase):
+    async def test_writes_are_applied_in_order(self):
+        applied = []
+        writer = DbWriter(None)
+        writer.start()
+        futures = [writer.submit(lambda i=i: applied.append(i) or i) for i in range(20)]
+        await writer.flush()
+
+        self.assertEqual(applied, list(range(20)))
+        self.assertEqual([future.result() for future in futures], list(range(20)))
+        await writer.stop()
+
+    async def test_failing_write_does_not_stop_the_writer(self):
+        writer = DbWriter(None)
+        writer.start()
+        failing = writer.submit(lambda: 1 / 0)
+        succeeding = writer.submit(lambda: "ok")
+
+        with self.assertRaises(ZeroDivisionError):
+            await failing
+        self.assertEqual(await succeeding, "ok")
+        await writer.stop()
+
+
+def message(id: int) -> Message:
+    return Message(1, id, 0, "main", "assistant", f"message {id}", datetime.timedelta(seconds=1), 1, 1)
+
+
+def tool_call(message_id: int, id: str) -> ToolCall:
+    return ToolCall(1, message_id, id, 0, "exec_command", "{}", "done", "", datetime.timedelta(seconds=1))
+
+
+def section(id: int, from_message: int) -> Section:
+    return Section(1, id, f"section {id}", from_message, from_message + 1, datetime.timedelta(seconds=1))
+
+
+def describe(records) -> list[str]:
+    return [f"{record.type.value}:{record.data.id}" for record in records]
+
+
+class TestInterleave(unittest.TestCase):
+    def test_sections_before_and_tool_calls_after_their_message(self):
+        records = interleave(
+            [message(0), message(1), message(2)],
+            [tool_call(0, "a"), tool_call(0, "b"), tool_call(2, "c")],
+            [section(0, 0), section(1, 2), section(2, 2)],
+        )
+        self.assertEqual(describe(records), [
+            "Section:0", "Message:0", "ToolCall:a", "ToolCall:b", "Message:1", "Section:1", "Section:2", "Message:2", "ToolCall:c",
+        ])
+
+    def test_records_without_message_are_kept(self):
+        records = interleave([message(0), message(2)], [tool_call(1, "orphan"), tool_call(5, "late")], [section(0, 1), section(1, 7)])
+        self.assertEqual(describe(records), ["Message:0", "Section:0", "ToolCall:orphan", "Message:2", "ToolCall:late", "Section:1"])
+
+
+class RecordingWebSocket:
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, text: str):
+        self.frames.append(json.loads(text))
+
+
+class ViewerDbTestCase(unittest.IsolatedAsyncioTestCase):
+    """A database with a run of 25 messages, each with a tool call, and a section per 5 messages."""
+
+    async def asyncSetUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.db = RawDbStorage(os.path.join(self.tmpdir.name, "viewer.sqlite3"))
+        self.db.init()
+        self.run_id = self.db.create_run("gpt-4o-mini", "test", datetime.datetime.now(), "{}")
+        for message_id in range(25):
+            self.db.add_message(self.run_id, message_id, "main", "assistant", f"message {message_id}", 1, 1, datetime.timedelta(seconds=1))
+            self.db.add_tool_call(self.run_id, message_id, "call", "exec_command", "{}", "", datetime.timedelta(seconds=1))
+            if message_id % 5 == 0:
+                self.db.add_section(self.run_id, message_id // 5, "round", message_id, message_id + 4, datetime.timedelta(seconds=1))
+        self.pool = ReadOnlyDbPool(self.db)
+        self.websocket = RecordingWebSocket()
+        self.client = Client(self.websocket, self.pool, page_size=10)
+
+    async def asyncTearDown(self):
+        self.pool.close()
+        self.db.flush()
+        self.db.db.close()
+        self.tmpdir.cleanup()
+
+
+class TestPagedRuns(ViewerDbTestCase):
+    async def test_run_is_sent_page_by_page(self):
+        records = []
+        from_message = 0
+        while from_message is not None:
+            await self.client.switch_to_run(self.run_id, from_message, 100)
+            batch = self.websocket.frames[-1]
+            self.assertEqual(batch["type"], MessageType.BATCH.value)
+            self.assertLessEqual(sum(record["type"] == "Message" for record in batch["data"]["records"]), 10)
+            records.extend(batch["data"]["records"])
+            from_message = batch["data"]["next_message"]
+
+        self.assertEqual(len(self.websocket.frames), 3)
+        self.assertEqual([record["data"]["id"] for record in records if record["type"] == "Message"], list(range(25)))
+        self.assertEqual([record["data"]["message_id"] for record in records if record["type"] == "ToolCall"], list(range(25)))
+        self.assertEqual([record["data"]["id"] for record in records if record["type"] == "Section"], list(range(5)))
+
+    async def test_pages_of_a_run_that_is_no_longer_followed_are_ignored(self):
+        other_run = self.db.create_run("gpt-4o-mini", "test", datetime.datetime.now(), "{}")
+        await self.client.switch_to_run(self.run_id)
+        await self.client.switch_to_run(other_run)
+        await self.client.switch_to_run(self.run_id, 10)
+
+        self.assertEqual(len(self.websocket.frames), 2)
+        self.assertEqual(self.client.current_run, other_run)
+        self.assertEqual(self.websocket.frames[1]["data"], {"run_id": other_run, "records": [], "next_message": None})
+
+
+class TestViewerLoad(unittest.TestCase):
+    def test_followers_get_all_messages_while_viewers_switch_runs(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            results = load_test(os.path.join(tmpdir, "viewer.sqlite3"), viewers=4, followers=2, ingress=2, messages=20, history=20, history_runs=3)
+
+        self.assertEqual(results.messages_sent, 40)
+        self.assertEqual(results.messages_received, 40)
+        self.assertGreater(results.switches, 0)
+
+
+class TestBroadcaster(ViewerDbTestCase):
+    def live_message(self, run_id: int, id: int) -> ControlMessage:
+        return ControlMessage(MessageType.MESSAGE, Message(run_id, id, 0, "main", "assistant", "live", datetime.timedelta(0), 0, 0))
+
+    async def test_clients_only_get_messages_of_the_run_they_follow(self):
+        broadcaster = Broadcaster()
+        following, other = Client(RecordingWebSocket(), self.pool), Client(RecordingWebSocket(), self.pool)
+        following.current_run = self.run_id
+        broadcaster.add(following)
+        broadcaster.add(other)
+
+        broadcaster.publish(self.live_message(self.run_id, 25))
+        broadcaster.publish(self.live_message(self.run_id + 1, 0))
+        broadcaster.publish(ControlMessage(MessageType.RUN, Run(self.run_id + 1, "gpt-4o-mini", "in progress", "", datetime.datetime.now(), None, "{}")))
+
+        self.assertEqual([message.type for message in following.queue._queue], [MessageType.MESSAGE, MessageType.RUN])
+        self.assertEqual([message.type for message in other.queue._queue], [MessageType.RUN])
+        self.assertEqual(broadcaster.metrics()["queue_depth_total"], 3)
+
+    async def test_slow_client_is_resynchronized(self):
+        broadcaster = Broadcaster()
+        client = Client(RecordingWebSocket(), self.pool, page_size=100, queue_size=3)
+        client.current_run = self.run_id
+        broadcaster.add(client)
+
+        request = ControlMessage(MessageType.MESSAGE_REQUEST, MessageRequest(self.run_id, 10, 5))
+        client.queue.put_nowait(request)
+        run = Run(self.run_id, "gpt-4o-mini", "success", "", datetime.datetime.now(), None, "{}")
+        for message in [self.live_message(self.run_id, 25), self.live_message(self.run_id, 26), ControlMessage(MessageType.RUN, run), self.live_message(self.run_id, 27)]:
+            broadcaster.publish(message)
+
+        metrics = broadcaster.metrics()
+        self.assertEqual((metrics["queue_depth_max"], metrics["dropped"]), (3, 2))
+        self.assertTrue(client.resync_needed)
+
+        await client.resync()
+        self.assertFalse(client.resync_needed)
+        self.assertTrue(client.queue.empty())
+        self.assertEqual(broadcaster.metrics()["resyncs"], 1)
+        # the dropped run, the current run from the database, then the page the client requested
+        frames = client.websocket.frames
+        self.assertEqual([frame["type"] for frame in frames], ["Run", "Batch", "Batch"])
+        self.assertEqual(frames[0]["data"]["state"], "success")
+        self.assertEqual(len([record for record in frames[1]["data"]["records"] if record["type"] == "Message"]), 25)
+        self.assertEqual([record["data"]["id"] for record in frames[2]["data"]["records"] if record["type"] == "Message"], [10, 11, 12, 13, 14])
+
+    async def test_queued_run_updates_survive_a_resync(self):
+        client = Client(RecordingWebSocket(), self.pool, page_size=100, queue_size=2)
+        client.current_run = self.run_id
+        other_run = self.db.create_run("gpt-4o-mini", "test", datetime.datetime.now(), "{}")
+
+        def run_update(run_id: int, state: str) -> ControlMessage:
+            return ControlMessage(MessageType.RUN, Run(run_id, "gpt-4o-mini", state, "", datetime.datetime.now(), None, "{}"))
+
+        client.offer(run_update(other_run, "success"))
+        client.offer(run_update(self.run_id, "in progress"))
+        # dropped, the newer state of the queued run wins
+        client.offer(run_update(self.run_id, "success"))
+        self.assertTrue(client.resync_needed)
+
+        await client.resync()
+        frames = client.websocket.frames
+        self.assertEqual([frame["type"] for frame in frames], ["Run", "Run", "Batch"])
+        self.assertEqual([(frame["data"]["id"], frame["data"]["state"]) for frame in frames[:2]], [(other_run, "success"), (self.run_id, "success")])
+
+
+class TestRemoteLoggerIngress(unittest.TestCase):
+    def test_batched_control_messages_are_stored(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "viewer.sqlite3")
+            process, url = start_viewer(path)
+            try:
+                log = RemoteLogger(console=Console(), log_server_address=url[len("ws://"):], batch_interval=0.5)
+                log.start_run("gpt-4o-mini", "{}")
+                with log.section("round"):
+                    stream = log.stream_message("assistant")
+                    for token in ["exec", "_command", " id"]:
+                        stream.append(token)
+                    stream.finalize(3, 3, datetime.timedelta(seconds=1))
+                    log.add_tool_call(0, "call", "exec_command", "id", "uid=0(root)", datetime.timedelta(seconds=1))
+                log.run_was_success()
+                log.close()
+            finally:
+                process.terminate()
+                process.join()
+
+            db = RawDbStorage(path, write_behind=False)
+            db.init()
+            [run] = db.get_runs()
+            self.assertEqual((run.id, run.state), (log.run.id, "success"))
+            messages = db.get_messages_by_run(run.id)
+            self.assertEqual([message.content for message in messages], ["exec_command id", "Run finished successfully"])
+            self.assertEqual([tool_call.result_text for tool_call in db.get_tool_calls_by_run(run.id)], ["uid=0(root)"])
+            self.assertEqual([(section.name, section.to_message) for section in db.get_sections_by_run(run.id)], [("round", 1)])
+            db.db.close()
+
+    def test_frames_sent_again_are_only_acknowledged(self):
+        def frame(frame_id: str, type: MessageType, data) -> str:
+            return json.dumps({"type": "Batch", "data": {"frame": frame_id, "records": [{"type": type.value, "data": json.loads(data.to_json())}]}})
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, "viewer.sqlite3")
+            process, url = start_viewer(path)
+            try:
+                creation = frame("sender-0", MessageType.RUN, Run(None, "gpt-4o-mini", "in progress", "", datetime.datetime.now(), None, "{}"))
+                acks = []
+                with ws_connect(f"{url}/ingress") as ingress:
+                    ingress.send(creation)
+                    acks.append(json.loads(ingress.recv()))
+                    run_id = acks[0]["data"]["runs"][0]["id"]
+                    ingress.send(frame("sender-1", MessageType.MESSAGE, Message(run_id, 0, 0, "main", "assistant", "exec", datetime.timedelta(0), 1, 1)))
+                    acks.append(json.loads(ingress.recv()))
+                    part = frame("sender-2", MessageType.MESSAGE_STREAM_PART, MessageStreamPart(None, run_id, 0, "append", "_command"))
+                    ingress.send(part)
+                    acks.append(json.loads(ingress.recv()))
+                # as if the acknowledgements of the run creation and the stream part were lost
+                with ws_connect(f"{url}/ingress") as ingress:
+                    for sent in (creation, part):
+                        ingress.send(sent)
+                        acks.append(json.loads(ingress.recv()))
+            finally:
+                process.terminate()
+                process.join()
+
+            self.assertEqual([ack["data"]["frame"] for ack in acks], ["sender-0", "sender-1", "sender-2", "sender-0", "sender-2"])
+            self.assertEqual(acks[3], acks[0])
+            db = RawDbStorage(path, write_behind=False)
+            db.init()
+            self.assertEqual([run.id for run in db.get_runs()], [run_id])
+            self.assertEqual([message.content for message in db.get_messages_by_run(run_id)], ["exec_command"])
+            db.db.close()
+
+if __name__ == "__main__":
+    unittest.main()